@@ -3,25 +3,78 @@ Flask API 服务
 """
 from flask import Flask, request, jsonify, Response, send_from_directory
 from pathlib import Path
+import argparse
 import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from rag_engine import RAGEngine
+from rag_engine import RAGEngine, DEFAULT_PROFILE
+from collection_versions import EngineReloader
 from llm_client import QwenClient
+from formatting import format_similar_cases, format_search_results
+from response_cache import ResponseCache, ReplyCache, document_keys
+from semantic_cache import SemanticCache
+from warmup import WarmupState, preload_engine, start_background_warmup
 
 app = Flask(__name__)
 
 # 全局实例（延迟初始化）
 rag_engine = None
 llm_client = None
+_init_lock = threading.Lock()
+
+# /chat/batch 单个请求的最大生成并发数
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', 4))
+
+# 回复缓存：精确匹配 + 语义近似
+reply_cache = ReplyCache(ResponseCache.from_env(), SemanticCache.from_env())
+
+# 启动预热状态（/readyz）
+warmup_state = WarmupState()
 
 
 def get_rag_engine():
     global rag_engine
     if rag_engine is None:
-        rag_engine = RAGEngine()
+        with _init_lock:
+            if rag_engine is None:
+                rag_engine = RAGEngine.from_profile(
+                    os.environ.get('RAG_PROFILE', DEFAULT_PROFILE),
+                    backend=os.environ.get('RAG_BACKEND', 'chroma'),
+                    mode=os.environ.get('RAG_MODE', 'dense'),
+                    product_filter=os.environ.get('RAG_PRODUCT_FILTER', '1') != '0',
+                    encoder_backend=os.environ.get('RAG_ENCODER_BACKEND', 'torch'),
+                    encoder_threads=int(os.environ['ENCODER_THREADS']) if os.environ.get('ENCODER_THREADS') else None,
+                    parent_context=os.environ.get('RAG_PARENT_CONTEXT', '0') == '1',
+                    reranker_model=os.environ.get('RERANKER_MODEL') or None,
+                    rerank_candidates=int(os.environ.get('RERANK_CANDIDATES', 50)),
+                    rerank_budget_ms=float(os.environ['RERANK_BUDGET_MS']) if os.environ.get('RERANK_BUDGET_MS') else None,
+                    mmr_lambda=float(os.environ['RAG_MMR_LAMBDA']) if os.environ.get('RAG_MMR_LAMBDA') else None,
+                    mmr_fetch_multiplier=int(os.environ.get('MMR_FETCH_MULTIPLIER', 4)),
+                    embedding_cache=os.environ.get('RAG_EMBEDDING_CACHE', '0') == '1',
+                    embedding_cache_dir=os.environ.get('EMBEDDING_CACHE_DIR') or None
+                )
+    else:
+        engine_reloader.maybe_reload(rag_engine)
     return rag_engine
 
 
+def _swap_rag_engine(engine):
+    global rag_engine
+    rag_engine = engine
+    # 新版本的检索结果和正文可能不同，按旧版本生成的回复和重排分数不再可信
+    # （重排器由新旧引擎共享，清空后旧引擎上仍在处理的请求只会少命中）
+    reply_cache.clear()
+    if engine.reranker is not None:
+        engine.reranker.clear()
+
+
+# 导入脚本切换集合别名后，最多 RAG_RELOAD_INTERVAL 秒内热加载新版本
+engine_reloader = EngineReloader(_swap_rag_engine, interval=float(os.environ.get('RAG_RELOAD_INTERVAL', 5)))
+
+
 def get_llm_client():
     global llm_client
     if llm_client is None:
@@ -29,93 +82,215 @@ def get_llm_client():
     return llm_client
 
 
+def preload_models():
+    """
+    预加载 Embedding 模型和向量库（生产模式下在 master 进程 fork 之前调用）
+
+    只加载权重、不做 encode / 检索（见 warmup.preload_engine），且只试几次，不让磁盘问题长时间阻塞 fork；
+    所有预热阶段由 start_worker_warmup 在各 worker 中进行。
+    """
+    preload_engine(get_rag_engine)
+
+
+def start_worker_warmup():
+    """生产模式：worker fork 后在后台预热全部阶段（dummy encode、检索、Ollama 模型），失败时退避重试直到成功"""
+    start_background_warmup(warmup_state, get_rag_engine, get_llm_client())
+
+
+def start_warmup():
+    """开发模式：后台预热，服务立即可以响应 /healthz"""
+    start_background_warmup(warmup_state, get_rag_engine, get_llm_client())
+
+
 @app.route('/')
 def index():
     """返回前端页面"""
     return send_from_directory('.', 'index.html')
 
 
+def generate_reply(message: str, system_prompt: str, user_query: str,
+                   similar: list[dict], query_embedding, cancel: threading.Event = None) -> tuple[str, dict, dict]:
+    """
+    缓存优先的回复生成：先查回复缓存，都未命中时 LLM 生成（分析 / 话术两个分支并发）；
+    cancel 被置位（客户端已断开）时放弃生成
+
+    Returns:
+        (reply, timings, cache_info)
+    """
+    engine = get_rag_engine()
+    client = get_llm_client()
+    models = [engine.model_name, client.analyst_model, client.sales_model]
+    products = engine.detect_products(message)
+    cache_key, cached, cache_info = reply_cache.lookup(
+        message,
+        document_keys(similar),
+        models,
+        query_embedding,
+        products
+    )
+    if cached is not None:
+        return cached['reply'], {}, cache_info
+
+    reply, timings = client.generate_with_timings(system_prompt, user_query, cancel)
+    timings["llm_ms"] = timings.pop("total_ms")
+    reply_cache.store(cache_key, query_embedding, {"reply": reply}, models, products)
+    return reply, timings, cache_info
+
+
 @app.route('/chat', methods=['POST'])
 def chat():
     """
     聊天接口
 
     请求体:
-        {"message": "客户说价格太贵了怎么办"}
+        {"message": "客户说价格太贵了怎么办", "rerank": true, "mmr_lambda": 0.5}
+        rerank 可选，是否用 cross-encoder 重排候选，不传时按服务配置（RERANKER_MODEL）
+        mmr_lambda 可选，MMR 多样性权重（1.0 只看相关度），不传时按服务配置（RAG_MMR_LAMBDA）
 
     返回:
-        {"reply": "...", "similar_cases": [...]}
+        {"reply": "...", "similar_cases": [...], "timings": {...}, "cache": {...}}
+        重排时 timings 另含 rerank_ms（不计入 retrieval_ms）、rerank_pairs 等
     """
     data = request.json
     message = data.get('message', '')
+    rerank = data.get('rerank')
+    mmr_lambda = data.get('mmr_lambda')
 
     if not message:
         return jsonify({"error": "消息不能为空"}), 400
 
     try:
         # 1. RAG 检索
+        start = time.perf_counter()
         engine = get_rag_engine()
-        system_prompt, user_query, similar = engine.build_prompt(message, k=5)
-
-        # 2. LLM 生成
-        client = get_llm_client()
-        reply = client.generate(system_prompt, user_query)
+        query_embedding = engine.encode_query(message)
+        rerank_timings = {}
+        system_prompt, user_query, similar = engine.build_prompt(
+            message, k=5, query_embedding=query_embedding, rerank=rerank, timings=rerank_timings,
+            mmr_lambda=mmr_lambda)
+        retrieval_ms = round((time.perf_counter() - start) * 1000 - rerank_timings.get("rerank_ms", 0), 1)
+
+        # 2. 查回复缓存（精确 + 语义），未命中时 LLM 生成
+        reply, timings, cache_info = generate_reply(message, system_prompt, user_query, similar, query_embedding)
+        timings["retrieval_ms"] = retrieval_ms
+        timings.update(rerank_timings)
+        timings["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
 
         # 3. 格式化相似案例（带分析）
-        similar_cases = []
-        for item in similar[:3]:  # 只返回前3个
-            meta = item['metadata']
-            content = item['document'].split('内容:')[-1][:200]
-            role = meta['role']
-            analysis = analyze_case(role, content)
-            similar_cases.append({
-                "product": meta['product'],
-                "role": role,
-                "content": content,
-                "analysis": analysis
-            })
+        similar_cases = format_similar_cases(similar)
 
         return jsonify({
             "reply": reply,
-            "similar_cases": similar_cases
+            "similar_cases": similar_cases,
+            "timings": timings,
+            "cache": cache_info
         })
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-def analyze_case(role, content):
-    """根据角色和内容生成简短分析"""
-    content_lower = content.lower()
-
-    if role == 'buyer' or role == '买家':
-        # 分析买家意图
-        if 'discount' in content_lower or '折扣' in content or '优惠' in content or '便宜' in content:
-            return "买家策略: 价格谈判，试探底价空间"
-        elif 'quality' in content_lower or '质量' in content or '品质' in content:
-            return "买家关注: 产品质量，需要建立信任"
-        elif 'competitor' in content_lower or '竞争' in content or '别家' in content or '其他' in content:
-            return "买家策略: 用竞品压价，需强调差异化"
-        elif 'long-term' in content_lower or '长期' in content or '合作' in content:
-            return "买家意图: 以长期合作换取优惠"
-        elif 'urgent' in content_lower or '急' in content or '马上' in content:
-            return "买家状态: 有紧迫需求，成交意向高"
-        else:
-            return "买家诉求: 了解产品/价格信息"
-    else:
-        # 分析卖家策略
-        if 'best offer' in content_lower or '最低' in content or '底价' in content:
-            return "卖家策略: 表明底线，促成成交"
-        elif 'discount' in content_lower or '折扣' in content or '%' in content:
-            return "卖家策略: 适度让步，给出优惠方案"
-        elif 'quality' in content_lower or '质量' in content or '品质' in content:
-            return "卖家策略: 强调价值，转移价格焦点"
-        elif 'long-term' in content_lower or '长期' in content:
-            return "卖家策略: 用长期合作换取当前让步"
-        elif 'confirm' in content_lower or '确认' in content or '下单' in content:
-            return "卖家策略: 推动成交，锁定订单"
-        else:
-            return "卖家策略: 维护关系，保持沟通"
+@app.route('/chat/batch', methods=['POST'])
+def chat_batch():
+    """
+    批量聊天接口（整批回放客户消息）
+
+    请求体:
+        {"messages": ["...", "..."], "max_concurrency": 4, "rerank": true}
+
+    返回:
+        NDJSON 流，每完成一条输出一行（顺序按完成先后，用 index 对应请求）:
+        {"index": 0, "message": "...", "reply": "...", "similar_cases": [...], "timings": {...}, "cache": {...}}
+        {"index": 1, "message": "...", "error": "..."}
+        最后一行为汇总: {"done": true, "count": N, "errors": M, "total_ms": ...}
+
+    所有消息一次批量编码、一次多查询检索，生成阶段按 max_concurrency 并发；
+    单条失败只影响该条。
+    """
+    data = request.json or {}
+    messages = data.get('messages')
+    rerank = data.get('rerank')
+    mmr_lambda = data.get('mmr_lambda')
+
+    if not isinstance(messages, list) or not messages:
+        return jsonify({"error": "messages 必须是非空列表"}), 400
+
+    max_concurrency = data.get('max_concurrency', BATCH_MAX_CONCURRENCY)
+    if isinstance(max_concurrency, bool) or not isinstance(max_concurrency, int) or max_concurrency < 1:
+        return jsonify({"error": "max_concurrency 必须是正整数"}), 400
+    max_concurrency = min(max_concurrency, BATCH_MAX_CONCURRENCY)
+
+    def generate():
+        start = time.perf_counter()
+        errors = 0
+
+        # 空消息直接报错，其余消息进入批量检索
+        valid = [(i, m) for i, m in enumerate(messages) if isinstance(m, str) and m.strip()]
+        for i, m in enumerate(messages):
+            if not (isinstance(m, str) and m.strip()):
+                errors += 1
+                yield json.dumps({"index": i, "message": m, "error": "消息不能为空"}, ensure_ascii=False) + "\n"
+
+        if valid:
+            # 1. 批量编码 + 批量检索（失败时整批记为错误）
+            try:
+                engine = get_rag_engine()
+                texts = [m for _, m in valid]
+                embeddings = engine.encode_queries(texts)
+                rerank_timings = {}
+                prompts = engine.build_prompts(texts, k=5, query_embeddings=embeddings,
+                                               rerank=rerank, timings=rerank_timings, mmr_lambda=mmr_lambda)
+                retrieval_ms = round((time.perf_counter() - start) * 1000 - rerank_timings.get("rerank_ms", 0), 1)
+            except Exception as e:
+                for i, m in valid:
+                    errors += 1
+                    yield json.dumps({"index": i, "message": m, "error": str(e)}, ensure_ascii=False) + "\n"
+                valid = []
+
+        if valid:
+            # 2. 有界并发生成，完成一条输出一条
+            def run_item(pos):
+                index, message = valid[pos]
+                system_prompt, user_query, similar = prompts[pos]
+                reply, timings, cache_info = generate_reply(
+                    message, system_prompt, user_query, similar, embeddings[pos], cancel)
+                timings["retrieval_ms"] = retrieval_ms
+                timings.update(rerank_timings)
+                return {
+                    "index": index,
+                    "message": message,
+                    "reply": reply,
+                    "similar_cases": format_similar_cases(similar),
+                    "timings": timings,
+                    "cache": cache_info
+                }
+
+            # 客户端断开时生成器收到 GeneratorExit：不等排队的调用跑完，排队的直接取消，
+            # 进行中的通过 cancel 放弃等待（同 asgi 版取消任务）
+            cancel = threading.Event()
+            pool = ThreadPoolExecutor(max_workers=min(max_concurrency, len(valid)))
+            try:
+                futures = {pool.submit(run_item, pos): pos for pos in range(len(valid))}
+                for future in as_completed(futures):
+                    try:
+                        line = future.result()
+                    except Exception as e:
+                        index, message = valid[futures[future]]
+                        errors += 1
+                        line = {"index": index, "message": message, "error": str(e)}
+                    yield json.dumps(line, ensure_ascii=False) + "\n"
+            finally:
+                cancel.set()
+                pool.shutdown(wait=False, cancel_futures=True)
+
+        yield json.dumps({
+            "done": True,
+            "count": len(messages),
+            "errors": errors,
+            "total_ms": round((time.perf_counter() - start) * 1000, 1)
+        }) + "\n"
+
+    return Response(generate(), mimetype='application/x-ndjson')
 
 
 @app.route('/chat/stream', methods=['POST'])
@@ -127,7 +302,10 @@ def chat_stream():
         {"message": "客户说价格太贵了怎么办"}
 
     返回:
-        Server-Sent Events 流
+        Server-Sent Events 流，事件类型:
+        - cases: 相似案例
+        - chunk: 增量文本，section 为 product / sales / analysis / price
+        - done / error
     """
     data = request.json
     message = data.get('message', '')
@@ -139,36 +317,29 @@ def chat_stream():
         try:
             # 1. RAG 检索
             engine = get_rag_engine()
-            system_prompt, user_query, similar = engine.build_prompt(message, k=5)
+            system_prompt, user_query, similar = engine.build_prompt(message, k=5, rerank=data.get('rerank'),
+                                                                     mmr_lambda=data.get('mmr_lambda'))
 
             # 2. 先发送相似案例（带分析）
-            similar_cases = []
-            for item in similar[:3]:
-                meta = item['metadata']
-                content = item['document'].split('内容:')[-1][:200]
-                role = meta['role']
-                analysis = analyze_case(role, content)
-
-                similar_cases.append({
-                    "product": meta['product'],
-                    "role": role,
-                    "content": content,
-                    "analysis": analysis
-                })
+            similar_cases = format_similar_cases(similar)
 
             yield f"data: {json.dumps({'type': 'cases', 'data': similar_cases})}\n\n"
 
-            # 3. 流式生成回复
+            # 3. 流式生成回复（话术 / 分析 token 按分区交错推送）
             client = get_llm_client()
-            for chunk in client.generate_stream(system_prompt, user_query):
-                yield f"data: {json.dumps({'type': 'chunk', 'data': chunk})}\n\n"
+            for section, chunk in client.generate_stream(system_prompt, user_query):
+                yield f"data: {json.dumps({'type': 'chunk', 'section': section, 'data': chunk})}\n\n"
 
             yield f"data: {json.dumps({'type': 'done'})}\n\n"
 
         except Exception as e:
             yield f"data: {json.dumps({'type': 'error', 'data': str(e)})}\n\n"
 
-    return Response(generate(), mimetype='text/event-stream')
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 
 @app.route('/search', methods=['POST'])
@@ -177,7 +348,10 @@ def search():
     仅检索接口（不调用 LLM）
 
     请求体:
-        {"query": "价格", "k": 5}
+        {"query": "价格", "k": 5, "mode": "sparse", "products": ["充电宝"], "mmr_lambda": 0.5}
+        mode 可选 dense / sparse / hybrid，sparse 不跑编码器，延迟最低
+        products 可选，不传时从查询中自动识别产品，传 [] 检索全库
+        mmr_lambda 可选，多取候选后用 MMR 选出 k 个互不重复的案例
 
     返回:
         {"results": [...]}
@@ -185,32 +359,87 @@ def search():
     data = request.json
     query = data.get('query', '')
     k = data.get('k', 5)
+    mode = data.get('mode')
+    products = data.get('products')
+    mmr_lambda = data.get('mmr_lambda')
 
     if not query:
         return jsonify({"error": "查询不能为空"}), 400
 
     try:
         engine = get_rag_engine()
-        results = engine.search(query, k)
-
-        formatted = []
-        for item in results:
-            meta = item['metadata']
-            formatted.append({
-                "product": meta['product'],
-                "role": meta['role'],
-                "round": meta['round'],
-                "content": item['document'].split('内容:')[-1],
-                "distance": item['distance']
-            })
+        results = engine.search(query, k, mode=mode, products=products, mmr_lambda=mmr_lambda)
 
-        return jsonify({"results": formatted})
+        return jsonify({"results": format_search_results(results)})
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """存活探测：进程能响应即可"""
+    return jsonify({"status": "ok"})
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """就绪探测：所有预热阶段完成后返回 200，否则 503"""
+    ready = warmup_state.ready()
+    return jsonify({
+        "status": "ready" if ready else "warming",
+        "stages": warmup_state.snapshot()
+    }), 200 if ready else 503
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """运行统计（连接池复用等）"""
+    return jsonify({
+        "llm_transport": get_llm_client().transport.stats(),
+        "response_cache": reply_cache.exact.stats(),
+        "semantic_cache": reply_cache.semantic.stats(),
+        "query_embedding_cache": rag_engine.query_cache.stats() if rag_engine is not None else None,
+        "embedding_cache": rag_engine.embedding_cache.stats() if rag_engine is not None and rag_engine.embedding_cache else None,
+        "reranker": rag_engine.reranker.stats() if rag_engine is not None and rag_engine.reranker else None,
+        "collection": engine_reloader.stats(rag_engine) if rag_engine is not None else None
+    })
+
+
+def run_production(bind: str = None, workers: int = None, threads: int = None):
+    """以 gunicorn 多进程模式启动（配置见 gunicorn.conf.py）"""
+    from gunicorn.app.base import Application
+
+    class StandaloneApplication(Application):
+        def init(self, parser, opts, args):
+            pass
+
+        def load_config(self):
+            self.load_config_from_file(str(Path(__file__).parent / 'gunicorn.conf.py'))
+            for key, value in (('bind', bind), ('workers', workers), ('threads', threads)):
+                if value is not None:
+                    self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    StandaloneApplication().run()
+
+
 if __name__ == '__main__':
-    print("启动客服辅助系统...")
-    print("访问 http://localhost:5001")
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    parser = argparse.ArgumentParser(description="客服辅助系统")
+    parser.add_argument('--prod', action='store_true', help="生产模式（gunicorn 多进程）")
+    parser.add_argument('--bind', help="监听地址，如 0.0.0.0:5001")
+    parser.add_argument('--workers', type=int, help="worker 进程数")
+    parser.add_argument('--threads', type=int, help="每个 worker 的线程数")
+    args = parser.parse_args()
+
+    if args.prod:
+        run_production(args.bind, args.workers, args.threads)
+    else:
+        print("启动客服辅助系统...")
+        print("访问 http://localhost:5001")
+        # debug 重载器会启动两个进程，只在实际服务的子进程中预热
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_warmup()
+        app.run(host='0.0.0.0', port=5001, debug=True)
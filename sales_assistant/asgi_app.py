@@ -0,0 +1,383 @@
+"""
+ASGI API 服务（异步版）
+
+与 app.py 接口一致：/chat、/chat/stream、/search。
+- LLM 调用走 AsyncDualModelClient，等待期间不占线程
+- Embedding / Chroma 是同步 CPU 计算，放到有界线程池执行
+
+启动:
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5001
+"""
+import asyncio
+import functools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from starlette.applications import Starlette
+from starlette.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from rag_engine import RAGEngine, DEFAULT_PROFILE
+from collection_versions import EngineReloader
+from async_llm_client import AsyncDualModelClient
+from llm_client import DualModelClient
+from formatting import format_similar_cases, format_search_results
+from response_cache import ResponseCache, ReplyCache, document_keys
+from semantic_cache import SemanticCache
+from warmup import WarmupState, start_background_warmup
+
+# 检索线程池：Embedding 计算受 CPU 限制，线程数不宜过多
+rag_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rag")
+
+# 全局实例（延迟初始化）
+rag_engine = None
+llm_client = None
+reply_cache = ReplyCache(ResponseCache.from_env(), SemanticCache.from_env())
+warmup_state = WarmupState()
+
+# /chat/batch 单个请求的最大生成并发数
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', 4))
+_engine_lock = threading.Lock()
+
+
+async def run_in_rag_pool(func, *args, **kwargs):
+    """在检索线程池中执行同步函数"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(rag_executor, functools.partial(func, *args, **kwargs))
+
+
+def load_rag_engine():
+    """同步加载检索引擎（线程池 / 预热线程共用）"""
+    global rag_engine
+    if rag_engine is None:
+        with _engine_lock:
+            if rag_engine is None:
+                rag_engine = RAGEngine.from_profile(
+                    os.environ.get('RAG_PROFILE', DEFAULT_PROFILE),
+                    backend=os.environ.get('RAG_BACKEND', 'chroma'),
+                    mode=os.environ.get('RAG_MODE', 'dense'),
+                    product_filter=os.environ.get('RAG_PRODUCT_FILTER', '1') != '0',
+                    encoder_backend=os.environ.get('RAG_ENCODER_BACKEND', 'torch'),
+                    encoder_threads=int(os.environ['ENCODER_THREADS']) if os.environ.get('ENCODER_THREADS') else None,
+                    parent_context=os.environ.get('RAG_PARENT_CONTEXT', '0') == '1',
+                    reranker_model=os.environ.get('RERANKER_MODEL') or None,
+                    rerank_candidates=int(os.environ.get('RERANK_CANDIDATES', 50)),
+                    rerank_budget_ms=float(os.environ['RERANK_BUDGET_MS']) if os.environ.get('RERANK_BUDGET_MS') else None,
+                    mmr_lambda=float(os.environ['RAG_MMR_LAMBDA']) if os.environ.get('RAG_MMR_LAMBDA') else None,
+                    mmr_fetch_multiplier=int(os.environ.get('MMR_FETCH_MULTIPLIER', 4)),
+                    embedding_cache=os.environ.get('RAG_EMBEDDING_CACHE', '0') == '1',
+                    embedding_cache_dir=os.environ.get('EMBEDDING_CACHE_DIR') or None
+                )
+    return rag_engine
+
+
+def _swap_rag_engine(engine):
+    global rag_engine
+    rag_engine = engine
+    # 新版本的检索结果和正文可能不同，按旧版本生成的回复和重排分数不再可信
+    # （重排器由新旧引擎共享，清空后旧引擎上仍在处理的请求只会少命中）
+    reply_cache.clear()
+    if engine.reranker is not None:
+        engine.reranker.clear()
+
+
+# 导入脚本切换集合别名后，最多 RAG_RELOAD_INTERVAL 秒内热加载新版本
+engine_reloader = EngineReloader(_swap_rag_engine, interval=float(os.environ.get('RAG_RELOAD_INTERVAL', 5)))
+
+
+async def get_rag_engine():
+    if rag_engine is None:
+        return await run_in_rag_pool(load_rag_engine)
+    engine_reloader.maybe_reload(rag_engine)
+    return rag_engine
+
+
+def get_llm_client():
+    global llm_client
+    if llm_client is None:
+        llm_client = AsyncDualModelClient()
+    return llm_client
+
+
+async def read_json(request) -> dict:
+    try:
+        return await request.json()
+    except ValueError:
+        return {}
+
+
+async def index(request):
+    """返回前端页面"""
+    return FileResponse(Path(__file__).parent / 'index.html')
+
+
+async def run_reply_cache(func, *args):
+    """回复缓存操作：配置了磁盘层（RESPONSE_CACHE_DB）时会读写 SQLite，放到检索线程池执行，不阻塞事件循环"""
+    if reply_cache.exact.db_path:
+        return await run_in_rag_pool(func, *args)
+    return func(*args)
+
+
+async def generate_reply(message: str, system_prompt: str, user_query: str,
+                         similar: list[dict], query_embedding) -> tuple[str, dict, dict]:
+    """缓存优先的回复生成（同 app.py generate_reply），返回 (reply, timings, cache_info)"""
+    engine = await get_rag_engine()
+    client = get_llm_client()
+    models = [engine.model_name, client.analyst_model, client.sales_model]
+    products = engine.detect_products(message)
+    cache_key, cached, cache_info = await run_reply_cache(
+        reply_cache.lookup,
+        message,
+        document_keys(similar),
+        models,
+        query_embedding,
+        products
+    )
+    if cached is not None:
+        return cached['reply'], {}, cache_info
+
+    reply, timings = await client.generate_with_timings(system_prompt, user_query)
+    timings["llm_ms"] = timings.pop("total_ms")
+    await run_reply_cache(reply_cache.store, cache_key, query_embedding, {"reply": reply}, models, products)
+    return reply, timings, cache_info
+
+
+async def chat(request):
+    """聊天接口（同 app.py /chat）"""
+    data = await read_json(request)
+    message = data.get('message', '')
+    rerank = data.get('rerank')
+
+    if not message:
+        return JSONResponse({"error": "消息不能为空"}, status_code=400)
+
+    try:
+        # 1. RAG 检索（线程池）
+        start = time.perf_counter()
+        engine = await get_rag_engine()
+        query_embedding = await run_in_rag_pool(engine.encode_query, message)
+        rerank_timings = {}
+        system_prompt, user_query, similar = await run_in_rag_pool(
+            engine.build_prompt, message, 5, query_embedding, rerank=rerank, timings=rerank_timings,
+            mmr_lambda=data.get('mmr_lambda'))
+        retrieval_ms = round((time.perf_counter() - start) * 1000 - rerank_timings.get("rerank_ms", 0), 1)
+
+        # 2. 查回复缓存，未命中时 LLM 生成（协程）
+        reply, timings, cache_info = await generate_reply(message, system_prompt, user_query, similar, query_embedding)
+        timings["retrieval_ms"] = retrieval_ms
+        timings.update(rerank_timings)
+        timings["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+        return JSONResponse({
+            "reply": reply,
+            "similar_cases": format_similar_cases(similar),
+            "timings": timings,
+            "cache": cache_info
+        })
+
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def chat_batch(request):
+    """批量聊天接口（同 app.py /chat/batch），NDJSON 流式返回"""
+    data = await read_json(request)
+    messages = data.get('messages')
+    rerank = data.get('rerank')
+
+    if not isinstance(messages, list) or not messages:
+        return JSONResponse({"error": "messages 必须是非空列表"}, status_code=400)
+
+    max_concurrency = data.get('max_concurrency', BATCH_MAX_CONCURRENCY)
+    if isinstance(max_concurrency, bool) or not isinstance(max_concurrency, int) or max_concurrency < 1:
+        return JSONResponse({"error": "max_concurrency 必须是正整数"}, status_code=400)
+    max_concurrency = min(max_concurrency, BATCH_MAX_CONCURRENCY)
+
+    async def generate():
+        start = time.perf_counter()
+        errors = 0
+
+        valid = [(i, m) for i, m in enumerate(messages) if isinstance(m, str) and m.strip()]
+        for i, m in enumerate(messages):
+            if not (isinstance(m, str) and m.strip()):
+                errors += 1
+                yield json.dumps({"index": i, "message": m, "error": "消息不能为空"}, ensure_ascii=False) + "\n"
+
+        if valid:
+            # 1. 批量编码 + 批量检索（线程池）
+            try:
+                engine = await get_rag_engine()
+                texts = [m for _, m in valid]
+                embeddings = await run_in_rag_pool(engine.encode_queries, texts)
+                rerank_timings = {}
+                prompts = await run_in_rag_pool(engine.build_prompts, texts, 5, embeddings,
+                                                rerank=rerank, timings=rerank_timings,
+                                                mmr_lambda=data.get('mmr_lambda'))
+                retrieval_ms = round((time.perf_counter() - start) * 1000 - rerank_timings.get("rerank_ms", 0), 1)
+            except Exception as e:
+                for i, m in valid:
+                    errors += 1
+                    yield json.dumps({"index": i, "message": m, "error": str(e)}, ensure_ascii=False) + "\n"
+                valid = []
+
+        if valid:
+            # 2. 信号量限制并发，完成一条输出一条
+            semaphore = asyncio.Semaphore(max_concurrency)
+
+            async def run_item(pos):
+                index, message = valid[pos]
+                system_prompt, user_query, similar = prompts[pos]
+                async with semaphore:
+                    try:
+                        reply, timings, cache_info = await generate_reply(
+                            message, system_prompt, user_query, similar, embeddings[pos])
+                    except Exception as e:
+                        return {"index": index, "message": message, "error": str(e)}
+                timings["retrieval_ms"] = retrieval_ms
+                timings.update(rerank_timings)
+                return {
+                    "index": index,
+                    "message": message,
+                    "reply": reply,
+                    "similar_cases": format_similar_cases(similar),
+                    "timings": timings,
+                    "cache": cache_info
+                }
+
+            tasks = [asyncio.create_task(run_item(pos)) for pos in range(len(valid))]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    line = await next_done
+                    if "error" in line:
+                        errors += 1
+                    yield json.dumps(line, ensure_ascii=False) + "\n"
+            finally:
+                for t in tasks:
+                    t.cancel()
+
+        yield json.dumps({
+            "done": True,
+            "count": len(messages),
+            "errors": errors,
+            "total_ms": round((time.perf_counter() - start) * 1000, 1)
+        }) + "\n"
+
+    return StreamingResponse(generate(), media_type='application/x-ndjson')
+
+
+async def chat_stream(request):
+    """流式聊天接口（同 app.py /chat/stream）"""
+    data = await read_json(request)
+    message = data.get('message', '')
+
+    if not message:
+        return JSONResponse({"error": "消息不能为空"}, status_code=400)
+
+    async def generate():
+        try:
+            engine = await get_rag_engine()
+            system_prompt, user_query, similar = await run_in_rag_pool(
+                engine.build_prompt, message, 5, rerank=data.get('rerank'), mmr_lambda=data.get('mmr_lambda'))
+
+            yield f"data: {json.dumps({'type': 'cases', 'data': format_similar_cases(similar)})}\n\n"
+
+            async for section, chunk in get_llm_client().generate_stream(system_prompt, user_query):
+                yield f"data: {json.dumps({'type': 'chunk', 'section': section, 'data': chunk})}\n\n"
+
+            yield f"data: {json.dumps({'type': 'done'})}\n\n"
+
+        except Exception as e:
+            yield f"data: {json.dumps({'type': 'error', 'data': str(e)})}\n\n"
+
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+async def search(request):
+    """仅检索接口（同 app.py /search）"""
+    data = await read_json(request)
+    query = data.get('query', '')
+    k = data.get('k', 5)
+    mode = data.get('mode')
+    products = data.get('products')
+    mmr_lambda = data.get('mmr_lambda')
+
+    if not query:
+        return JSONResponse({"error": "查询不能为空"}, status_code=400)
+
+    try:
+        engine = await get_rag_engine()
+        results = await run_in_rag_pool(engine.search, query, k, None, mode, products, mmr_lambda)
+        return JSONResponse({"results": format_search_results(results)})
+
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def healthz(request):
+    """存活探测"""
+    return JSONResponse({"status": "ok"})
+
+
+async def readyz(request):
+    """就绪探测：所有预热阶段完成后返回 200，否则 503"""
+    ready = warmup_state.ready()
+    return JSONResponse({
+        "status": "ready" if ready else "warming",
+        "stages": warmup_state.snapshot()
+    }, status_code=200 if ready else 503)
+
+
+async def stats(request):
+    """运行统计"""
+    return JSONResponse({
+        "llm_transport": get_llm_client().stats(),
+        "response_cache": reply_cache.exact.stats(),
+        "semantic_cache": reply_cache.semantic.stats(),
+        "query_embedding_cache": rag_engine.query_cache.stats() if rag_engine is not None else None,
+        "embedding_cache": rag_engine.embedding_cache.stats() if rag_engine is not None and rag_engine.embedding_cache else None,
+        "reranker": rag_engine.reranker.stats() if rag_engine is not None and rag_engine.reranker else None,
+        "collection": engine_reloader.stats(rag_engine) if rag_engine is not None else None
+    })
+
+
+async def startup():
+    # 预热在后台线程中进行；用独立的同步客户端预热 Ollama 模型（模型常驻对所有客户端生效）
+    start_background_warmup(warmup_state, load_rag_engine, DualModelClient(max_workers=1))
+
+
+async def shutdown():
+    if llm_client is not None:
+        await llm_client.aclose()
+    rag_executor.shutdown(wait=False)
+
+
+app = Starlette(
+    routes=[
+        Route('/', index),
+        Route('/chat', chat, methods=['POST']),
+        Route('/chat/stream', chat_stream, methods=['POST']),
+        Route('/chat/batch', chat_batch, methods=['POST']),
+        Route('/search', search, methods=['POST']),
+        Route('/healthz', healthz, methods=['GET']),
+        Route('/readyz', readyz, methods=['GET']),
+        Route('/stats', stats, methods=['GET']),
+    ],
+    on_startup=[startup],
+    on_shutdown=[shutdown]
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    print("启动客服辅助系统（ASGI）...")
+    print("访问 http://localhost:5001")
+    uvicorn.run(app, host='0.0.0.0', port=5001)
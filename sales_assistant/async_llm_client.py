@@ -0,0 +1,217 @@
+"""
+Ollama 本地 LLM 客户端 - 异步版（asyncio + httpx）
+
+与 DualModelClient 共用提示词和结果格式，区别在于：
+- 所有调用都是协程，等待 LLM 时不占用线程
+- 分析 / 话术两个分支用 asyncio 任务并发执行
+"""
+import asyncio
+import random
+import time
+
+import httpx
+
+from llm_client import _DualModelBase
+
+
+class AsyncDualModelClient(_DualModelBase):
+    """异步双模型客户端：qwen2.5 分析 + sales-assistant 话术"""
+
+    RETRY_STATUS = {500, 502, 503, 504}
+    RETRY_ERRORS = (httpx.ConnectError, httpx.RemoteProtocolError)
+    # 非流式调用读取 body 时连接被重置（复用了服务端已关闭的 keep-alive 连接）也重试
+    RETRY_READ_ERRORS = RETRY_ERRORS + (httpx.ReadError,)
+
+    def __init__(self, base_url: str = "http://localhost:11434", max_connections: int = 32,
+                 timeout: float = 120.0, connect_timeout: float = 3.0,
+                 max_retries: int = 2, backoff: float = 0.5):
+        """
+        Args:
+            base_url: Ollama 服务地址
+            max_connections: 连接池上限（超出的请求在池上排队）
+            timeout: 单次模型调用超时（秒），同时作为读取超时
+            connect_timeout: 建立连接超时（秒）
+            max_retries: 5xx / 连接重置时的最大重试次数
+            backoff: 退避基数（秒）
+        """
+        super().__init__(base_url)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.retries = 0
+        self.requests = 0
+        self.connections_created = 0
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections)
+        )
+
+    async def _trace(self, event_name: str, info: dict):
+        """httpcore 连接事件回调：只有新建 TCP 连接时才会触发 connect_tcp"""
+        if event_name == "connection.connect_tcp.complete":
+            self.connections_created += 1
+
+    def stats(self) -> dict:
+        """连接池统计：新建连接数 vs 复用次数（同 OllamaTransport.stats）"""
+        return {
+            "requests": self.requests,
+            "connections_created": self.connections_created,
+            "connections_reused": max(self.requests - self.connections_created, 0),
+            "retries": self.retries,
+        }
+
+    async def _sleep_backoff(self, attempt: int):
+        """指数退避 + full jitter"""
+        self.retries += 1
+        await asyncio.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    async def _send(self, payload: dict, stream: bool = False) -> httpx.Response:
+        """
+        发送 /api/chat 请求，只在拿到完整响应之前重试（连接失败 / 读 body 时连接断开 / 5xx）
+
+        stream=True 时返回未读取 body 的响应，调用方负责 aclose()。
+        """
+        retry_errors = self.RETRY_ERRORS if stream else self.RETRY_READ_ERRORS
+        for attempt in range(self.max_retries + 1):
+            request = self._client.build_request("POST", "/api/chat", json=payload,
+                                                 extensions={"trace": self._trace})
+            self.requests += 1
+            try:
+                response = await self._client.send(request, stream=stream)
+            except retry_errors:
+                if attempt == self.max_retries:
+                    raise
+                await self._sleep_backoff(attempt)
+                continue
+
+            if response.status_code in self.RETRY_STATUS and attempt < self.max_retries:
+                await response.aclose()
+                await self._sleep_backoff(attempt)
+                continue
+            return response
+
+    async def _call_model(self, model: str, system_prompt: str, user_message: str) -> str:
+        """调用指定模型"""
+        response = await self._send(self._chat_payload(model, system_prompt, user_message, stream=False))
+        if response.status_code == 200:
+            return response.json()["message"]["content"]
+        else:
+            raise Exception(f"Ollama 调用失败: {response.status_code}")
+
+    async def _stream_model(self, model: str, system_prompt: str, user_message: str):
+        """流式调用指定模型，逐块产出 token"""
+        response = await self._send(self._chat_payload(model, system_prompt, user_message, stream=True), stream=True)
+        try:
+            if response.status_code != 200:
+                raise Exception(f"Ollama 调用失败: {response.status_code}")
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                content, done = self._parse_stream_line(line)
+                if content:
+                    yield content
+                if done:
+                    return
+        finally:
+            await response.aclose()
+
+    async def _timed_call(self, model: str, system_prompt: str, user_message: str) -> tuple[str, float]:
+        """调用模型并返回 (内容, 耗时毫秒)"""
+        start = time.perf_counter()
+        content = await self._call_model(model, system_prompt, user_message)
+        return content, (time.perf_counter() - start) * 1000
+
+    async def generate_with_timings(self, system_prompt: str, user_message: str) -> tuple[str, dict]:
+        """
+        双模型生成，并返回各分支耗时
+
+        两个分支并发执行，任一分支失败或超时时取消另一个。
+        """
+        start = time.perf_counter()
+        product_type = self._extract_product_from_context(system_prompt)
+
+        analysis_task = asyncio.create_task(
+            self._timed_call(self.analyst_model, self._build_analysis_prompt(product_type), user_message))
+        sales_task = asyncio.create_task(
+            self._timed_call(self.sales_model, self._build_sales_prompt(product_type, user_message), user_message))
+
+        done, pending = await asyncio.wait(
+            [analysis_task, sales_task], timeout=self.timeout, return_when=asyncio.FIRST_EXCEPTION)
+        failed = [t for t in done if t.exception() is not None]
+        if failed or pending:
+            for t in (analysis_task, sales_task):
+                t.cancel()
+            if failed:
+                raise failed[0].exception()
+            raise TimeoutError(f"模型调用超时（>{self.timeout}s）")
+
+        analysis, analysis_ms = analysis_task.result()
+        sales_reply, sales_ms = sales_task.result()
+
+        price_info = self._build_price_info(system_prompt, user_message)
+        result = self._compose_result(product_type, sales_reply, analysis, price_info)
+
+        timings = {
+            "analysis_ms": round(analysis_ms, 1),
+            "sales_ms": round(sales_ms, 1),
+            "total_ms": round((time.perf_counter() - start) * 1000, 1),
+            "mode": "async",
+        }
+        return result, timings
+
+    async def generate(self, system_prompt: str, user_message: str) -> str:
+        """双模型生成（异步）"""
+        result, _ = await self.generate_with_timings(system_prompt, user_message)
+        return result
+
+    async def _pump_stream(self, section: str, model: str, system_prompt: str, user_message: str,
+                           out: asyncio.Queue):
+        """把模型的流式输出按分区写入队列"""
+        try:
+            async for token in self._stream_model(model, system_prompt, user_message):
+                await out.put((section, token))
+        except Exception as e:
+            await out.put((section, e))
+        finally:
+            await out.put((section, None))
+
+    async def generate_stream(self, system_prompt: str, user_message: str):
+        """
+        流式双模型生成（异步），产出 (section, text)，分区含义同 DualModelClient.generate_stream
+        """
+        product_type = self._extract_product_from_context(system_prompt)
+        yield "product", product_type
+
+        out = asyncio.Queue()
+        tasks = [
+            asyncio.create_task(self._pump_stream(
+                "sales", self.sales_model, self._build_sales_prompt(product_type, user_message), user_message, out)),
+            asyncio.create_task(self._pump_stream(
+                "analysis", self.analyst_model, self._build_analysis_prompt(product_type), user_message, out)),
+        ]
+
+        remaining = len(tasks)
+        try:
+            while remaining:
+                try:
+                    section, item = await asyncio.wait_for(out.get(), timeout=self.timeout)
+                except asyncio.TimeoutError:
+                    raise TimeoutError(f"模型流式输出超时（>{self.timeout}s 无新 token）")
+                if item is None:
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield section, item
+        finally:
+            for t in tasks:
+                t.cancel()
+
+        price_info = self._build_price_info(system_prompt, user_message)
+        if price_info:
+            yield "price", price_info
+
+    async def aclose(self):
+        await self._client.aclose()
@@ -0,0 +1,226 @@
+"""
+检索配置对比：Embedding 模型 × 文档粒度
+
+对 rag_engine.PROFILES 中的每个配置，在同一组查询上测量：
+- encode: 单条查询编码延迟 p50 / p99（不走查询缓存）
+- query: 向量检索延迟 p50 / p99（向量已算好）
+- memory: 加载模型和向量库后的进程常驻内存，以及向量矩阵本身的大小
+- recall@k: 标注集中 top-k 结果命中相关对话的查询比例
+
+每个配置在独立子进程中运行，内存数字互不干扰。
+召回的查询来自导入时留出、不在索引里的对话，运行前先按配置留出导入:
+    python import_data.py --profile m3-utterance --holdout 0.1
+    python import_data.py --profile small-conversation --holdout 0.1
+
+用法:
+    python benchmark.py
+    python benchmark.py --profiles small-conversation --k 3 --min-recall 0.9
+"""
+import argparse
+import json
+import multiprocessing
+import random
+import re
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+# 延迟测试用的固定查询集
+FIXED_QUERIES = [
+    "客户说竞争对手只要一半价格，怎么回复？",
+    "客户坚持要 50% 折扣，否则取消订单",
+    "客户投诉发货太慢要求退款",
+    "客户说价格太贵了",
+    "MOQ能不能降到100",
+    "有没有CE/FCC认证",
+    "充电宝能给个best price吗",
+    "蓝牙耳机量大能便宜多少",
+    "客户要求先发样品",
+    "付款方式和交期怎么安排",
+]
+
+
+def message_template(text: str) -> str:
+    """去掉价格等数字后的消息模板"""
+    return re.sub(r"\$?\d+(?:\.\d+)?", "#", text)
+
+
+def build_labelled_set(dialogues: list[dict], holdout: float, n: int = 100, seed: int = 0) -> list[dict]:
+    """
+    从留出的对话生成标注集
+
+    查询取留出对话（导入时 --holdout 排除，不在索引里）中买家第 2 轮的砍价消息；
+    与入库对话原文完全相同的消息跳过，否则 utterance 粒度会原样命中同一句话，召回虚高。
+    相关对话为入库对话中砍价消息模板（去掉价格后）相同的对话。
+
+    Returns:
+        [{"query": ..., "dialogue_ids": [...]}, ...]
+    """
+    from import_data import is_holdout
+
+    indexed_texts = set()
+    by_template = {}
+    candidates = []
+    for d in dialogues:
+        if d.get("role") != "buyer" or d.get("round") != 2:
+            continue
+        if is_holdout(d["id"], holdout):
+            candidates.append(d["content"])
+        else:
+            indexed_texts.add(d["content"])
+            by_template.setdefault(message_template(d["content"]), set()).add(d["id"])
+
+    texts = sorted({t for t in candidates if t not in indexed_texts and message_template(t) in by_template})
+    random.Random(seed).shuffle(texts)
+    return [{"query": text, "dialogue_ids": sorted(by_template[message_template(text)])} for text in texts[:n]]
+
+
+def _rss_mb() -> float:
+    """当前常驻内存（MB），无 /proc 时退回峰值常驻内存"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _percentiles(latencies: list[float]) -> dict:
+    return {
+        "p50": round(float(np.percentile(latencies, 50)), 3),
+        "p99": round(float(np.percentile(latencies, 99)), 3),
+    }
+
+
+def run_profile(profile: str, queries: list[str], labels: list[dict], k: int = 5,
+                backend: str = "chroma", db_path: str = None, repeat: int = 3, holdout: float = None) -> dict:
+    """在当前进程中加载一个配置并测量，返回报告"""
+    from rag_engine import RAGEngine
+
+    rss_before = _rss_mb()
+    start = time.perf_counter()
+    engine = RAGEngine.from_profile(profile, backend=backend, db_path=db_path)
+    load_s = time.perf_counter() - start
+    rss_after = _rss_mb()
+
+    # 标注查询必须真的不在索引里
+    if backend == "chroma" and holdout is not None:
+        imported = (engine.collection.metadata or {}).get("holdout") or 0.0
+        if imported != holdout:
+            raise ValueError(f"{engine.collection_name} 导入时 --holdout 为 {imported}，与评测的 {holdout} 不一致，"
+                             f"请先运行 import_data.py --profile {profile} --holdout {holdout}")
+
+    engine.model.encode(["预热"])
+
+    encode_ms = []
+    embeddings = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            embedding = engine.model.encode([query])[0]
+            encode_ms.append((time.perf_counter() - start) * 1000)
+            embeddings.append(embedding)
+
+    query_ms = []
+    for embedding in embeddings:
+        start = time.perf_counter()
+        engine.store.query([embedding], k)
+        query_ms.append((time.perf_counter() - start) * 1000)
+
+    hits = 0
+    label_embeddings = engine.model.encode([label["query"] for label in labels]) if labels else []
+    for label, embedding in zip(labels, label_embeddings):
+        results = engine.search(label["query"], k, query_embedding=embedding, mode="dense", products=[])
+        relevant = set(label["dialogue_ids"])
+        if any(item["metadata"].get("dialogue_id") in relevant for item in results):
+            hits += 1
+
+    dim = len(embeddings[0]) if embeddings else 0
+    return {
+        "profile": profile,
+        "encoder": engine.model_name,
+        "granularity": engine.granularity,
+        "documents": engine.store.count(),
+        "load_s": round(load_s, 2),
+        "encode_ms": _percentiles(encode_ms),
+        "query_ms": _percentiles(query_ms),
+        "rss_mb": round(rss_after - rss_before, 1),
+        "index_mb": round(engine.store.count() * dim * 4 / 1024 / 1024, 2),
+        f"recall@{k}": round(hits / len(labels), 4) if labels else None,
+    }
+
+
+def run_isolated(profile: str, *args, **kwargs) -> dict:
+    """在独立子进程（spawn）中运行 run_profile，避免配置之间共享已加载的模型"""
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(run_profile, profile, *args, **kwargs).result()
+
+
+def pick_cheapest(reports: list[dict], k: int, min_recall: float) -> dict:
+    """召回达标的配置中选常驻内存最小的（相同时比编码延迟）"""
+    qualified = [r for r in reports if (r[f"recall@{k}"] or 0) >= min_recall]
+    if not qualified:
+        return None
+    return min(qualified, key=lambda r: (r["rss_mb"], r["encode_ms"]["p50"]))
+
+
+def main():
+    from import_data import load_dialogues
+    from rag_engine import PROFILES
+
+    parser = argparse.ArgumentParser(description="对比各检索配置的延迟、内存和召回")
+    parser.add_argument("--profiles", nargs="+", choices=sorted(PROFILES), default=sorted(PROFILES))
+    parser.add_argument("--backend", choices=["chroma", "numpy", "int8", "binary"], default="chroma")
+    parser.add_argument("--db-path", help="Chroma 数据库路径，默认 sales_assistant/chroma_db")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--labels", help="标注集 JSONL（不存在时从对话数据生成并写入）")
+    parser.add_argument("--n-labels", type=int, default=100)
+    parser.add_argument("--holdout", type=float, default=0.1, help="与导入时的 --holdout 一致")
+    parser.add_argument("--min-recall", type=float, default=0.8, help="选择配置时要求的最低 recall@k")
+    parser.add_argument("--output", help="把完整报告写入 JSON 文件")
+    args = parser.parse_args()
+
+    labels_path = Path(args.labels) if args.labels else None
+    if labels_path and labels_path.exists():
+        with open(labels_path, "r", encoding="utf-8") as f:
+            labels = [json.loads(line) for line in f if line.strip()]
+    else:
+        data_path = Path(__file__).parent.parent / "dialogue_data.jsonl"
+        labels = build_labelled_set(load_dialogues(str(data_path)), args.holdout, n=args.n_labels)
+        if labels_path:
+            with open(labels_path, "w", encoding="utf-8") as f:
+                for label in labels:
+                    f.write(json.dumps(label, ensure_ascii=False) + "\n")
+    print(f"📋 固定查询 {len(FIXED_QUERIES)} 条，标注查询 {len(labels)} 条，k={args.k}")
+
+    reports = []
+    for profile in args.profiles:
+        print(f"\n⏳ {profile} ...")
+        report = run_isolated(profile, FIXED_QUERIES, labels, k=args.k, backend=args.backend,
+                              db_path=args.db_path, holdout=args.holdout)
+        reports.append(report)
+        print(f"  {report['encoder']} / {report['granularity']}，{report['documents']} 个文档")
+        print(f"  编码: p50 {report['encode_ms']['p50']:.2f} ms, p99 {report['encode_ms']['p99']:.2f} ms")
+        print(f"  检索: p50 {report['query_ms']['p50']:.2f} ms, p99 {report['query_ms']['p99']:.2f} ms")
+        print(f"  内存: 常驻 +{report['rss_mb']:.0f} MB，向量矩阵 {report['index_mb']:.1f} MB")
+        print(f"  recall@{args.k}: {report[f'recall@{args.k}']}")
+
+    best = pick_cheapest(reports, args.k, args.min_recall)
+    if best:
+        print(f"\n✅ recall@{args.k} ≥ {args.min_recall} 中开销最小的配置: {best['profile']}")
+    else:
+        print(f"\n⚠️ 没有配置达到 recall@{args.k} ≥ {args.min_recall}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"reports": reports, "best": best and best["profile"]}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
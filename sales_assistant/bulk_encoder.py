@@ -0,0 +1,244 @@
+"""
+批量编码（导入 / 重建索引用）
+
+SentenceTransformer.encode 在单进程里按输入顺序分批，每个 batch 要 padding 到其中最长的句子；
+我们的消息长短差异很大（一句寒暄 vs 带报价、认证、MOQ 的长段落），大量算力花在 padding 上。
+
+BulkEncoder:
+1. 用模型的 tokenizer 算出每条文本的 token 数，按长度排序后切成 batch（长度桶），
+   同一 batch 内长度接近，padding 很少
+2. batch 分发到 workers 个进程（spawn），每个进程加载一份模型，PyTorch 线程数固定为
+   threads_per_worker，支持的平台上每个进程绑定到各自的一组 CPU 核，互不争抢
+3. 结果按原始顺序写回
+
+encode() 与 SentenceTransformer.encode 兼容，import_data.py 直接替换。
+
+用法（对比不同 进程数x线程数 配置的吞吐）:
+    python bulk_encoder.py --configs 1x8 2x4 4x2 8x1
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+# worker 进程内的模型（每个进程一份）
+_worker_model = None
+
+
+def available_cpus() -> int:
+    """当前进程可用的 CPU 核数（考虑 cgroup / taskset 限制）"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _pin_threads(threads: int, index: int = None, pin_cpus: bool = False):
+    """固定本进程的计算线程数；index 不为空且 pin_cpus 时绑定到第 index 组 CPU 核"""
+    if pin_cpus and index is not None and hasattr(os, "sched_setaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+        start = (index * threads) % len(cpus)
+        os.sched_setaffinity(0, cpus[start:start + threads] or cpus)
+
+    # 不能靠 OMP_NUM_THREADS：spawn 的子进程先重新导入 __main__（import_data.py -> rag_engine -> torch），
+    # 执行到这里时 OpenMP 运行时已经初始化，环境变量不再生效。用 torch 的接口设置（同时作用于 OpenMP / MKL）
+    import torch
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(threads)
+    except RuntimeError:
+        # 本进程已经跑过并行计算（workers=1 在当前进程内编码时可能发生），inter-op 线程数不能再改
+        pass
+
+
+def _init_worker(model_name: str, threads: int, counter, pin_cpus: bool):
+    global _worker_model
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    _pin_threads(threads, index, pin_cpus)
+
+    from sentence_transformers import SentenceTransformer
+    _worker_model = SentenceTransformer(model_name)
+
+
+def _encode_batch(texts: list[str]) -> np.ndarray:
+    return _worker_model.encode(texts, batch_size=len(texts), show_progress_bar=False)
+
+
+class BulkEncoder:
+    """长度分桶 + 多进程的批量编码器"""
+
+    def __init__(self, model_name: str, workers: int = 1, threads_per_worker: int = None,
+                 batch_size: int = 64, length_bucketing: bool = True, pin_cpus: bool = True,
+                 max_length: int = 8192):
+        """
+        Args:
+            model_name: SentenceTransformer 模型
+            workers: 编码进程数；1 时在当前进程内编码
+            threads_per_worker: 每个进程的 PyTorch 线程数，默认可用核数 / workers
+            batch_size: 每个 batch 的文本数（encode 的 batch_size 参数可覆盖）
+            length_bucketing: 是否按 token 长度排序分桶，关闭时按输入顺序分批（用于对比）
+            pin_cpus: 多进程时是否把每个进程绑定到各自的 CPU 核（仅 Linux）
+            max_length: 计算长度时的截断上限
+        """
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker or max(1, available_cpus() // workers)
+        self.batch_size = batch_size
+        self.length_bucketing = length_bucketing
+        self.max_length = max_length
+        self.pin_cpus = pin_cpus
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+        # 模型 / 进程池在首次编码时才加载（导入全部命中向量缓存时不必加载模型）
+        self._model = None
+        self._pool = None
+
+    def _start(self):
+        if self._model is not None or self._pool is not None:
+            return
+        if self.workers == 1:
+            _pin_threads(self.threads_per_worker)
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name)
+        else:
+            context = multiprocessing.get_context("spawn")
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=context, initializer=_init_worker,
+                initargs=(self.model_name, self.threads_per_worker, context.Value("i", 0), self.pin_cpus)
+            )
+
+    def token_lengths(self, texts: list[str]) -> np.ndarray:
+        encoded = self.tokenizer(texts, padding=False, truncation=True, max_length=self.max_length)
+        return np.array([len(ids) for ids in encoded["input_ids"]], dtype=np.int64)
+
+    def plan_batches(self, lengths: np.ndarray, batch_size: int = None) -> list[np.ndarray]:
+        """切分 batch：每个 batch 是原始下标数组；分桶时最长的 batch 排在最前，避免长 batch 最后拖尾"""
+        batch_size = batch_size or self.batch_size
+        order = np.argsort(-lengths, kind="stable") if self.length_bucketing else np.arange(len(lengths))
+        return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+    @staticmethod
+    def padding_efficiency(lengths: np.ndarray, batches: list[np.ndarray]) -> float:
+        """有效 token 占 padding 后总 token 的比例"""
+        padded = sum(int(lengths[batch].max()) * len(batch) for batch in batches)
+        return float(lengths.sum() / padded) if padded else 1.0
+
+    def encode(self, sentences, batch_size: int = None, show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        """
+        编码文本，返回与输入顺序一致的向量矩阵（单条字符串返回一维向量）
+
+        show_progress_bar 等参数为兼容 SentenceTransformer.encode 而保留。
+        """
+        if isinstance(sentences, str):
+            return self.encode([sentences], batch_size)[0]
+        texts = list(sentences)
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+
+        batches = self.plan_batches(self.token_lengths(texts), batch_size)
+        self._start()
+        if self._pool is None:
+            results = (self._model.encode([texts[i] for i in batch], batch_size=len(batch), show_progress_bar=False)
+                       for batch in batches)
+        else:
+            futures = [self._pool.submit(_encode_batch, [texts[i] for i in batch]) for batch in batches]
+            results = (future.result() for future in futures)
+
+        embeddings = None
+        for batch, result in zip(batches, results):
+            result = np.asarray(result)
+            if embeddings is None:
+                embeddings = np.empty((len(texts), result.shape[1]), dtype=result.dtype)
+            embeddings[batch] = result
+        return embeddings
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parse_config(value: str) -> tuple[int, int]:
+    """'4x2' -> (4 个进程, 每进程 2 线程)"""
+    workers, _, threads = value.partition("x")
+    return int(workers), int(threads) if threads else None
+
+
+def benchmark(model_name: str, texts: list[str], configs: list[tuple[int, int]], batch_size: int = 64,
+              length_bucketing: bool = True) -> list[dict]:
+    """
+    逐个配置编码同一批文本，统计吞吐
+
+    Returns:
+        [{workers, threads, bucketing, padding_efficiency, seconds, sentences_per_sec}, ...]
+    """
+    results = []
+    for workers, threads in configs:
+        with BulkEncoder(model_name, workers=workers, threads_per_worker=threads, batch_size=batch_size,
+                         length_bucketing=length_bucketing) as encoder:
+            # 预热：每个进程都加载好模型后再计时
+            encoder.encode(texts[:batch_size * workers])
+            lengths = encoder.token_lengths(texts)
+            efficiency = encoder.padding_efficiency(lengths, encoder.plan_batches(lengths))
+
+            start = time.perf_counter()
+            encoder.encode(texts)
+            elapsed = time.perf_counter() - start
+            results.append({
+                "workers": workers,
+                "threads": encoder.threads_per_worker,
+                "bucketing": length_bucketing,
+                "padding_efficiency": round(efficiency, 3),
+                "seconds": round(elapsed, 2),
+                "sentences_per_sec": round(len(texts) / elapsed, 1),
+            })
+    return results
+
+
+def main():
+    from import_data import iter_dialogues, iter_documents
+    from rag_engine import PROFILES, DEFAULT_PROFILE
+
+    parser = argparse.ArgumentParser(description="批量编码吞吐对比（进程数 x 线程数）")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default=DEFAULT_PROFILE)
+    parser.add_argument("--model", help="覆盖配置中的 Embedding 模型")
+    parser.add_argument("--data", help="对话数据 JSONL，默认为项目根目录的 dialogue_data.jsonl")
+    parser.add_argument("--limit", type=int, default=4096, help="参与测试的文档数")
+    parser.add_argument("--configs", nargs="+", default=[f"1x{available_cpus()}"],
+                        help="进程数x每进程线程数，如 1x8 2x4 4x2")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--compare-bucketing", action="store_true", help="同时测不分桶（按输入顺序分批）的结果")
+    args = parser.parse_args()
+
+    profile = PROFILES[args.profile]
+    model_name = args.model or profile["encoder"]
+    data_path = args.data or str(Path(__file__).parent.parent / "dialogue_data.jsonl")
+    texts = [doc for doc, _, _ in iter_documents(iter_dialogues(data_path), profile["granularity"])][:args.limit]
+    configs = [parse_config(c) for c in args.configs]
+
+    print(f"模型: {model_name}，文档: {len(texts)} 条，可用 CPU: {available_cpus()}")
+    rows = benchmark(model_name, texts, configs, args.batch_size)
+    if args.compare_bucketing:
+        rows += benchmark(model_name, texts, configs, args.batch_size, length_bucketing=False)
+
+    print(f"\n{'进程x线程':<10} {'分桶':<6} {'padding 有效率':>14} {'耗时(s)':>8} {'句/s':>8}")
+    for row in rows:
+        print(f"{row['workers']}x{row['threads']:<8} {'是' if row['bucketing'] else '否':<6} "
+              f"{row['padding_efficiency']:>14.1%} {row['seconds']:>8} {row['sentences_per_sec']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+集合版本（蓝绿重建）
+
+全量重建原来要先删除线上正在使用的集合，服务中的 rag_engine 也感知不到新集合。现在：
+1. 每次全量导入写入新版本 <集合名>__v<时间戳>，旧版本照常服务
+2. 新版本校验通过（条数 + 冒烟查询）后，原子地把别名指向它
+3. 服务按别名解析集合，发现指向变化后在后台打开新版本并替换引擎（EngineReloader），无需重启
+4. 清理旧版本：保留当前版本和最近几个曾经上线的版本（用于回滚）
+
+增量导入直接更新当前版本：衍生文件先写临时文件再原子替换（正在 mmap 旧文件的进程不受影响），
+完成后递增别名文件里的 generation，服务同样据此热加载。
+
+别名文件 <chroma_db>/alias_<集合名>.json:
+    {"version": "dialogues__v20261017T101500123", "generation": 3, "switched_at": 1760000000.0, "history": [...]}
+没有别名文件时按原名解析，兼容引入版本之前导入的集合。
+
+用法:
+    python collection_versions.py list
+    python collection_versions.py switch dialogues__v20261016T093000120   # 回滚到旧版本
+    python collection_versions.py gc --keep 2
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+VERSION_SEPARATOR = "__v"
+# 保留多少个曾经上线的旧版本（不含当前版本）记录在别名文件里
+HISTORY_SIZE = 10
+
+
+@contextmanager
+def replace_atomically(path):
+    """写到同目录的临时文件，写完后 os.replace 到 path；读者只会看到完整的旧文件或新文件"""
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def alias_path(db_path, name: str) -> Path:
+    return Path(db_path) / f"alias_{name}.json"
+
+
+def load_alias(db_path, name: str) -> dict:
+    path = alias_path(db_path, name)
+    if not path.exists():
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def resolve_collection(db_path, name: str) -> str:
+    """别名当前指向的集合版本；没有别名时就是集合本身"""
+    return load_alias(db_path, name).get("version", name)
+
+
+def resolve_version(db_path, name: str) -> tuple[str, int]:
+    """(当前版本, generation)：版本不变时 generation 变化说明当前版本被增量更新过"""
+    alias = load_alias(db_path, name)
+    return alias.get("version", name), alias.get("generation", 0)
+
+
+def _write_alias(db_path, name: str, alias: dict):
+    with replace_atomically(alias_path(db_path, name)) as tmp:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(alias, f, ensure_ascii=False)
+
+
+def new_version_name(name: str) -> str:
+    """按时间生成版本名，字典序即时间顺序"""
+    return f"{name}{VERSION_SEPARATOR}{datetime.now().strftime('%Y%m%dT%H%M%S%f')[:-3]}"
+
+
+def alias_of(collection: str) -> str:
+    """版本名 -> 别名；不是版本名时原样返回"""
+    match = re.fullmatch(rf"(.+){VERSION_SEPARATOR}\d{{8}}T\d{{9}}", collection)
+    return match.group(1) if match else collection
+
+
+def switch_alias(db_path, name: str, version: str):
+    """把别名指向 version：先写临时文件再原子替换，读者只会看到切换前或切换后的内容"""
+    alias = load_alias(db_path, name)
+    previous = alias.get("version", name)
+    history = [v for v in alias.get("history", []) if v not in (previous, version)]
+    if previous != version:
+        history.append(previous)
+    _write_alias(db_path, name, {"version": version, "generation": alias.get("generation", 0) + 1,
+                                 "switched_at": time.time(), "history": history[-HISTORY_SIZE:]})
+
+
+def bump_generation(db_path, name: str) -> int:
+    """当前版本被增量更新（集合和衍生文件都已写完）后调用，通知服务重新加载"""
+    alias = load_alias(db_path, name)
+    alias.setdefault("version", name)
+    alias.setdefault("history", [])
+    alias["generation"] = alias.get("generation", 0) + 1
+    alias["switched_at"] = time.time()
+    _write_alias(db_path, name, alias)
+    return alias["generation"]
+
+
+def list_versions(client, name: str) -> list[str]:
+    """别名下的所有集合（含引入版本之前的同名集合），按时间从旧到新"""
+    names = [c.name for c in client.list_collections()]
+    versions = sorted(n for n in names if alias_of(n) == name and n != name)
+    return ([name] if name in names else []) + versions
+
+
+def gc_versions(client, db_path, name: str, keep: int = 2, protect=(), derived_paths=None) -> list[str]:
+    """
+    删除旧版本：保留当前版本和最近 keep - 1 个曾经上线的版本，
+    其余版本（更早的、校验失败没有上线的）连同衍生文件一起删除
+
+    Args:
+        protect: 不能删除的版本（如正在导入、有检查点的版本）
+        derived_paths: 版本名 -> 该版本的衍生文件 / 目录列表（NumPy 索引、BM25 索引、父文档）
+
+    Returns:
+        被删除的版本
+    """
+    alias = load_alias(db_path, name)
+    current = alias.get("version", name)
+    history = alias.get("history", [])
+    kept = {current, *protect, *(history[-(keep - 1):] if keep > 1 else [])}
+
+    removed = []
+    for version in list_versions(client, name):
+        if version in kept:
+            continue
+        drop_version(client, version, derived_paths)
+        removed.append(version)
+    return removed
+
+
+def drop_version(client, version: str, derived_paths=None):
+    """删除一个版本的集合和衍生文件（参数同 gc_versions）"""
+    client.delete_collection(version)
+    for path in (derived_paths(version) if derived_paths else []):
+        path = Path(path)
+        if path.is_dir():
+            shutil.rmtree(path)
+        elif path.exists():
+            path.unlink()
+
+
+class EngineReloader:
+    """
+    服务侧热加载
+
+    请求路径上调用 maybe_reload(engine)：最多每 interval 秒检查一次别名，指向变化时在后台线程
+    用 engine.reload() 打开新版本（复用已加载的模型），完成后通过 on_reload 替换全局引擎；
+    切换完成前请求继续由旧版本服务。版本不变、generation 变化（增量导入）时同样重新加载。检查由请求触发而不是常驻线程，
+    gunicorn preload 之后 fork 出的每个 worker 也能各自切换。
+    """
+
+    def __init__(self, on_reload, interval: float = 5.0):
+        self.on_reload = on_reload
+        self.interval = interval
+        self.reloads = 0
+        self.last_error = None
+        self._next_check = 0.0
+        self._failed_version = None
+        self._lock = threading.Lock()
+
+    def maybe_reload(self, engine):
+        now = time.monotonic()
+        if now < self._next_check or not self._lock.acquire(blocking=False):
+            return
+        self._next_check = now + self.interval
+        try:
+            target = engine.resolve_version()
+        except Exception as e:
+            self.last_error = f"解析别名失败: {e}"
+            target = None
+        if target in (None, (engine.collection_name, engine.collection_generation), self._failed_version):
+            self._lock.release()
+            return
+        threading.Thread(target=self._reload, args=(engine, target), daemon=True).start()
+
+    def _reload(self, engine, target: tuple[str, int]):
+        try:
+            new_engine = engine.reload()
+            self.on_reload(new_engine)
+            self.reloads += 1
+            self.last_error = None
+            print(f"🔁 检索引擎已切换到 {new_engine.collection_name}#{new_engine.collection_generation}"
+                  f"（原 {engine.collection_name}#{engine.collection_generation}）")
+        except Exception as e:
+            # 新版本打不开（如缺少衍生索引）时继续用旧版本，同一版本（同一 generation）不再反复重试
+            self._failed_version = target
+            self.last_error = f"加载 {target[0]}#{target[1]} 失败: {e}"
+            print(f"⚠️ {self.last_error}，继续使用 {engine.collection_name}")
+        finally:
+            self._lock.release()
+
+    def stats(self, engine) -> dict:
+        return {
+            "alias": engine.collection_alias,
+            "collection": engine.collection_name,
+            "generation": engine.collection_generation,
+            "reloads": self.reloads,
+            "last_error": self.last_error,
+        }
+
+
+def main():
+    import chromadb
+    from import_data import checkpoint_collection, checkpoint_path
+    from rag_engine import PROFILES, DEFAULT_PROFILE, derived_paths
+
+    parser = argparse.ArgumentParser(description="集合版本管理（蓝绿重建）")
+    parser.add_argument("command", choices=["list", "switch", "gc"])
+    parser.add_argument("version", nargs="?", help="switch 的目标版本")
+    parser.add_argument("--collection", default=PROFILES[DEFAULT_PROFILE]["collection"], help="集合别名")
+    parser.add_argument("--keep", type=int, default=2, help="gc 时保留的版本数（含当前版本）")
+    args = parser.parse_args()
+
+    db_path = Path(__file__).parent / "chroma_db"
+    client = chromadb.PersistentClient(path=str(db_path))
+    name = args.collection
+
+    if args.command == "list":
+        current = resolve_collection(db_path, name)
+        for version in list_versions(client, name):
+            marker = "*" if version == current else " "
+            print(f"{marker} {version}  {client.get_collection(version).count()} 条")
+    elif args.command == "switch":
+        if args.version is None or alias_of(args.version) not in (name, args.version):
+            raise SystemExit(f"❌ 请指定 {name} 的一个版本")
+        if args.version not in list_versions(client, name):
+            raise SystemExit(f"❌ 版本不存在: {args.version}")
+        switch_alias(db_path, name, args.version)
+        print(f"✅ {name} -> {args.version}")
+    else:
+        protect = [v for v in [checkpoint_collection(checkpoint_path(db_path, name))] if v]
+        removed = gc_versions(client, db_path, name, keep=args.keep, protect=protect, derived_paths=derived_paths)
+        print(f"🧹 已删除 {len(removed)} 个旧版本" + (f": {', '.join(removed)}" if removed else ""))
+
+
+if __name__ == "__main__":
+    main()
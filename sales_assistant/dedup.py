@@ -0,0 +1,160 @@
+"""
+导入时的近重复文档折叠（MinHash + LSH）
+
+generate_dialogues.py 用少量固定模板生成对话，大量发言只在产品名或价格上不同，
+既撑大了索引，也让 build_prompt 的 top-k 被几乎相同的案例占满。
+
+做法：
+1. 文本规范化：数字 / 价格替换为占位符（scope=global 时产品名也替换）
+2. 字符 3-gram 集合 → MinHash 签名
+3. LSH 分桶找候选对，签名估计的 Jaccard ≥ threshold 的合并为一簇（并查集）
+4. 每簇保留第一条作为代表，metadata 记录 cluster_size
+
+只在同一 scope 内比较：默认按 (产品, 角色, 轮次) 分组，保证按产品过滤检索仍然可用；
+scope=global 时跨产品折叠，代表文档只保留一个产品名。
+"""
+import re
+import unicodedata
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+_NUMBER = re.compile(r"[$￥¥]?\d+(?:[.,]\d+)*%?")
+_PRIME = (1 << 31) - 1
+
+
+def normalize_for_dedup(text: str, products: list[str] = ()) -> str:
+    """小写 + 数字 / 价格替换为 #，products 中的产品名替换为 @"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    for product in sorted(products, key=len, reverse=True):
+        text = text.replace(unicodedata.normalize("NFKC", product).lower(), "@")
+    return _NUMBER.sub("#", text)
+
+
+def shingles(text: str, size: int = 3) -> set[str]:
+    text = re.sub(r"\s+", " ", text)
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class MinHasher:
+    """MinHash 签名：h(x) = (a·crc32(x) + b) mod p"""
+
+    def __init__(self, num_perm: int = 64, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.a = rng.integers(1, _PRIME, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, _PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, features: set[str]) -> np.ndarray:
+        hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) & _PRIME for f in features),
+                             dtype=np.uint64, count=len(features))
+        return ((hashes[:, None] * self.a + self.b) % _PRIME).min(axis=0)
+
+
+class _UnionFind:
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+
+    def find(self, x: int) -> int:
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, x: int, y: int):
+        rx, ry = self.find(x), self.find(y)
+        if rx != ry:
+            # 以下标小的为根，代表文档即簇内第一条
+            self.parent[max(rx, ry)] = min(rx, ry)
+
+
+def cluster_near_duplicates(texts, threshold: float = 0.8, num_perm: int = 64,
+                            bands: int = 16, groups: list = None) -> list[int]:
+    """
+    近重复聚类
+
+    Args:
+        texts: 已规范化的文本（可以是迭代器，只保留签名）
+        threshold: 估计 Jaccard 相似度阈值
+        bands: LSH 分段数（num_perm 须能被整除），段数越多召回越高、候选越多
+        groups: 每条文本的分组键，只在同组内比较，为空时全部同组
+
+    Returns:
+        每条文本所属簇的代表下标
+    """
+    if num_perm % bands:
+        raise ValueError("num_perm 必须能被 bands 整除")
+    rows = num_perm // bands
+    hasher = MinHasher(num_perm)
+    signatures = [hasher.signature(shingles(t)) for t in texts]
+    n = len(signatures)
+    signatures = np.stack(signatures) if signatures else np.empty((0, num_perm), dtype=np.uint64)
+    groups = groups if groups is not None else [None] * n
+
+    union = _UnionFind(n)
+    for band in range(bands):
+        buckets = defaultdict(list)
+        band_slice = signatures[:, band * rows:(band + 1) * rows]
+        for i, (group, key) in enumerate(zip(groups, map(bytes, band_slice))):
+            buckets[(group, key)].append(i)
+        for members in buckets.values():
+            first = members[0]
+            for other in members[1:]:
+                if union.find(first) == union.find(other):
+                    continue
+                if np.mean(signatures[first] == signatures[other]) >= threshold:
+                    union.union(first, other)
+
+    return [union.find(i) for i in range(n)]
+
+
+def near_duplicate_representatives(records, threshold: float = 0.8, scope: str = "product",
+                                   products: list[str] = ()) -> dict[str, int]:
+    """
+    近重复聚类，返回 {代表文档 ID: 簇大小}
+
+    records 是 (document, metadata, id) 迭代器，只保留签名和分组键，可以流式处理大语料。
+
+    Args:
+        scope: product 只在同产品（同角色、同轮次）内折叠；global 跨产品折叠，产品名视为相同
+        products: scope=global 时需要替换掉的产品名
+    """
+    if scope not in ("product", "global"):
+        raise ValueError(f"未知的折叠范围: {scope}")
+    fields = [f for f in ("product", "role", "round") if scope == "product" or f != "product"]
+    masked = products if scope == "global" else ()
+    ids, groups = [], []
+
+    def texts():
+        for doc, meta, doc_id in records:
+            ids.append(doc_id)
+            groups.append(tuple(meta.get(f) for f in fields))
+            yield normalize_for_dedup(doc, masked)
+
+    # cluster_near_duplicates 先把文本全部转成签名再按组比较，此时 ids / groups 已经填满
+    representatives = cluster_near_duplicates(texts(), threshold, groups=groups)
+    sizes = defaultdict(int)
+    for rep in representatives:
+        sizes[ids[rep]] += 1
+    return dict(sizes)
+
+
+def collapse_near_duplicates(documents: list[str], metadatas: list[dict], ids: list[str],
+                             threshold: float = 0.8, scope: str = "product",
+                             products: list[str] = ()) -> tuple[list[str], list[dict], list[str]]:
+    """
+    折叠近重复文档，每簇保留代表文档，metadata 增加 cluster_size
+
+    Returns:
+        折叠后的 (documents, metadatas, ids)
+    """
+    sizes = near_duplicate_representatives(zip(documents, metadatas, ids), threshold, scope, products)
+    kept = [i for i, doc_id in enumerate(ids) if doc_id in sizes]
+    return (
+        [documents[i] for i in kept],
+        [dict(metadatas[i], cluster_size=sizes[ids[i]]) for i in kept],
+        [ids[i] for i in kept],
+    )
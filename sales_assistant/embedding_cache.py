@@ -0,0 +1,364 @@
+"""
+磁盘向量缓存（按内容寻址）
+
+导入经常重跑（追加数据、在 bge-m3 / bge-small-zh 两套配置之间切换），每次都把编码过的文本再编码一遍。
+EmbeddingCache 以 (模型, 规范化文本哈希) 为键把向量持久化到磁盘，导入和查询编码都先查缓存，
+只有没见过的文本才跑模型，小改动后的全量重建只需几秒。
+
+每个模型一个目录:
+    vectors.npy   固定容量的 float32 向量矩阵，以内存映射方式读写（稀疏文件，按实际写入占用磁盘）
+    index.sqlite  键 -> 行号 + 最近使用时间，以及命中统计
+
+容量满时按最近使用时间淘汰一批（LRU）。多进程（gunicorn worker）可共享同一目录：
+- 写：先在写事务中分配行号（淘汰的条目随之删除）并提交，再写向量，最后提交新条目的索引，
+  所以一个键在索引里可见时，它的行里一定是它自己的向量
+- 读：不加写锁，查索引 -> 复制向量 -> 再查一次索引，行号变了（期间被淘汰复用）就当作未命中
+- 最近使用时间和命中统计先在进程内累积，定期批量写回，查询路径上不抢写锁（统计为近似值）
+
+用法:
+    python embedding_cache.py stats
+    python embedding_cache.py clear --model BAAI/bge-m3
+"""
+import argparse
+import atexit
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+
+
+def default_cache_dir() -> Path:
+    return Path(__file__).parent / "embedding_cache"
+
+
+def normalize_for_embedding(text: str) -> str:
+    """只做不影响编码结果的规范化：Unicode NFC、合并空白（两种模型的 tokenizer 都按空白切分）"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha1(normalize_for_embedding(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """单个模型的磁盘向量缓存（线程安全，可多进程共享）"""
+
+    VECTORS_FILE = "vectors.npy"
+    INDEX_FILE = "index.sqlite"
+
+    # 最近使用时间 / 命中统计写回的间隔（秒）和攒够多少条就写回
+    TOUCH_FLUSH_INTERVAL = 30.0
+    TOUCH_FLUSH_SIZE = 1024
+
+    def __init__(self, model_name: str, cache_dir: str = None, max_entries: int = 200_000,
+                 evict_fraction: float = 0.1):
+        """
+        Args:
+            model_name: 模型标识（同一模型不同编码后端的输出不同，应区分，如 "BAAI/bge-m3#onnx"）
+            cache_dir: 缓存根目录，默认 sales_assistant/embedding_cache
+            max_entries: 容量（条），只在首次创建时生效；bge-m3 每条 4 KB
+            evict_fraction: 容量满时一次淘汰的比例，避免每次写入都触发淘汰
+        """
+        self.model_name = model_name
+        self.path = Path(cache_dir or default_cache_dir()) / model_name.replace("/", "__")
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.evict_fraction = evict_fraction
+        self._lock = threading.Lock()
+
+        # SQLite 连接和内存映射都不能跨 fork 共享，按进程延迟打开
+        self._db = None
+        self._vectors = None
+        self._pid = None
+
+        # 进程内累积、待写回的最近使用时间和命中统计
+        self._touched = {}
+        self._hits = 0
+        self._misses = 0
+        self._last_touch_flush = time.monotonic()
+        atexit.register(self._flush_at_exit)
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None or self._pid != os.getpid():
+            db = sqlite3.connect(str(self.path / self.INDEX_FILE), timeout=30, check_same_thread=False,
+                                 isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, slot INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON entries(last_used)")
+            db.execute("CREATE TABLE IF NOT EXISTS free_slots (slot INTEGER PRIMARY KEY)")
+            db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value)")
+            db.execute("INSERT OR IGNORE INTO meta VALUES ('model', ?)", (self.model_name,))
+            db.execute("INSERT OR IGNORE INTO meta VALUES ('capacity', ?)", (self.max_entries,))
+            for name in ("next_slot", "hits", "misses", "evictions"):
+                db.execute("INSERT OR IGNORE INTO meta VALUES (?, 0)", (name,))
+            self._db = db
+            self._vectors = None
+            self._pid = os.getpid()
+            self._touched, self._hits, self._misses = {}, 0, 0
+        return self._db
+
+    def _meta(self, db: sqlite3.Connection, name: str):
+        row = db.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def _matrix(self, db: sqlite3.Connection, dim: int = None) -> np.ndarray:
+        """向量矩阵的内存映射；尚未创建且给了 dim 时按容量创建"""
+        if self._vectors is not None:
+            return self._vectors
+        path = self.path / self.VECTORS_FILE
+        if path.exists():
+            self._vectors = np.load(path, mmap_mode="r+")
+        elif dim is not None:
+            capacity = int(self._meta(db, "capacity"))
+            self._vectors = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(capacity, dim))
+        return self._vectors
+
+    @staticmethod
+    def _lookup(db: sqlite3.Connection, keys: list[str]) -> dict[str, int]:
+        """键 -> 行号（SQLite 单条语句的参数个数有限，分批查询）"""
+        found = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            found.update(db.execute(
+                f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(chunk))})", chunk).fetchall())
+        return found
+
+    def get_many(self, texts: list[str]) -> list:
+        """按文本批量取向量，未命中的位置为 None（只读，不加写锁）"""
+        keys = [text_key(t) for t in texts]
+        results = [None] * len(texts)
+        with self._lock:
+            db = self._conn()
+            unique = list(dict.fromkeys(keys))
+            found = self._lookup(db, unique)
+            if found:
+                matrix = self._matrix(db)
+                rows = {key: np.array(matrix[slot]) for key, slot in found.items()}
+                # 复制期间行号被淘汰复用的键当作未命中
+                still = self._lookup(db, list(found))
+                rows = {key: row for key, row in rows.items() if still.get(key) == found[key]}
+                for i, key in enumerate(keys):
+                    results[i] = rows.get(key)
+                now = time.time()
+                self._touched.update((key, now) for key in rows)
+
+            hits = sum(r is not None for r in results)
+            self._hits += hits
+            self._misses += len(texts) - hits
+            if (len(self._touched) >= self.TOUCH_FLUSH_SIZE
+                    or time.monotonic() - self._last_touch_flush > self.TOUCH_FLUSH_INTERVAL):
+                self._flush_touched(db)
+        return results
+
+    def _flush_at_exit(self):
+        """进程退出时尽量写回累积的统计，失败也不影响退出"""
+        try:
+            if self._db is not None and self._pid == os.getpid():
+                with self._lock:
+                    self._flush_touched(self._db)
+        except Exception:
+            pass
+
+    def _flush_touched(self, db: sqlite3.Connection):
+        """把累积的最近使用时间和命中统计写回（一次短写事务）"""
+        touched, hits, misses = self._touched, self._hits, self._misses
+        self._touched, self._hits, self._misses = {}, 0, 0
+        self._last_touch_flush = time.monotonic()
+        if not (touched or hits or misses):
+            return
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany("UPDATE entries SET last_used = MAX(last_used, ?) WHERE key = ?",
+                           [(t, key) for key, t in touched.items()])
+            db.execute("UPDATE meta SET value = value + ? WHERE name = 'hits'", (hits,))
+            db.execute("UPDATE meta SET value = value + ? WHERE name = 'misses'", (misses,))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def put_many(self, texts: list[str], embeddings: np.ndarray):
+        """写入向量；已缓存的键（同一模型、同一文本的向量相同）跳过"""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        items = dict(zip((text_key(t) for t in texts), embeddings))
+        if not items:
+            return
+        with self._lock:
+            db = self._conn()
+            # 1. 分配行号并提交：被淘汰的条目先从索引中消失，之后才覆盖它们的行
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                matrix = self._matrix(db, dim=embeddings.shape[1])
+                if matrix.shape[1] != embeddings.shape[1]:
+                    raise ValueError(f"向量维度 {embeddings.shape[1]} 与缓存中的 {matrix.shape[1]} 不一致")
+                existing = self._lookup(db, list(items))
+                # 超出容量的部分不缓存
+                new_keys = [key for key in items if key not in existing][:matrix.shape[0]]
+                slots = dict(zip(new_keys, self._allocate(db, matrix.shape[0], len(new_keys),
+                                                          protect=set(existing))))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            if not slots:
+                return
+
+            # 2. 写向量（此时这些行不属于任何键，读者不会读到）；3. 提交索引
+            for key, slot in slots.items():
+                matrix[slot] = items[key]
+            now = time.time()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.executemany("INSERT OR REPLACE INTO entries (key, slot, last_used) VALUES (?, ?, ?)",
+                               [(key, slot, now) for key, slot in slots.items()])
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+
+    def flush(self):
+        """把向量落盘（msync）并写回累积的统计；导入每写完一块调用一次，查询路径不调用"""
+        with self._lock:
+            db = self._conn()
+            if self._vectors is not None:
+                self._vectors.flush()
+            self._flush_touched(db)
+
+    def _allocate(self, db: sqlite3.Connection, capacity: int, n: int, protect: set = frozenset()) -> list[int]:
+        """
+        分配 n 个空行（在调用方的写事务内）：
+        未用过的行 -> 空闲行 -> 按 LRU 淘汰一批（跳过 protect 中本批正在写的键），
+        多淘汰出的行进空闲表留给之后的写入
+        """
+        next_slot = int(self._meta(db, "next_slot"))
+        slots = list(range(next_slot, min(capacity, next_slot + n)))
+        db.execute("UPDATE meta SET value = ? WHERE name = 'next_slot'", (next_slot + len(slots),))
+
+        if len(slots) < n:
+            free = db.execute("SELECT COUNT(*) FROM free_slots").fetchone()[0]
+            if free < n - len(slots):
+                batch = max(n - len(slots) - free, int(capacity * self.evict_fraction))
+                victims = db.execute("SELECT key, slot FROM entries ORDER BY last_used LIMIT ?",
+                                     (batch + len(protect),)).fetchall()
+                victims = [(key, slot) for key, slot in victims if key not in protect][:batch]
+                db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in victims])
+                db.executemany("INSERT INTO free_slots VALUES (?)", [(slot,) for _, slot in victims])
+                db.execute("UPDATE meta SET value = value + ? WHERE name = 'evictions'", (len(victims),))
+            reused = [slot for (slot,) in db.execute(
+                "SELECT slot FROM free_slots LIMIT ?", (n - len(slots),)).fetchall()]
+            db.executemany("DELETE FROM free_slots WHERE slot = ?", [(slot,) for slot in reused])
+            slots += reused
+        return slots
+
+    def stats(self) -> dict:
+        with self._lock:
+            db = self._conn()
+            self._flush_touched(db)
+            entries = db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            hits, misses = int(self._meta(db, "hits")), int(self._meta(db, "misses"))
+            matrix = self._matrix(db)
+            vectors_file = self.path / self.VECTORS_FILE
+            return {
+                "model": self._meta(db, "model"),
+                "path": str(self.path),
+                "entries": entries,
+                "capacity": int(self._meta(db, "capacity")),
+                "dim": matrix.shape[1] if matrix is not None else None,
+                "disk_mb": round(sum(_disk_bytes(p) for p in self.path.iterdir()) / 1024 / 1024, 1),
+                "logical_mb": round(vectors_file.stat().st_size / 1024 / 1024, 1) if vectors_file.exists() else 0.0,
+                "hits": hits,
+                "misses": misses,
+                "evictions": int(self._meta(db, "evictions")),
+                "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            }
+
+
+def _disk_bytes(path: Path) -> int:
+    """实际占用的磁盘空间（稀疏文件按已分配的块计算）"""
+    stat = path.stat()
+    return stat.st_blocks * 512 if hasattr(stat, "st_blocks") else stat.st_size
+
+
+class CachedEncoder:
+    """
+    在编码器外包一层磁盘缓存，接口与 SentenceTransformer.encode 兼容
+
+    同一批内重复的文本只编码一次，未命中的文本合并成一次 encoder.encode 调用。
+    flush_on_put=True 时每次写入新向量后落盘（导入按块调用 encode，即每块一次）；
+    服务侧查询不落盘，向量经共享的页缓存对其他进程立即可见。
+    """
+
+    def __init__(self, encoder, cache: EmbeddingCache, flush_on_put: bool = False):
+        self.encoder = encoder
+        self.cache = cache
+        self.flush_on_put = flush_on_put
+        self.encoded = 0  # 实际交给模型编码的条数
+
+    def encode(self, sentences, batch_size: int = None, show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        if isinstance(sentences, str):
+            return self.encode([sentences], batch_size)[0]
+        texts = list(sentences)
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+
+        results = self.cache.get_many(texts)
+        missing = {}  # 规范化后的键 -> 下标列表
+        for i, embedding in enumerate(results):
+            if embedding is None:
+                missing.setdefault(text_key(texts[i]), []).append(i)
+
+        if missing:
+            order = [indexes[0] for indexes in missing.values()]
+            kwargs = {"batch_size": batch_size} if batch_size else {}
+            embeddings = np.asarray(self.encoder.encode([texts[i] for i in order], show_progress_bar=False, **kwargs),
+                                    dtype=np.float32)
+            self.cache.put_many([texts[i] for i in order], embeddings)
+            if self.flush_on_put:
+                self.cache.flush()
+            self.encoded += len(order)
+            for indexes, embedding in zip(missing.values(), embeddings):
+                for i in indexes:
+                    results[i] = embedding
+        return np.stack(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="磁盘向量缓存管理")
+    parser.add_argument("command", choices=["stats", "clear"])
+    parser.add_argument("--dir", help="缓存根目录，默认 sales_assistant/embedding_cache")
+    parser.add_argument("--model", help="只处理这个模型（目录名中的 / 写作 __ 也可以）")
+    args = parser.parse_args()
+
+    root = Path(args.dir) if args.dir else default_cache_dir()
+    dirs = sorted(p for p in root.iterdir() if (p / EmbeddingCache.INDEX_FILE).exists()) if root.exists() else []
+    if args.model:
+        dirs = [p for p in dirs if p.name == args.model.replace("/", "__")]
+    if not dirs:
+        print(f"没有缓存: {root}")
+        return
+
+    for path in dirs:
+        if args.command == "clear":
+            shutil.rmtree(path)
+            print(f"🗑️  已清空 {path}")
+            continue
+        stats = EmbeddingCache(path.name, cache_dir=str(root)).stats()
+        print(f"📦 {stats['model']}（{stats['path']}）")
+        print(f"  条目: {stats['entries']} / {stats['capacity']}，维度: {stats['dim']}，"
+              f"磁盘: {stats['disk_mb']} MB（逻辑 {stats['logical_mb']} MB）")
+        print(f"  命中: {stats['hits']}，未命中: {stats['misses']}，命中率: {stats['hit_rate']:.1%}，"
+              f"淘汰: {stats['evictions']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+检索结果格式化：相似案例分析与接口输出（Flask / ASGI 共用）
+"""
+
+
+def analyze_case(role, content):
+    """根据角色和内容生成简短分析"""
+    content_lower = content.lower()
+
+    if role == 'buyer' or role == '买家':
+        # 分析买家意图
+        if 'discount' in content_lower or '折扣' in content or '优惠' in content or '便宜' in content:
+            return "买家策略: 价格谈判，试探底价空间"
+        elif 'quality' in content_lower or '质量' in content or '品质' in content:
+            return "买家关注: 产品质量，需要建立信任"
+        elif 'competitor' in content_lower or '竞争' in content or '别家' in content or '其他' in content:
+            return "买家策略: 用竞品压价，需强调差异化"
+        elif 'long-term' in content_lower or '长期' in content or '合作' in content:
+            return "买家意图: 以长期合作换取优惠"
+        elif 'urgent' in content_lower or '急' in content or '马上' in content:
+            return "买家状态: 有紧迫需求，成交意向高"
+        else:
+            return "买家诉求: 了解产品/价格信息"
+    else:
+        # 分析卖家策略
+        if 'best offer' in content_lower or '最低' in content or '底价' in content:
+            return "卖家策略: 表明底线，促成成交"
+        elif 'discount' in content_lower or '折扣' in content or '%' in content:
+            return "卖家策略: 适度让步，给出优惠方案"
+        elif 'quality' in content_lower or '质量' in content or '品质' in content:
+            return "卖家策略: 强调价值，转移价格焦点"
+        elif 'long-term' in content_lower or '长期' in content:
+            return "卖家策略: 用长期合作换取当前让步"
+        elif 'confirm' in content_lower or '确认' in content or '下单' in content:
+            return "卖家策略: 推动成交，锁定订单"
+        else:
+            return "卖家策略: 维护关系，保持沟通"
+
+
+def document_text(item: dict) -> str:
+    """
+    文档正文：发言文档取 "内容:" 之后的部分，整段对话文档去掉首行的产品名
+    """
+    document = item['document']
+    if '内容:' in document:
+        return document.split('内容:')[-1]
+    first, _, rest = document.partition('\n')
+    return rest if first.startswith('产品:') else document
+
+
+def format_similar_cases(similar: list[dict], limit: int = 3) -> list[dict]:
+    """格式化相似案例（带分析），只返回前 limit 个"""
+    similar_cases = []
+    for item in similar[:limit]:
+        meta = item['metadata']
+        content = document_text(item)[:200]
+        role = meta.get('role', 'dialogue')
+        analysis = analyze_case(role, content)
+        similar_cases.append({
+            "product": meta['product'],
+            "role": role,
+            "content": content,
+            "analysis": analysis
+        })
+    return similar_cases
+
+
+def format_search_results(results: list[dict]) -> list[dict]:
+    """格式化 /search 的检索结果"""
+    formatted = []
+    for item in results:
+        meta = item['metadata']
+        formatted.append({
+            "product": meta['product'],
+            "role": meta.get('role'),
+            "round": meta.get('round'),
+            "content": document_text(item),
+            "distance": item['distance'],
+            "score": item.get('score')
+        })
+    return formatted
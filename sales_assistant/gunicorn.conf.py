@@ -0,0 +1,73 @@
+"""
+Gunicorn 生产配置：多进程 pre-fork，模型在 master 中预加载
+
+启动:
+    gunicorn -c gunicorn.conf.py app:app
+    # 或
+    python app.py --prod --workers 4 --threads 8
+
+环境变量:
+    BIND: 监听地址，默认 0.0.0.0:5001
+    WORKERS: worker 进程数，默认 CPU 核数
+    THREADS: 每个 worker 的线程数，默认 8
+    TORCH_THREADS: 每个 worker 的 PyTorch 计算线程数，默认 CPU 核数 / WORKERS
+    ENCODER_THREADS: RAG_ENCODER_BACKEND=onnx 时每个 worker 的 ONNX Runtime 线程数，默认同上
+
+SentenceTransformer 和 Chroma 客户端在 master 中加载一次（preload_app），
+fork 出来的 worker 通过写时复制共享同一份模型权重，不会每个进程各占一份内存。
+master 只加载权重、不做编码：PyTorch 的 OpenMP 线程池在父进程中建立后 fork 不安全，
+dummy encode 和检索在每个 worker fork 之后进行。
+"""
+import gc
+import multiprocessing
+import os
+import sys
+
+bind = os.environ.get("BIND", "0.0.0.0:5001")
+workers = int(os.environ.get("WORKERS", multiprocessing.cpu_count()))
+threads = int(os.environ.get("THREADS", 8))
+worker_class = "gthread"
+preload_app = True
+
+# LLM 调用可能持续数十秒，超时需要大于模型调用超时
+timeout = 180
+graceful_timeout = 30
+keepalive = 5
+
+
+def _torch_encoder() -> bool:
+    return os.environ.get("RAG_ENCODER_BACKEND", "torch") != "onnx"
+
+
+def when_ready(server):
+    """app 已在 master 中导入，此时加载本地模型（不做编码），随后 fork 出 worker"""
+    if _torch_encoder():
+        import torch
+
+        # 加载权重过程中的张量操作也保持单线程，master 里不建立 OpenMP 线程池
+        torch.set_num_threads(1)
+
+    # 通过已加载的 Flask 实例找到其所在模块（python app.py --prod 时为 __main__）
+    service = sys.modules[server.app.wsgi().import_name]
+    service.preload_models()
+    # 冻结当前对象，避免 worker 中的 GC 触碰这些对象导致写时复制失效
+    gc.freeze()
+    server.log.info("模型已在 master 中预加载，开始 fork worker")
+
+
+def post_fork(server, worker):
+    """限制每个 worker 的 PyTorch / ONNX Runtime 线程数，避免多进程间 CPU 超额订阅"""
+    per_worker = max(1, multiprocessing.cpu_count() // server.cfg.workers)
+    if _torch_encoder():
+        import torch
+
+        torch.set_num_threads(int(os.environ.get("TORCH_THREADS", per_worker)))
+
+    # ONNX 编码器的 session 在 worker 首次编码时创建，此前设置线程数即可
+    service = sys.modules[server.app.wsgi().import_name]
+    engine = getattr(service, "rag_engine", None)
+    if engine is not None and getattr(engine.model, "intra_op_threads", 0) is None:
+        engine.model.intra_op_threads = per_worker
+
+    # 编码 / 检索预热和 LLM 客户端都在 worker 中进行（LLM 客户端不能跨 fork 共享）
+    service.start_worker_warmup()
@@ -1,111 +1,579 @@
 """
 数据导入脚本：将对话数据导入 Chroma 向量库
+
+文档粒度:
+- utterance: 每条发言一个文档（默认，配合 bge-m3）
+- conversation: 每个完整对话一个文档（原 rag.py 的方式，配合 bge-small-zh）
+
+utterance 粒度同时生成父文档（完整对话）存储，发言的 metadata.parent_id 指向所属对话，
+RAGEngine(parent_context=True) 用发言检索、用完整对话组装 Prompt。
+
+导入是流式的：逐行读取 JSONL，按块编码、按块写入向量库，峰值内存与数据量无关；
+每写完一块更新检查点，中断后重新运行会从上次的位置继续（--restart 重新开始）。
+
+全量导入是蓝绿重建：写入新版本集合 <集合名>__v<时间戳>，线上版本照常服务；
+新版本校验通过（条数 + 冒烟查询）后原子切换别名，再清理旧版本（见 collection_versions.py）。
+
+文档 ID 由对话 ID / 轮次 / 角色决定，metadata.content_hash 记录正文哈希。
+--incremental 不删集合，只编码新增和正文变化的文档，metadata 变化的只更新 metadata，
+输入中已不存在的文档从集合中删除，服务不需要停机。
 """
+import argparse
+import hashlib
+import itertools
 import json
+import os
+import sys
+import time
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
+from typing import Iterable, Iterator
 import chromadb
+import numpy as np
 
+from bulk_encoder import BulkEncoder, available_cpus
+from embedding_cache import CachedEncoder, EmbeddingCache
+from vector_store import NumpyStore, ParentStore, QuantizedStore
+from sparse_index import BM25Index
+from rag_engine import PROFILES, DEFAULT_PROFILE, index_paths, parent_store_path, derived_paths
+from collection_versions import (resolve_collection, new_version_name, switch_alias, bump_generation,
+                                 gc_versions, drop_version)
+from dedup import near_duplicate_representatives
+from product_detector import load_catalog_products
 
-def load_dialogues(jsonl_path: str) -> list[dict]:
-    """读取 JSONL 对话数据"""
-    dialogues = []
+
+def iter_dialogues(jsonl_path: str) -> Iterator[dict]:
+    """逐行读取 JSONL 对话数据（生成器）"""
     with open(jsonl_path, 'r', encoding='utf-8') as f:
         for line in f:
-            dialogues.append(json.loads(line.strip()))
-    return dialogues
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def load_dialogues(jsonl_path: str) -> list[dict]:
+    """读取 JSONL 对话数据"""
+    return list(iter_dialogues(jsonl_path))
+
+
+def is_holdout(dialogue_id, fraction: float) -> bool:
+    """按对话 ID 哈希确定性地留出一部分对话不入库（benchmark.py 用它们做召回评测的查询）"""
+    if fraction <= 0:
+        return False
+    digest = hashlib.sha1(str(dialogue_id).encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") / 2 ** 32 < fraction
+
+
+def content_hash(document: str) -> str:
+    """文档正文哈希，增量导入据此判断是否需要重新编码"""
+    return hashlib.sha1(document.encode("utf-8")).hexdigest()[:16]
+
+
+def _utterance_id(d: dict, occurrence: int = 0) -> str:
+    doc_id = f"doc_{d['id']}_{d['round']}_{d['role']}"
+    return f"{doc_id}_{occurrence}" if occurrence else doc_id
+
+
+def _utterance_document(doc_id: str, d: dict) -> tuple[str, dict, str]:
+    # 文档内容：产品 + 角色 + 对话内容
+    doc = f"产品:{d['product']} 角色:{d['role']} 轮次:{d['round']} 内容:{d['content']}"
+    metadata = {
+        "product": d["product"],
+        "role": d["role"],
+        "round": d["round"],
+        "dialogue_id": d["id"],
+        "parent_id": f"conv_{d['id']}"
+    }
+    return doc, metadata, doc_id
+
+
+def _conversation_document(conv_id, product: str, messages: list[dict]) -> tuple[str, dict, str]:
+    # 按轮次排序，同一轮买家在前
+    messages = sorted(messages, key=lambda x: (x['round'], 0 if x['role'] == 'buyer' else 1))
+
+    text_parts = [f"产品: {product}"]
+    for msg in messages:
+        role_name = "客户" if msg['role'] == 'buyer' else "客服"
+        text_parts.append(f"{role_name}: {msg['content']}")
 
+    metadata = {
+        'product': product,
+        'dialogue_id': conv_id,
+        'rounds': len(set(m['round'] for m in messages))
+    }
+    return "\n".join(text_parts), metadata, f"conv_{conv_id}"
 
-def create_documents(dialogues: list[dict]) -> tuple[list[str], list[dict], list[str]]:
+
+def _message(d: dict) -> dict:
+    return {
+        'round': d.get('round', 0),
+        'role': d.get('role', ''),
+        'content': d.get('content', '')
+    }
+
+
+def create_documents(dialogues: list[dict], granularity: str = "utterance") -> tuple[list[str], list[dict], list[str]]:
     """
     将对话转换为文档格式
     返回: (documents, metadatas, ids)
     """
-    documents = []
-    metadatas = []
-    ids = []
+    if granularity == "conversation":
+        return create_conversation_documents(dialogues)
+    if granularity != "utterance":
+        raise ValueError(f"未知的文档粒度: {granularity}")
+    return _unzip(iter_documents(dialogues, granularity))
 
-    for i, d in enumerate(dialogues):
-        # 文档内容：产品 + 角色 + 对话内容
-        doc = f"产品:{d['product']} 角色:{d['role']} 轮次:{d['round']} 内容:{d['content']}"
-        documents.append(doc)
 
-        metadatas.append({
-            "product": d["product"],
-            "role": d["role"],
-            "round": d["round"],
-            "dialogue_id": d["id"]
-        })
+def create_conversation_documents(dialogues: list[dict]) -> tuple[list[str], list[dict], list[str]]:
+    """按对话 ID 分组，每个完整对话生成一个文档"""
+    conversations = {}
+    for d in dialogues:
+        conv = conversations.setdefault(d['id'], {'product': d.get('product', ''), 'messages': []})
+        conv['messages'].append(_message(d))
+    return _unzip(_conversation_document(conv_id, conv['product'], conv['messages'])
+                  for conv_id, conv in conversations.items())
 
-        ids.append(f"doc_{i}")
 
+def _unzip(records: Iterable[tuple]) -> tuple[list, list, list]:
+    documents, metadatas, ids = [], [], []
+    for doc, meta, doc_id in records:
+        documents.append(doc)
+        metadatas.append(meta)
+        ids.append(doc_id)
     return documents, metadatas, ids
 
 
+def iter_documents(dialogues: Iterable[dict], granularity: str = "utterance") -> Iterator[tuple[str, dict, str]]:
+    """
+    create_documents 的流式版本，逐个产出 (document, metadata, id)
+
+    要求同一对话的发言在输入中相邻（generate_dialogues.py 的输出即如此），
+    这样每次只需记住当前这一个对话，内存与数据量无关。
+    """
+    if granularity == "utterance":
+        # ID 取 (对话, 轮次, 角色)，追加数据不会改变已有文档的 ID；同一对话内同一键重复出现时加序号
+        for _, rows in itertools.groupby(dialogues, key=lambda d: d['id']):
+            occurrences = {}
+            for d in rows:
+                key = (d['round'], d['role'])
+                occurrence = occurrences[key] = occurrences.get(key, -1) + 1
+                yield _utterance_document(_utterance_id(d, occurrence), d)
+    elif granularity == "conversation":
+        seen = set()
+        for conv_id, rows in itertools.groupby(dialogues, key=lambda d: d['id']):
+            if conv_id in seen:
+                raise ValueError(f"对话 {conv_id} 的发言在文件中不相邻，无法流式导入")
+            seen.add(conv_id)
+            rows = list(rows)
+            yield _conversation_document(conv_id, rows[0].get('product', ''), [_message(d) for d in rows])
+    else:
+        raise ValueError(f"未知的文档粒度: {granularity}")
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def peak_memory_mb() -> float:
+    """进程峰值常驻内存（MB），不支持的平台返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位是 KB，macOS 是字节
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def indexed_metadatas(collection, page_size: int = 4096) -> dict[str, dict]:
+    """集合中已有文档的 {id: metadata}，分页读取，不取向量和正文"""
+    existing = {}
+    for offset in range(0, collection.count(), page_size):
+        page = collection.get(limit=page_size, offset=offset, include=["metadatas"])
+        existing.update(zip(page["ids"], page["metadatas"]))
+    return existing
+
+
+def _replace(collection, existing: dict, documents: list, metadatas: list, ids: list, embeddings: list):
+    """
+    upsert 一批文档
+
+    Chroma 的 upsert 会与旧 metadata 合并，旧 metadata 多出的键（如去掉 --dedup 后的 cluster_size）
+    不会消失，这些文档先删除再写入。
+    """
+    shrunk = [doc_id for doc_id, meta in zip(ids, metadatas)
+              if doc_id in existing and not existing[doc_id].keys() <= meta.keys()]
+    if shrunk:
+        collection.delete(ids=shrunk)
+    collection.upsert(documents=documents, embeddings=embeddings, metadatas=metadatas, ids=ids)
+
+
+def incremental_import(collection, encoder, records: Iterable[tuple], batch_size: int = 2048,
+                       encode_batch_size: int = 64) -> dict:
+    """
+    增量导入：与集合中已有文档按 ID 比对
+
+    - 新 ID、或 content_hash 变化：编码后 upsert
+    - 只有 metadata 变化：复用已有向量重新写入，不重新编码
+    - 输入中已不存在的 ID：删除
+
+    天然幂等，中断后重新运行即可，不需要检查点。
+
+    Returns:
+        {added, updated, metadata_only, unchanged, deleted}
+    """
+    existing = indexed_metadatas(collection, batch_size)
+    counts = {"added": 0, "updated": 0, "metadata_only": 0, "unchanged": 0, "deleted": 0}
+    seen = set()
+    start = time.perf_counter()
+    processed = 0
+
+    for chunk in batched(records, batch_size):
+        to_encode, to_update = [], []
+        for doc, meta, doc_id in chunk:
+            seen.add(doc_id)
+            old = existing.get(doc_id)
+            if old is None:
+                counts["added"] += 1
+                to_encode.append((doc, meta, doc_id))
+            elif old.get("content_hash") != meta["content_hash"]:
+                counts["updated"] += 1
+                to_encode.append((doc, meta, doc_id))
+            elif old != meta:
+                counts["metadata_only"] += 1
+                to_update.append((doc, meta, doc_id))
+            else:
+                counts["unchanged"] += 1
+
+        if to_encode:
+            documents, metadatas, ids = _unzip(to_encode)
+            embeddings = encoder.encode(documents, batch_size=encode_batch_size, show_progress_bar=False)
+            _replace(collection, existing, documents, metadatas, ids, embeddings.tolist())
+        if to_update:
+            documents, metadatas, ids = _unzip(to_update)
+            stored = collection.get(ids=ids, include=["embeddings"])
+            by_id = dict(zip(stored["ids"], stored["embeddings"]))
+            _replace(collection, existing, documents, metadatas, ids, [by_id[doc_id] for doc_id in ids])
+
+        processed += len(chunk)
+        rate = processed / (time.perf_counter() - start)
+        print(f"  已比对 {processed} 条（编码 {counts['added'] + counts['updated']} 条，{rate:.0f} 条/s，"
+              f"峰值内存 {peak_memory_mb()} MB）", flush=True)
+
+    stale = [doc_id for doc_id in existing if doc_id not in seen]
+    for chunk in batched(stale, batch_size):
+        collection.delete(ids=chunk)
+    counts["deleted"] = len(stale)
+    return counts
+
+
+def checkpoint_path(db_path: Path, collection: str) -> Path:
+    return Path(db_path) / f"import_checkpoint_{collection}.json"
+
+
+def load_checkpoint(path: Path, fingerprint: dict) -> dict:
+    """返回 {"collection": 正在构建的版本, "rows": 已导入的文档数}；没有检查点或数据 / 配置已变化时返回 None"""
+    if not path.exists():
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("fingerprint") != fingerprint or "collection" not in checkpoint:
+        return None
+    return checkpoint
+
+
+def checkpoint_collection(path: Path) -> str:
+    """检查点对应的未完成版本（清理旧版本时不能删）"""
+    if not path.exists():
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f).get("collection")
+
+
+def save_checkpoint(path: Path, fingerprint: dict, collection: str, rows: int):
+    """先写临时文件再原子替换，中途被杀也不会留下半个检查点"""
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({"fingerprint": fingerprint, "collection": collection, "rows": rows}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+SMOKE_QUERY = "客户说价格太贵了"
+
+
+def validate_collection(collection, expected: int, encoder, query: str = SMOKE_QUERY) -> tuple[list[str], list[str]]:
+    """
+    上线前校验：写入了文档、条数与写入的一致，冒烟查询能返回结果
+
+    Returns:
+        (问题列表（空表示通过）, 冒烟查询返回的文档)
+    """
+    problems = []
+    count = collection.count()
+    if not expected:
+        problems.append("没有写入任何文档（数据文件为空或全部被过滤）")
+    if count != expected:
+        problems.append(f"条数 {count} 与写入的 {expected} 不一致")
+    documents = []
+    if expected:
+        results = collection.query(query_embeddings=encoder.encode([query]).tolist(), n_results=min(3, expected))
+        documents = results['documents'][0]
+        if not documents:
+            problems.append("冒烟查询没有返回结果")
+    return problems, documents
+
+
 def main():
+    parser = argparse.ArgumentParser(description="导入对话数据到向量库")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default=DEFAULT_PROFILE,
+                        help="预置配置（Embedding 模型 + 文档粒度 + 集合名）")
+    parser.add_argument("--encoder", help="覆盖配置中的 Embedding 模型")
+    parser.add_argument("--granularity", choices=["utterance", "conversation"], help="覆盖配置中的文档粒度")
+    parser.add_argument("--collection", help="覆盖配置中的集合名")
+    parser.add_argument("--export-numpy", action="store_true",
+                        help="同时导出 NumPy 索引（RAG_BACKEND=numpy 时使用）")
+    parser.add_argument("--numpy-dtype", choices=["float32", "float16"], default="float32",
+                        help="NumPy 索引的向量存储精度")
+    parser.add_argument("--quantize", action="store_true",
+                        help="导出 NumPy 索引并生成 int8 / 二值量化向量（RAG_BACKEND=int8 或 binary 时使用）")
+    parser.add_argument("--dedup", action="store_true",
+                        help="折叠近重复文档（只差产品名 / 价格的模板发言），每簇保留一条并记录 cluster_size")
+    parser.add_argument("--dedup-threshold", type=float, default=0.8, help="近重复判定的 Jaccard 相似度阈值")
+    parser.add_argument("--dedup-scope", choices=["product", "global"], default="product",
+                        help="product: 同产品内折叠（保留按产品过滤）；global: 跨产品折叠")
+    parser.add_argument("--data", help="对话数据 JSONL，默认为项目根目录的 dialogue_data.jsonl")
+    parser.add_argument("--encode-batch-size", type=int, default=64, help="每次前向编码的文档数（同长度桶内）")
+    parser.add_argument("--encode-workers", type=int, default=1,
+                        help="编码进程数，每个进程加载一份模型；内存够时设为 2~4 可用满 CPU")
+    parser.add_argument("--encode-threads", type=int, help="每个编码进程的线程数，默认可用核数 / 进程数")
+    parser.add_argument("--embedding-cache-dir", help="磁盘向量缓存目录，默认 sales_assistant/embedding_cache")
+    parser.add_argument("--embedding-cache-size", type=int, default=200_000, help="磁盘向量缓存容量（条，首次创建时生效）")
+    parser.add_argument("--no-embedding-cache", action="store_true", help="不读写磁盘向量缓存，全部重新编码")
+    parser.add_argument("--add-batch-size", type=int, default=2048,
+                        help="每次写入向量库的文档数（不超过向量库的单批上限），也是检查点间隔")
+    parser.add_argument("--restart", action="store_true", help="忽略检查点，重新构建一个新版本")
+    parser.add_argument("--incremental", action="store_true",
+                        help="增量导入：直接更新当前版本，只编码新增 / 变化的文档，并删除输入中已不存在的文档")
+    parser.add_argument("--holdout", type=float, default=0.0,
+                        help="留出这一比例的对话不入库，供 benchmark.py 评测召回（线上导入保持 0）")
+    parser.add_argument("--keep-versions", type=int, default=2,
+                        help="切换后保留的版本数（含新版本），其余旧版本连同衍生索引删除")
+    args = parser.parse_args()
+
+    config = dict(PROFILES[args.profile])
+    for key in ("encoder", "granularity", "collection"):
+        if getattr(args, key):
+            config[key] = getattr(args, key)
+
     # 路径配置
-    data_path = Path(__file__).parent.parent / "dialogue_data.jsonl"
+    data_path = Path(args.data) if args.data else Path(__file__).parent.parent / "dialogue_data.jsonl"
     db_path = Path(__file__).parent / "chroma_db"
+    alias = config["collection"]
+    live = resolve_collection(db_path, alias)
 
     print(f"📂 数据文件: {data_path}")
-    print(f"📦 向量库路径: {db_path}")
+    print(f"📦 向量库路径: {db_path}（{alias} 当前版本: {live}）")
+    print(f"⚙️  配置: {config}")
+
+    # 1. 编码器：磁盘向量缓存 + 批量编码（模型在首次未命中缓存时加载，首次运行需要下载）
+    model = BulkEncoder(config['encoder'], workers=args.encode_workers, threads_per_worker=args.encode_threads,
+                        batch_size=args.encode_batch_size)
+    encoder = model
+    if not args.no_embedding_cache:
+        encoder = CachedEncoder(model, EmbeddingCache(config['encoder'], args.embedding_cache_dir,
+                                                      max_entries=args.embedding_cache_size),
+                                flush_on_put=True)
+    print(f"\n✅ 编码器: {config['encoder']}（{model.workers} 个编码进程 x {model.threads_per_worker} 线程，"
+          f"可用 CPU {available_cpus()}，向量缓存{'关闭' if args.no_embedding_cache else '开启'}）")
 
-    # 1. 加载对话数据
-    print("\n⏳ 加载对话数据...")
-    dialogues = load_dialogues(str(data_path))
-    print(f"✅ 加载了 {len(dialogues)} 条对话")
+    # 2. 文档流：每次从 JSONL 重新读取，全程不把语料整体放进内存
+    def dialogues():
+        return (d for d in iter_dialogues(str(data_path)) if not is_holdout(d["id"], args.holdout))
 
-    # 2. 加载 embedding 模型
-    print("\n⏳ 加载 BGE-M3 模型（首次运行需要下载）...")
-    model = SentenceTransformer('BAAI/bge-m3')
-    print("✅ 模型加载完成")
+    def stream_documents():
+        return iter_documents(dialogues(), config["granularity"])
 
-    # 3. 准备文档
-    documents, metadatas, ids = create_documents(dialogues)
+    # 近重复折叠需要全局视图，先流式扫一遍只保留 MinHash 签名，得到要保留的代表文档
+    representatives = None
+    if args.dedup:
+        print("\n⏳ 近重复折叠...")
+        products = load_catalog_products()
+        if args.dedup_scope == "global":
+            products += sorted({d["product"] for d in dialogues()})
+        total = sum(1 for _ in stream_documents())
+        representatives = near_duplicate_representatives(
+            stream_documents(), threshold=args.dedup_threshold, scope=args.dedup_scope, products=products)
+        print(f"✅ 近重复折叠: {total} -> {len(representatives)} 个文档（{len(representatives) / total:.1%}）")
 
-    # 4. 生成 embeddings
-    print("\n⏳ 生成向量...")
-    embeddings = model.encode(documents, show_progress_bar=True)
-    print(f"✅ 生成了 {len(embeddings)} 个向量，维度: {embeddings.shape[1]}")
+    def records():
+        for doc, meta, doc_id in stream_documents():
+            meta = dict(meta, content_hash=content_hash(doc))
+            if representatives is None:
+                yield doc, meta, doc_id
+            elif doc_id in representatives:
+                yield doc, dict(meta, cluster_size=representatives[doc_id]), doc_id
 
-    # 5. 存入 Chroma
-    print("\n⏳ 存入向量库...")
     client = chromadb.PersistentClient(path=str(db_path))
+    add_batch_size = min(args.add_batch_size, client.max_batch_size)
+    collection_metadata = {
+        "description": "跨境电商客服对话数据",
+        "encoder": config["encoder"],
+        "granularity": config["granularity"],
+        "holdout": args.holdout
+    }
+    ckpt_path = checkpoint_path(db_path, alias)
 
-    # 删除旧集合（如果存在）
-    try:
-        client.delete_collection("dialogues")
-    except:
-        pass
-
-    collection = client.create_collection(
-        name="dialogues",
-        metadata={"description": "跨境电商客服对话数据"}
-    )
-
-    collection.add(
-        documents=documents,
-        embeddings=embeddings.tolist(),
-        metadatas=metadatas,
-        ids=ids
-    )
-
-    print(f"✅ 成功导入 {collection.count()} 条数据到向量库")
-
-    # 6. 测试检索
-    print("\n🔍 测试检索...")
-    test_query = "客户说价格太贵了"
-    query_embedding = model.encode([test_query])
-
-    results = collection.query(
-        query_embeddings=query_embedding.tolist(),
-        n_results=3
-    )
-
-    print(f"查询: '{test_query}'")
+    if args.incremental:
+        # 3. 增量导入：直接更新当前版本，集合不存在时新建；编码器 / 粒度不一致时向量不可比，只能全量重建
+        # （get_or_create_collection 会用传入的 metadata 覆盖原有的，不能用来校验）
+        try:
+            collection = client.get_collection(live)
+        except ValueError:
+            collection = client.create_collection(name=live, metadata=collection_metadata)
+        indexed = collection.metadata or {}
+        for key in ("encoder", "granularity", "holdout"):
+            if indexed.get(key) not in (None, collection_metadata[key]):
+                raise SystemExit(f"❌ 集合 {live} 的 {key} 为 {indexed[key]}，"
+                                 f"与配置的 {collection_metadata[key]} 不一致，请去掉 --incremental 全量导入")
+        print(f"\n⏳ 增量导入（每批 {add_batch_size} 条，编码批大小 {args.encode_batch_size}）...")
+        start = time.perf_counter()
+        counts = incremental_import(collection, encoder, records(), add_batch_size, args.encode_batch_size)
+        expected = counts['added'] + counts['updated'] + counts['metadata_only'] + counts['unchanged']
+        print(f"✅ 增量导入完成（{time.perf_counter() - start:.1f}s）: 新增 {counts['added']}，"
+              f"正文变化 {counts['updated']}，仅 metadata 变化 {counts['metadata_only']}，"
+              f"未变 {counts['unchanged']}，删除 {counts['deleted']}；集合现有 {collection.count()} 条")
+    else:
+        # 3. 全量导入：检查点与数据文件 / 配置一致时接着上次的进度导入
+        stat = data_path.stat()
+        fingerprint = {
+            "data": str(data_path.resolve()),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "config": config,
+            "dedup": [args.dedup_threshold, args.dedup_scope] if args.dedup else None,
+            "holdout": args.holdout,
+        }
+        checkpoint = None if args.restart else load_checkpoint(ckpt_path, fingerprint)
+
+        collection = None
+        if checkpoint is not None:
+            try:
+                collection = client.get_collection(checkpoint["collection"])
+                done = checkpoint["rows"]
+                print(f"\n↩️  从检查点继续：{collection.name} 已导入 {done} 条")
+            except ValueError:
+                pass
+        if collection is None:
+            # 写入新版本，线上版本不动，校验通过后再切换别名
+            # 记录编码器和粒度，RAGEngine 加载时据此校验
+            collection = client.create_collection(name=new_version_name(alias), metadata=collection_metadata)
+            done = 0
+            save_checkpoint(ckpt_path, fingerprint, collection.name, done)
+            print(f"\n🆕 新版本: {collection.name}")
+
+        # 4. 分块编码 + 写入：每块 add_batch_size 条，写完更新检查点
+        #    用 upsert，写入成功但检查点没来得及更新时，重跑这一块也不会重复
+        print(f"\n⏳ 生成向量并写入向量库（每批 {add_batch_size} 条，编码批大小 {args.encode_batch_size}）...")
+        start = time.perf_counter()
+        imported = 0
+        for chunk in batched(itertools.islice(records(), done, None), add_batch_size):
+            documents, metadatas, ids = _unzip(chunk)
+            embeddings = encoder.encode(documents, batch_size=args.encode_batch_size, show_progress_bar=False)
+            collection.upsert(
+                documents=documents,
+                embeddings=embeddings.tolist(),
+                metadatas=metadatas,
+                ids=ids
+            )
+            done += len(ids)
+            imported += len(ids)
+            save_checkpoint(ckpt_path, fingerprint, collection.name, done)
+            rate = imported / (time.perf_counter() - start)
+            print(f"  已导入 {done} 条（本次 {imported} 条，{rate:.0f} 条/s，峰值内存 {peak_memory_mb()} MB）", flush=True)
+
+        elapsed = time.perf_counter() - start
+        print(f"✅ 成功导入 {collection.count()} 条数据到向量库"
+              f"（本次 {imported} 条，{elapsed:.1f}s，{imported / elapsed if elapsed else 0:.0f} 条/s）")
+        expected = done
+
+    # 衍生索引按版本命名，旧版本的文件在切换前继续服务
+    numpy_index_path, sparse_index_path = index_paths(collection.name)
+
+    # 5. 衍生索引：各自从数据文件或集合流式重建
+    # BM25 稀疏索引（hybrid / sparse 检索模式使用）
+    sparse_index = BM25Index.build_from_records(
+        (doc_id, doc, meta["product"]) for doc, meta, doc_id in records())
+    sparse_index.save(str(sparse_index_path))
+    print(f"✅ 已生成 BM25 索引: {sparse_index_path}（{len(sparse_index.postings)} 个词）")
+
+    # 父文档：发言级索引命中后取回完整对话（先取 ID / 元数据，正文第二遍流式写出）
+    if config["granularity"] == "utterance":
+        parent_path = parent_store_path(collection.name)
+
+        def conversations():
+            return iter_documents(dialogues(), "conversation")
+
+        _, parent_metadatas, parent_ids = _unzip((None, meta, doc_id) for _, meta, doc_id in conversations())
+        ParentStore.write(str(parent_path), parent_ids, (doc for doc, _, _ in conversations()), parent_metadatas)
+        print(f"✅ 已生成父文档: {parent_path}（{len(parent_ids)} 个对话）")
+
+    export_numpy, quantize, numpy_dtype = args.export_numpy or args.quantize, args.quantize, args.numpy_dtype
+    embeddings_file = numpy_index_path / NumpyStore.EMBEDDINGS_FILE
+    if args.incremental and embeddings_file.exists():
+        # 增量导入更新的是当前版本：已有的 NumPy / 量化索引要一起重新导出，否则热加载后与集合不一致
+        if not export_numpy:
+            numpy_dtype = str(np.load(embeddings_file, mmap_mode="r").dtype)
+        export_numpy = True
+        quantize = quantize or (numpy_index_path / QuantizedStore.INT8_FILE).exists()
+    if export_numpy:
+        NumpyStore.write_from_collection(str(numpy_index_path), collection, dtype=numpy_dtype,
+                                         page_size=add_batch_size)
+        print(f"✅ 已导出 NumPy 索引: {numpy_index_path}（{numpy_dtype}）")
+    if quantize:
+        QuantizedStore.quantize(str(numpy_index_path))
+        print("✅ 已生成量化向量: int8 1 字节/维，二值 1 位/维")
+
+    if isinstance(encoder, CachedEncoder):
+        stats = encoder.cache.stats()
+        print(f"🗄️  向量缓存: 本次实际编码 {encoder.encoded} 条，缓存 {stats['entries']} / {stats['capacity']} 条，"
+              f"累计命中率 {stats['hit_rate']:.1%}")
+    print(f"📈 峰值内存: {peak_memory_mb()} MB")
+
+    # 6. 校验：条数 + 冒烟查询
+    print("\n🔍 校验...")
+    problems, documents = validate_collection(collection, expected, encoder)
+    model.close()
+
+    print(f"查询: '{SMOKE_QUERY}'")
     print("相似结果:")
-    for i, doc in enumerate(results['documents'][0]):
+    for i, doc in enumerate(documents):
         print(f"  {i+1}. {doc[:80]}...")
+    if problems:
+        if collection.name == live:
+            # 增量导入直接改写了当前版本，别名没变，但服务重新加载（或重启）后就会用上这份数据
+            raise SystemExit(f"❌ {live} 校验失败: {'；'.join(problems)}。增量更新已写入 {live}，"
+                             f"未通知服务重新加载；请修复数据后重新导入")
+        # 校验失败的新版本没有上线：连同衍生文件和检查点一起删除，下次从头导入而不是续上这个版本
+        drop_version(client, collection.name, derived_paths)
+        ckpt_path.unlink(missing_ok=True)
+        raise SystemExit(f"❌ {collection.name} 校验失败: {'；'.join(problems)}。已删除该版本，{alias} 仍指向 {live}")
+    ckpt_path.unlink(missing_ok=True)
+
+    # 7. 切换别名（运行中的服务几秒内自动加载新版本），清理旧版本
+    if collection.name != live:
+        switch_alias(db_path, alias, collection.name)
+        print(f"✅ 已切换: {alias} -> {collection.name}（原 {live}）")
+        # 另一个导入进程可能正在构建新版本（有检查点），不能删
+        protect = [v for v in [checkpoint_collection(ckpt_path)] if v]
+        removed = gc_versions(client, db_path, alias, keep=args.keep_versions, protect=protect,
+                              derived_paths=derived_paths)
+        if removed:
+            print(f"🧹 已清理旧版本: {', '.join(removed)}")
+    else:
+        # 增量导入更新的是当前版本，版本名不变：递增 generation 让运行中的服务重新加载衍生索引
+        generation = bump_generation(db_path, alias)
+        print(f"✅ 已通知服务重新加载: {alias} -> {live}#{generation}")
 
     print("\n✨ 数据导入完成！")
 
@@ -1,34 +1,136 @@
 """
 Ollama 本地 LLM 客户端 - 双模型架构
 """
+import json
+import queue
+import random
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
 import requests
+from requests.adapters import HTTPAdapter
 
 
-class DualModelClient:
-    """双模型客户端：qwen2.5 分析 + sales-assistant 话术"""
+# 流式分支结束标记
+_STREAM_END = object()
+
+
+class OllamaTransport:
+    """
+    Ollama HTTP 传输层
+
+    - 共享 Session + 连接池（keep-alive），池大小与服务端并发对齐
+    - 连接 / 读取超时分开配置，避免一次卡死的调用永久占住 worker
+    - 5xx 和连接被重置时有界重试，退避时间带随机抖动
+    """
+
+    RETRY_STATUS = {500, 502, 503, 504}
+    # 非流式调用读取 body 时连接被重置（复用了服务端已关闭的 keep-alive 连接）也重试
+    RETRY_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError)
+
+    def __init__(self, base_url: str, pool_size: int = 8, connect_timeout: float = 3.0,
+                 read_timeout: float = 120.0, max_retries: int = 2, backoff: float = 0.5):
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.retries = 0
+
+        # 重试由本类处理，adapter 自身不重试
+        self._adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+
+    def _sleep_backoff(self, attempt: int):
+        """指数退避 + full jitter"""
+        self.retries += 1
+        time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def post(self, path: str, payload: dict, stream: bool = False) -> requests.Response:
+        """
+        发送 POST 请求
 
-    def __init__(self, base_url: str = "http://localhost:11434"):
+        只在拿到完整响应之前重试（连接失败 / 连接重置 / 读 body 时连接断开 / 5xx）；
+        读取超时不重试，流式响应开始后出错也不重试。
+        """
+        url = f"{self.base_url}{path}"
+        retry_errors = requests.exceptions.ConnectionError if stream else self.RETRY_ERRORS
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.post(
+                    url,
+                    json=payload,
+                    stream=stream,
+                    timeout=(self.connect_timeout, self.read_timeout)
+                )
+            except retry_errors:
+                if attempt == self.max_retries:
+                    raise
+                self._sleep_backoff(attempt)
+                continue
+
+            if response.status_code in self.RETRY_STATUS and attempt < self.max_retries:
+                response.close()
+                self._sleep_backoff(attempt)
+                continue
+            return response
+
+    def stats(self) -> dict:
+        """连接池统计：新建连接数 vs 复用次数"""
+        created = 0
+        requests_total = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            created += pool.num_connections
+            requests_total += pool.num_requests
+        return {
+            "requests": requests_total,
+            "connections_created": created,
+            "connections_reused": max(requests_total - created, 0),
+            "retries": self.retries,
+        }
+
+    def close(self):
+        self.session.close()
+
+
+class _DualModelBase:
+    """双模型客户端公共部分：提示词构建与结果合并（同步 / 异步客户端共用）"""
+
+    def __init__(self, base_url: str = "http://localhost:11434", keep_alive: str = "30m"):
         self.base_url = base_url
         self.analyst_model = "qwen2.5"  # 分析模型
         self.sales_model = "sales-assistant"  # 话术模型
-
-    def _call_model(self, model: str, system_prompt: str, user_message: str) -> str:
-        """调用指定模型"""
-        response = requests.post(
-            f"{self.base_url}/api/chat",
-            json={
-                "model": model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                "stream": False
-            }
-        )
-        if response.status_code == 200:
-            return response.json()["message"]["content"]
-        else:
-            raise Exception(f"Ollama 调用失败: {response.status_code}")
+        self.keep_alive = keep_alive  # 模型在 Ollama 中的常驻时间
+
+    def _chat_payload(self, model: str, system_prompt: str, user_message: str, stream: bool) -> dict:
+        """构建 /api/chat 请求体"""
+        return {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_message}
+            ],
+            "stream": stream,
+            "keep_alive": self.keep_alive
+        }
+
+    def _warm_payload(self, model: str) -> dict:
+        """不带 prompt 的 /api/generate 请求只加载模型，不做生成"""
+        return {"model": model, "keep_alive": self.keep_alive}
+
+    def _parse_stream_line(self, line) -> tuple[str, bool]:
+        """解析流式响应中的一行 NDJSON，返回 (content, done)"""
+        chunk = json.loads(line)
+        if chunk.get("error"):
+            raise Exception(f"Ollama 调用失败: {chunk['error']}")
+        return chunk.get("message", {}).get("content", ""), bool(chunk.get("done"))
 
     def _check_price_keywords(self, message: str) -> bool:
         """检测是否涉及价格关键词"""
@@ -69,19 +171,9 @@ class DualModelClient:
                 return most_common[0][0]
         return "通用产品"
 
-    def generate(self, system_prompt: str, user_message: str) -> str:
-        """
-        双模型生成：
-        1. qwen2.5 分析客户心理、策略和避坑提醒
-        2. sales-assistant 生成人味话术
-        3. 价格关键词触发时显示价格参考
-        4. 显示相关产品标记
-        """
-        # Step 0: 提取相关产品类型
-        product_type = self._extract_product_from_context(system_prompt)
-
-        # Step 1: 用 qwen2.5 分析（包含避坑提醒）
-        analysis_prompt = f"""你是跨境电商培训师，分析客户问题并给出策略建议。
+    def _build_analysis_prompt(self, product_type: str) -> str:
+        """分析模型的系统提示词（包含避坑提醒）"""
+        return f"""你是跨境电商培训师，分析客户问题并给出策略建议。
 当前咨询产品：{product_type}
 
 请按以下格式回复（简洁）：
@@ -98,10 +190,9 @@ class DualModelClient:
 - 这种情况下新手容易犯什么错误
 - 千万不要说什么话"""
 
-        analysis = self._call_model(self.analyst_model, analysis_prompt, user_message)
-
-        # Step 2: 用 sales-assistant 生成话术（带产品信息）
-        sales_prompt = f"""你是经验丰富的跨境电商销售员，说话要有人味。
+    def _build_sales_prompt(self, product_type: str, user_message: str) -> str:
+        """话术模型的系统提示词（带产品信息）"""
+        return f"""你是经验丰富的跨境电商销售员，说话要有人味。
 当前产品：{product_type}
 
 客户说：{user_message}
@@ -111,17 +202,18 @@ class DualModelClient:
 - 中英文混用自然
 - 有底线但不生硬"""
 
-        sales_reply = self._call_model(self.sales_model, sales_prompt, user_message)
+    def _build_price_info(self, system_prompt: str, user_message: str) -> str:
+        """价格关键词触发时，生成价格参考段落"""
+        if not self._check_price_keywords(user_message):
+            return ""
+        price_ref = self._extract_price_from_context(system_prompt)
+        if not price_ref:
+            return ""
+        return f"\n\n---\n\n## [价格参考]\n\n{price_ref}\n\n> 注：以上价格来自历史成交案例，实际价格请根据数量和当前市场情况调整"
 
-        # Step 3: 检测价格关键词，提取价格参考
-        price_info = ""
-        if self._check_price_keywords(user_message):
-            price_ref = self._extract_price_from_context(system_prompt)
-            if price_ref:
-                price_info = f"\n\n---\n\n## [价格参考]\n\n{price_ref}\n\n> 注：以上价格来自历史成交案例，实际价格请根据数量和当前市场情况调整"
-
-        # 合并输出（无 emoji，带产品标记）
-        result = f"""## [相关产品: {product_type}]
+    def _compose_result(self, product_type: str, sales_reply: str, analysis: str, price_info: str) -> str:
+        """合并输出（无 emoji，带产品标记）"""
+        return f"""## [相关产品: {product_type}]
 
 ---
 
@@ -135,12 +227,258 @@ class DualModelClient:
 
 {analysis}{price_info}"""
 
+
+class DualModelClient(_DualModelBase):
+    """双模型客户端：qwen2.5 分析 + sales-assistant 话术"""
+
+    # 传入 cancel 时等待分支的轮询间隔（秒）
+    CANCEL_POLL = 0.2
+
+    def __init__(self, base_url: str = "http://localhost:11434",
+                 concurrent: bool = True, max_workers: int = 8, timeout: float = 120.0,
+                 connect_timeout: float = 3.0, max_retries: int = 2):
+        """
+        Args:
+            base_url: Ollama 服务地址
+            concurrent: generate 是否并发执行分析 / 话术两个分支（流式生成始终并发）
+            max_workers: 非流式调用的线程池上限（所有请求共享，超出的调用排队），连接池按同样大小配置
+            timeout: 单次模型调用超时（秒），同时作为读取超时
+            connect_timeout: 建立连接超时（秒）
+            max_retries: 5xx / 连接重置时的最大重试次数
+        """
+        super().__init__(base_url)
+        self.concurrent = concurrent
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ollama")
+        self.transport = OllamaTransport(
+            base_url,
+            pool_size=max_workers,
+            connect_timeout=connect_timeout,
+            read_timeout=timeout,
+            max_retries=max_retries
+        )
+
+    def _call_model(self, model: str, system_prompt: str, user_message: str) -> str:
+        """调用指定模型"""
+        response = self.transport.post(
+            "/api/chat",
+            self._chat_payload(model, system_prompt, user_message, stream=False)
+        )
+        if response.status_code == 200:
+            return response.json()["message"]["content"]
+        else:
+            raise Exception(f"Ollama 调用失败: {response.status_code}")
+
+    def warm_model(self, model: str):
+        """让 Ollama 加载模型并保持常驻"""
+        response = self.transport.post("/api/generate", self._warm_payload(model))
+        if response.status_code != 200:
+            raise Exception(f"Ollama 预热失败: {model} {response.status_code}")
+
+    def _stream_model(self, model: str, system_prompt: str, user_message: str, cancel: threading.Event = None,
+                      responses: list = None):
+        """
+        流式调用指定模型，逐块产出 token
+
+        Ollama 在 stream 模式下返回 NDJSON，每行一个 chunk，最后一行 done=true。
+        cancel 被置位时不再发起请求 / 关闭连接并提前结束；responses 不为空时登记打开的响应，
+        调用方取消时可以直接关闭它，不必等到下一行到达。
+        """
+        if cancel is not None and cancel.is_set():
+            return
+        with self.transport.post(
+            "/api/chat",
+            self._chat_payload(model, system_prompt, user_message, stream=True),
+            stream=True
+        ) as response:
+            if responses is not None:
+                responses.append(response)
+            if cancel is not None and cancel.is_set():
+                return
+            if response.status_code != 200:
+                raise Exception(f"Ollama 调用失败: {response.status_code}")
+
+            for line in response.iter_lines():
+                if cancel is not None and cancel.is_set():
+                    return
+                if not line:
+                    continue
+                content, done = self._parse_stream_line(line)
+                if content:
+                    yield content
+                if done:
+                    return
+
+    def _pump_stream(self, section: str, model: str, system_prompt: str, user_message: str,
+                     out: queue.Queue, cancel: threading.Event, responses: list):
+        """在独立线程中运行：把模型的流式输出按分区写入队列"""
+        try:
+            for token in self._stream_model(model, system_prompt, user_message, cancel, responses):
+                out.put((section, token))
+        except Exception as e:
+            # 取消时关闭连接导致的读取错误不必上报
+            if not cancel.is_set():
+                out.put((section, e))
+        finally:
+            out.put((section, _STREAM_END))
+
+    def _timed_call(self, model: str, system_prompt: str, user_message: str) -> tuple[str, float]:
+        """调用模型并返回 (内容, 耗时毫秒)"""
+        start = time.perf_counter()
+        content = self._call_model(model, system_prompt, user_message)
+        return content, (time.perf_counter() - start) * 1000
+
+    def _run_branches(self, analysis_prompt: str, sales_prompt: str, user_message: str,
+                      cancel: threading.Event = None) -> tuple[str, str, dict]:
+        """
+        执行分析 / 话术两个分支
+
+        并发模式下两个分支提交到有界线程池同时执行，任一分支失败或超时时
+        立即取消另一个分支（尚未开始的直接取消，已在执行的不再等待）并抛出异常。
+        超时从分支真正开始执行时算起，在线程池里排队的时间不计入。
+        cancel 被置位（调用方已离开）时同样取消并抛出 CancelledError。
+
+        Returns:
+            (analysis, sales_reply, timings)
+        """
+        if not self.concurrent:
+            analysis, analysis_ms = self._timed_call(self.analyst_model, analysis_prompt, user_message)
+            if cancel is not None and cancel.is_set():
+                raise CancelledError("调用方已取消")
+            sales_reply, sales_ms = self._timed_call(self.sales_model, sales_prompt, user_message)
+            return analysis, sales_reply, {"analysis_ms": round(analysis_ms, 1), "sales_ms": round(sales_ms, 1)}
+
+        started = {}  # 分支 -> 开始执行的时间
+
+        def branch(name: str, model: str, prompt: str):
+            started[name] = time.monotonic()
+            return self._timed_call(model, prompt, user_message)
+
+        futures = {
+            "analysis": self._executor.submit(branch, "analysis", self.analyst_model, analysis_prompt),
+            "sales": self._executor.submit(branch, "sales", self.sales_model, sales_prompt),
+        }
+        pending = set(futures.values())
+        while pending:
+            # 等到最早开始的分支到期；都还在排队时每 timeout 秒复查一次
+            deadlines = [started[name] + self.timeout for name, f in futures.items() if f in pending and name in started]
+            timeout = max(min(deadlines) - time.monotonic(), 0) if deadlines else self.timeout
+            if cancel is not None:
+                timeout = min(timeout, self.CANCEL_POLL)
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_EXCEPTION)
+
+            failed = [f for f in done if f.exception() is not None]
+            expired = [name for name, f in futures.items()
+                       if f in pending and name in started and time.monotonic() - started[name] >= self.timeout]
+            cancelled = cancel is not None and cancel.is_set()
+            if failed or expired or cancelled:
+                for f in futures.values():
+                    f.cancel()
+                if failed:
+                    raise failed[0].exception()
+                if cancelled:
+                    raise CancelledError("调用方已取消")
+                raise TimeoutError(f"模型调用超时（>{self.timeout}s）")
+
+        analysis, analysis_ms = futures["analysis"].result()
+        sales_reply, sales_ms = futures["sales"].result()
+        return analysis, sales_reply, {"analysis_ms": round(analysis_ms, 1), "sales_ms": round(sales_ms, 1)}
+
+    def generate_with_timings(self, system_prompt: str, user_message: str,
+                              cancel: threading.Event = None) -> tuple[str, dict]:
+        """
+        双模型生成，并返回各分支耗时；cancel 被置位时放弃等待并抛出 CancelledError
+
+        Returns:
+            (result, timings)，timings 包含 analysis_ms / sales_ms / total_ms / mode
+        """
+        start = time.perf_counter()
+
+        # Step 0: 提取相关产品类型
+        product_type = self._extract_product_from_context(system_prompt)
+
+        # Step 1 & 2: qwen2.5 分析 + sales-assistant 话术（两者互不依赖）
+        analysis, sales_reply, timings = self._run_branches(
+            self._build_analysis_prompt(product_type),
+            self._build_sales_prompt(product_type, user_message),
+            user_message,
+            cancel
+        )
+
+        # Step 3: 检测价格关键词，提取价格参考
+        price_info = self._build_price_info(system_prompt, user_message)
+
+        result = self._compose_result(product_type, sales_reply, analysis, price_info)
+
+        timings["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        timings["mode"] = "concurrent" if self.concurrent else "sequential"
+        return result, timings
+
+    def generate(self, system_prompt: str, user_message: str) -> str:
+        """
+        双模型生成：
+        1. qwen2.5 分析客户心理、策略和避坑提醒
+        2. sales-assistant 生成人味话术
+        3. 价格关键词触发时显示价格参考
+        4. 显示相关产品标记
+        """
+        result, _ = self.generate_with_timings(system_prompt, user_message)
         return result
 
     def generate_stream(self, system_prompt: str, user_message: str):
-        """流式生成（简化版，先返回完整结果）"""
-        result = self.generate(system_prompt, user_message)
-        yield result
+        """
+        流式双模型生成
+
+        两个模型同时以 stream 模式调用，token 一到达就按分区产出 (section, text)：
+        - product: 相关产品类型（最先产出）
+        - sales: 建议回复的 token
+        - analysis: 策略分析的 token
+        - price: 价格参考（命中价格关键词时最后产出）
+
+        sales / analysis 两个分区的 token 交错到达，调用方按 section 分别拼接。
+        任一分支出错或调用方提前关闭生成器时，另一分支随之取消（关闭连接）。
+        流式分支在整个生成期间占着线程，用独立线程而不是共享线程池，不会挤占 /chat 和 /chat/batch。
+        """
+        product_type = self._extract_product_from_context(system_prompt)
+        yield "product", product_type
+
+        out = queue.Queue()
+        cancel = threading.Event()
+        responses = []
+        branches = [
+            ("sales", self.sales_model, self._build_sales_prompt(product_type, user_message)),
+            ("analysis", self.analyst_model, self._build_analysis_prompt(product_type)),
+        ]
+        for section, model, prompt in branches:
+            threading.Thread(target=self._pump_stream, args=(section, model, prompt, user_message, out, cancel, responses),
+                             name=f"ollama-stream-{section}", daemon=True).start()
+
+        remaining = len(branches)
+        try:
+            while remaining:
+                try:
+                    section, item = out.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"模型流式输出超时（>{self.timeout}s 无新 token）")
+                if item is _STREAM_END:
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield section, item
+        finally:
+            cancel.set()
+            for response in list(responses):
+                response.close()
+
+        price_info = self._build_price_info(system_prompt, user_message)
+        if price_info:
+            yield "price", price_info
+
+    def close(self):
+        """释放线程池和连接池"""
+        self._executor.shutdown(wait=False)
+        self.transport.close()
 
 
 # 兼容旧代码的别名（直接使用双模型）
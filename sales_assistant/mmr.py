@@ -0,0 +1,48 @@
+"""
+最大边际相关（MMR）多样性选择
+
+语料由模板生成，检索 top-k 经常是同一句卖家还价的多个副本，浪费 Prompt token 和 LLM 预填充时间。
+MMR 在多取的候选中贪心选择：每一步选
+    λ · 与查询的相关度 - (1 - λ) · 与已选案例的最大相似度
+最大的候选。相似度矩阵一次算好，每步只做向量运算。
+"""
+import numpy as np
+
+
+def mmr_select(relevance: np.ndarray, embeddings: np.ndarray, k: int, lambda_: float = 0.5) -> list[int]:
+    """
+    Args:
+        relevance: 每个候选与查询的相关度（越大越相关）
+        embeddings: 候选向量矩阵，与 relevance 逐行对应
+        k: 选择数量
+        lambda_: 1.0 只看相关度，0.0 只看多样性
+
+    Returns:
+        被选中候选的下标，按选择顺序
+    """
+    relevance = np.asarray(relevance, dtype=np.float32)
+    n = len(relevance)
+    if n == 0 or k <= 0:
+        return []
+
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix = matrix / norms
+    similarity = matrix @ matrix.T
+
+    first = int(np.argmax(relevance))
+    selected = [first]
+    max_similarity = similarity[:, first].copy()
+    available = np.ones(n, dtype=bool)
+    available[first] = False
+
+    for _ in range(min(k, n) - 1):
+        scores = lambda_ * relevance - (1 - lambda_) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[:, best], out=max_similarity)
+
+    return selected
@@ -0,0 +1,281 @@
+"""
+ONNX Runtime 查询编码器（CPU）
+
+服务器只有 CPU，PyTorch eager 模式下的 SentenceTransformer.encode 是 /search 的主要耗时。
+这里把配置的 Embedding 模型导出为 ONNX 并做动态 int8 量化，
+OnnxEncoder 提供与 SentenceTransformer.encode 兼容的接口，RAGEngine 可直接替换。
+
+用法:
+    python onnx_encoder.py export --profile m3-utterance
+    python onnx_encoder.py check --profile m3-utterance --threshold 0.99
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+CONFIG_FILE = "encoder_config.json"
+# OnnxEncoder 能复现的池化方式（max / lasttoken / weightedmean 等未实现）
+SUPPORTED_POOLING = ("cls", "mean")
+
+
+def default_onnx_path(model_name: str) -> Path:
+    """模型对应的默认导出目录，如 onnx/BAAI__bge-m3"""
+    return Path(__file__).parent / "onnx" / model_name.replace("/", "__")
+
+
+def export_onnx(model_name: str, output_dir: str = None, quantize: bool = True, opset: int = 17) -> Path:
+    """
+    导出 Embedding 模型为 ONNX
+
+    池化方式、是否归一化、最大长度从 SentenceTransformer 的模块配置中读取，
+    写入 encoder_config.json，OnnxEncoder 按此复现同样的输出。
+
+    Args:
+        model_name: SentenceTransformer 模型名
+        output_dir: 导出目录，默认 default_onnx_path(model_name)
+        quantize: 是否做动态 int8 量化（权重 int8，激活运行时量化）
+
+    Returns:
+        导出目录
+
+    Raises:
+        ValueError: 模型的池化方式不在 SUPPORTED_POOLING 中（导出的向量会和原模型不一致）
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = st_model[0]
+    pooling = st_model[1].get_pooling_mode_str() if len(st_model) > 1 else "cls"
+    if pooling not in SUPPORTED_POOLING:
+        raise ValueError(f"{model_name} 的池化方式 {pooling} 不受支持（支持: {', '.join(SUPPORTED_POOLING)}）")
+
+    output_dir = Path(output_dir) if output_dir else default_onnx_path(model_name)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    normalize = any(type(module).__name__ == "Normalize" for module in st_model)
+    transformer.tokenizer.save_pretrained(str(output_dir))
+
+    class HiddenState(torch.nn.Module):
+        """只输出 last_hidden_state，池化在 OnnxEncoder 中完成"""
+
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+
+    dummy = transformer.tokenizer(["导出 ONNX 模型"], return_tensors="pt")
+    fp32_path = output_dir / "model_fp32.onnx"
+    dynamic = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            HiddenState(transformer.auto_model.eval()),
+            (dummy["input_ids"], dummy["attention_mask"]),
+            str(fp32_path),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={"input_ids": dynamic, "attention_mask": dynamic, "last_hidden_state": dynamic},
+            opset_version=opset
+        )
+
+    model_file = fp32_path.name
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(str(fp32_path), str(output_dir / "model_int8.onnx"),
+                         weight_type=QuantType.QInt8, use_external_data_format=True)
+        model_file = "model_int8.onnx"
+
+    with open(output_dir / CONFIG_FILE, "w", encoding="utf-8") as f:
+        json.dump({
+            "model_name": model_name,
+            "model_file": model_file,
+            "pooling": pooling,
+            "normalize": normalize,
+            "max_seq_length": transformer.max_seq_length,
+        }, f, ensure_ascii=False, indent=2)
+    return output_dir
+
+
+class OnnxEncoder:
+    """
+    ONNX Runtime 编码器，encode() 与 SentenceTransformer.encode 兼容
+
+    InferenceSession 按进程懒创建：gunicorn master 中预热用的 session 不会带进 fork 出的 worker
+    （ORT 的线程池在 fork 后不可用），每个 worker 首次编码时自己创建。
+    """
+
+    def __init__(self, path: str, intra_op_threads: int = None, batch_size: int = 32):
+        """
+        Args:
+            path: export_onnx 的导出目录
+            intra_op_threads: 单次推理使用的线程数，为空时由 ORT 按核数决定
+            batch_size: 批量编码时每批的文本数
+        """
+        from transformers import AutoTokenizer
+
+        self.path = Path(path)
+        with open(self.path / CONFIG_FILE, "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        if self.config["pooling"] not in SUPPORTED_POOLING:
+            raise ValueError(f"{path} 的池化方式 {self.config['pooling']} 不受支持，请重新导出")
+        self.tokenizer = AutoTokenizer.from_pretrained(str(self.path))
+        self.intra_op_threads = intra_op_threads
+        self.batch_size = batch_size
+
+        self._lock = threading.Lock()
+        self._session_obj = None
+        self._session_pid = None
+
+    def _session(self):
+        if self._session_obj is None or self._session_pid != os.getpid():
+            import onnxruntime as ort
+
+            with self._lock:
+                if self._session_obj is None or self._session_pid != os.getpid():
+                    options = ort.SessionOptions()
+                    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                    options.inter_op_num_threads = 1
+                    if self.intra_op_threads:
+                        options.intra_op_num_threads = self.intra_op_threads
+                    self._session_obj = ort.InferenceSession(
+                        str(self.path / self.config["model_file"]),
+                        sess_options=options,
+                        providers=["CPUExecutionProvider"]
+                    )
+                    self._session_pid = os.getpid()
+        return self._session_obj
+
+    def _encode_batch(self, texts: list[str]) -> np.ndarray:
+        tokens = self.tokenizer(texts, padding=True, truncation=True,
+                                max_length=self.config["max_seq_length"], return_tensors="np")
+        mask = tokens["attention_mask"].astype(np.int64)
+        hidden = self._session().run(None, {
+            "input_ids": tokens["input_ids"].astype(np.int64),
+            "attention_mask": mask
+        })[0]
+
+        if self.config["pooling"] == "cls":
+            pooled = hidden[:, 0]
+        else:
+            weights = mask[..., None].astype(np.float32)
+            pooled = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+
+        if self.config["normalize"]:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32)
+
+    def encode(self, sentences, batch_size: int = None, **kwargs) -> np.ndarray:
+        """
+        编码文本，单个字符串返回一维向量，列表返回矩阵
+
+        按长度排序后分批，减少 padding；其余 SentenceTransformer 参数（show_progress_bar 等）忽略。
+        """
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        batch_size = batch_size or self.batch_size
+
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        embeddings = [None] * len(texts)
+        for start in range(0, len(texts), batch_size):
+            indexes = order[start:start + batch_size]
+            for i, embedding in zip(indexes, self._encode_batch([texts[i] for i in indexes])):
+                embeddings[i] = embedding
+
+        result = np.stack(embeddings)
+        return result[0] if single else result
+
+
+def parity_check(model_name: str, onnx_path: str, texts: list[str], threshold: float = 0.99,
+                 intra_op_threads: int = None) -> dict:
+    """
+    对比 PyTorch 与 ONNX 的输出一致性和单条编码延迟
+
+    Returns:
+        {"min_cosine", "mean_cosine", "passed", "torch_p50_ms", "onnx_p50_ms", "speedup"}
+    """
+    from sentence_transformers import SentenceTransformer
+
+    torch_model = SentenceTransformer(model_name, device="cpu")
+    onnx_model = OnnxEncoder(onnx_path, intra_op_threads=intra_op_threads)
+
+    reference = torch_model.encode(texts, normalize_embeddings=True)
+    candidate = onnx_model.encode(texts)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    cosines = np.sum(reference * candidate, axis=1)
+
+    def p50_ms(model):
+        model.encode([texts[0]])
+        latencies = []
+        for text in texts:
+            start = time.perf_counter()
+            model.encode([text])
+            latencies.append((time.perf_counter() - start) * 1000)
+        return float(np.percentile(latencies, 50))
+
+    torch_ms, onnx_ms = p50_ms(torch_model), p50_ms(onnx_model)
+    return {
+        "min_cosine": round(float(cosines.min()), 5),
+        "mean_cosine": round(float(cosines.mean()), 5),
+        "passed": bool(cosines.min() >= threshold),
+        "torch_p50_ms": round(torch_ms, 2),
+        "onnx_p50_ms": round(onnx_ms, 2),
+        "speedup": round(torch_ms / onnx_ms, 2) if onnx_ms else None,
+    }
+
+
+def _parity_texts(limit: int = 200) -> list[str]:
+    """固定查询集 + 对话数据中的前若干条发言"""
+    from benchmark import FIXED_QUERIES
+
+    texts = list(FIXED_QUERIES)
+    data_path = Path(__file__).parent.parent / "dialogue_data.jsonl"
+    if data_path.exists():
+        from import_data import load_dialogues
+        texts += [d["content"] for d in load_dialogues(str(data_path))[:limit]]
+    return texts
+
+
+def main():
+    from rag_engine import PROFILES, DEFAULT_PROFILE
+
+    parser = argparse.ArgumentParser(description="导出 ONNX int8 编码器并校验一致性")
+    parser.add_argument("command", choices=["export", "check"])
+    parser.add_argument("--profile", choices=sorted(PROFILES), default=DEFAULT_PROFILE)
+    parser.add_argument("--model", help="覆盖配置中的 Embedding 模型")
+    parser.add_argument("--output", help="导出目录，默认 onnx/<模型名>")
+    parser.add_argument("--no-quantize", action="store_true", help="只导出 fp32，不做 int8 量化")
+    parser.add_argument("--threshold", type=float, default=0.99, help="一致性检查的最低余弦相似度")
+    parser.add_argument("--threads", type=int, help="ONNX Runtime intra-op 线程数")
+    args = parser.parse_args()
+
+    model_name = args.model or PROFILES[args.profile]["encoder"]
+    output = args.output or str(default_onnx_path(model_name))
+
+    if args.command == "export":
+        print(f"⏳ 导出 {model_name} -> {output}")
+        export_onnx(model_name, output, quantize=not args.no_quantize)
+        print("✅ 导出完成，运行 check 校验一致性")
+        return
+
+    report = parity_check(model_name, output, _parity_texts(), args.threshold, args.threads)
+    print(f"余弦相似度: min {report['min_cosine']:.5f}, mean {report['mean_cosine']:.5f}（阈值 {args.threshold}）")
+    print(f"单条编码 p50: PyTorch {report['torch_p50_ms']:.2f} ms, ONNX {report['onnx_p50_ms']:.2f} ms, "
+          f"加速 {report['speedup']}x")
+    if not report["passed"]:
+        print("❌ 一致性检查未通过")
+        sys.exit(1)
+    print("✅ 一致性检查通过")
+
+
+if __name__ == "__main__":
+    main()
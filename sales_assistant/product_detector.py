@@ -0,0 +1,92 @@
+"""
+产品识别：从查询中识别已知产品，用于检索前的元数据过滤
+
+产品目录 = model/generate_dialogues.py 中的 products 列表 + 向量库里出现过的 product。
+用 Aho-Corasick 自动机一次扫描查询完成多模式匹配，重叠时取最左最长匹配
+（"蓝牙耳机" 不会再额外匹配出 "耳机" 类的短名）。
+"""
+import importlib.util
+import unicodedata
+from collections import deque
+from pathlib import Path
+
+
+def _normalize(text: str) -> str:
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def load_catalog_products() -> list[str]:
+    """读取 model/generate_dialogues.py 中的产品列表（文件不存在时返回空列表）"""
+    path = Path(__file__).parent.parent / "model" / "generate_dialogues.py"
+    if not path.exists():
+        return []
+    spec = importlib.util.spec_from_file_location("generate_dialogues", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return list(getattr(module, "products", []))
+
+
+class ProductDetector:
+    """Aho-Corasick 多模式匹配器"""
+
+    def __init__(self, products):
+        self.products = sorted(set(p for p in products if p))
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None]  # 以该状态结尾的产品：(原始名称, 规范化长度)
+        for product in self.products:
+            self._add(product)
+        self._build_failure_links()
+
+    def _add(self, product: str):
+        state = 0
+        for ch in _normalize(product):
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+            state = nxt
+        self._output[state] = (product, len(_normalize(product)))
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+
+    def _matches(self, text: str) -> list[tuple[int, int, str]]:
+        """所有匹配 (start, end, product)"""
+        matches = []
+        state = 0
+        for i, ch in enumerate(_normalize(text)):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            s = state
+            while s:
+                if self._output[s] is not None:
+                    product, length = self._output[s]
+                    matches.append((i + 1 - length, i + 1, product))
+                s = self._fail[s]
+        return matches
+
+    def detect(self, text: str) -> list[str]:
+        """识别查询中的产品，按出现顺序去重返回（重叠时取最左最长）"""
+        matches = sorted(self._matches(text), key=lambda m: (m[0], -(m[1] - m[0])))
+        products = []
+        covered_until = 0
+        for start, end, product in matches:
+            if start < covered_until:
+                continue
+            covered_until = end
+            if product not in products:
+                products.append(product)
+        return products
@@ -1,9 +1,149 @@
 """
 RAG 检索引擎：检索相似对话并组装 Prompt
+
+Embedding 模型、文档粒度和集合名都可配置，PROFILES 中是两套预置配置：
+- m3-utterance: bge-m3 + 每条发言一个文档（默认）
+- small-conversation: bge-small-zh-v1.5 + 每个完整对话一个文档（原 rag.py）
+用 benchmark.py 对比各配置的延迟、内存和召回。
 """
+import threading
+from collections import OrderedDict
 from pathlib import Path
 from sentence_transformers import SentenceTransformer
-import chromadb
+import numpy as np
+
+from response_cache import normalize_message
+from formatting import document_text
+from vector_store import ChromaStore, NumpyStore, ParentStore, QuantizedStore, open_chroma_client
+from sparse_index import BM25Index, reciprocal_rank_fusion
+from product_detector import ProductDetector, load_catalog_products
+from onnx_encoder import OnnxEncoder, default_onnx_path
+from reranker import CrossEncoderReranker
+from mmr import mmr_select
+from embedding_cache import CachedEncoder, EmbeddingCache
+from collection_versions import resolve_version
+
+
+PROFILES = {
+    "m3-utterance": {
+        "encoder": "BAAI/bge-m3",
+        "granularity": "utterance",
+        "collection": "dialogues",
+    },
+    "small-conversation": {
+        "encoder": "BAAI/bge-small-zh-v1.5",
+        "granularity": "conversation",
+        "collection": "sales_dialogues",
+    },
+}
+DEFAULT_PROFILE = "m3-utterance"
+
+
+def index_paths(collection: str) -> tuple[Path, Path]:
+    """集合对应的 (NumPy 索引目录, BM25 索引文件)，默认集合沿用原来的文件名"""
+    base = Path(__file__).parent
+    if collection == PROFILES[DEFAULT_PROFILE]["collection"]:
+        return base / "numpy_index", base / "sparse_index.json"
+    return base / f"numpy_index_{collection}", base / f"sparse_index_{collection}.json"
+
+
+def parent_store_path(collection: str) -> Path:
+    """集合对应的父文档（完整对话）文件"""
+    base = Path(__file__).parent
+    if collection == PROFILES[DEFAULT_PROFILE]["collection"]:
+        return base / "parent_docs.json"
+    return base / f"parent_docs_{collection}.json"
+
+
+def derived_paths(collection: str) -> list[Path]:
+    """集合的全部衍生文件（清理旧版本时一起删除）"""
+    return [*index_paths(collection), parent_store_path(collection)]
+
+
+class QueryEmbeddingCache:
+    """
+    查询向量缓存（LRU）
+
+    /search 和 /chat 反复查询同样的字符串，缓存后无需再跑一遍 transformer 前向。
+    键为 (模型名, 规范化文本)，线程安全。
+    """
+
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_compute(self, model_name: str, text: str, compute) -> np.ndarray:
+        """命中直接返回，否则调用 compute(text) 计算并写入"""
+        key = (model_name, normalize_message(text))
+        with self._lock:
+            embedding = self._items.get(key)
+            if embedding is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return embedding
+            self.misses += 1
+
+        # 计算放在锁外，避免一次编码阻塞其他线程
+        embedding = np.asarray(compute(text))
+        embedding.setflags(write=False)
+
+        with self._lock:
+            self._items[key] = embedding
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+        return embedding
+
+    def get_or_compute_many(self, model_name: str, texts: list[str], compute_batch) -> list[np.ndarray]:
+        """批量版本：未命中的文本合并成一次 compute_batch(texts) 调用"""
+        keys = [(model_name, normalize_message(t)) for t in texts]
+        results = [None] * len(texts)
+        missing = {}  # key -> 需要计算的文本下标列表（同一批内重复文本只算一次）
+        with self._lock:
+            for i, key in enumerate(keys):
+                embedding = self._items.get(key)
+                if embedding is not None:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    results[i] = embedding
+                else:
+                    self.misses += 1
+                    missing.setdefault(key, []).append(i)
+
+        if missing:
+            order = list(missing)
+            embeddings = np.asarray(compute_batch([texts[missing[key][0]] for key in order]))
+            with self._lock:
+                for key, embedding in zip(order, embeddings):
+                    embedding.setflags(write=False)
+                    self._items[key] = embedding
+                    self._items.move_to_end(key)
+                    for i in missing[key]:
+                        results[i] = embedding
+                while len(self._items) > self.max_size:
+                    self._items.popitem(last=False)
+                    self.evictions += 1
+        return results
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
 
 
 class RAGEngine:
@@ -17,74 +157,480 @@ class RAGEngine:
 
 根据以上案例，回答客服的问题。"""
 
-    def __init__(self, db_path: str = None):
+    # 检索模式：dense 只用向量，sparse 只用 BM25（不跑编码器），hybrid 两者 RRF 融合
+    MODES = ("dense", "sparse", "hybrid")
+
+    def __init__(self, db_path: str = None, query_cache_size: int = 4096,
+                 backend: str = "chroma", index_path: str = None,
+                 mode: str = "dense", sparse_index_path: str = None, fusion_candidates: int = 4,
+                 product_filter: bool = True, encoder: str = "BAAI/bge-m3",
+                 granularity: str = "utterance", collection: str = "dialogues",
+                 rescore_multiplier: int = 4, encoder_backend: str = "torch", onnx_path: str = None,
+                 encoder_threads: int = None, parent_context: bool = False, parent_path: str = None,
+                 parent_candidates: int = 3, reranker_model: str = None, rerank_candidates: int = 50,
+                 rerank_budget_ms: float = None, mmr_lambda: float = None, mmr_fetch_multiplier: int = 4,
+                 embedding_cache: bool = False, embedding_cache_dir: str = None, embedding_cache_size: int = 200_000,
+                 shared: "RAGEngine" = None):
+        """
+        Args:
+            db_path: Chroma 数据库路径
+            query_cache_size: 查询向量缓存容量
+            backend: 检索后端，chroma / numpy / int8 / binary（后两者为量化粗排 + 全精度重排）
+            index_path: NumPy 索引目录（backend 非 chroma 时使用，由 import_data.py --export-numpy 生成）
+            mode: 默认检索模式，dense / sparse / hybrid
+            sparse_index_path: BM25 索引文件（由 import_data.py 生成）
+            fusion_candidates: hybrid 模式下每路召回 k 的多少倍参与融合
+            product_filter: 是否默认按查询中识别出的产品过滤检索范围
+            encoder: Embedding 模型，须与导入时一致
+            granularity: 文档粒度，utterance（每条发言）或 conversation（整段对话）
+            collection: Chroma 集合名或别名（按别名文件解析到当前版本），NumPy / BM25 索引路径也按解析后的集合名区分
+            rescore_multiplier: 量化后端粗排取 k 的多少倍候选做全精度重排
+            encoder_backend: 查询编码后端，torch（SentenceTransformer）或 onnx（int8 ONNX Runtime）
+            onnx_path: ONNX 导出目录（由 onnx_encoder.py export 生成），默认 onnx/<模型名>
+            encoder_threads: ONNX Runtime intra-op 线程数
+            parent_context: 用发言检索、用所属完整对话组装 Prompt（仅 utterance 粒度）
+            parent_path: 父文档文件（由 import_data.py 生成），默认按集合名
+            parent_candidates: 父文档模式下检索 k 的多少倍发言，保证去重后凑够 k 个对话
+            reranker_model: CrossEncoder 重排模型，为空时不加载重排器
+            rerank_candidates: 重排时一阶段检索的候选数
+            rerank_budget_ms: 重排延迟预算，超出时截断候选
+            mmr_lambda: 默认的 MMR 多样性权重（1.0 只看相关度），为空时不做多样性选择
+            mmr_fetch_multiplier: MMR 时多取 k 的多少倍候选
+            embedding_cache: 查询向量内存缓存未命中时再查磁盘向量缓存（与导入共享，见 embedding_cache.py）
+            embedding_cache_dir: 磁盘向量缓存目录，默认 sales_assistant/embedding_cache
+            embedding_cache_size: 磁盘向量缓存容量（条，首次创建时生效）
+            shared: 热加载新版本时传入旧引擎，复用其已加载的编码器、缓存和重排器
+        """
+        # 热加载时用同样的参数重新打开（须在定义其他局部变量之前取）
+        self.options = {key: value for key, value in locals().items() if key not in ("self", "shared")}
+
         if db_path is None:
             db_path = str(Path(__file__).parent / "chroma_db")
+        self.db_path = db_path
+        self.collection_alias = collection
+        collection, self.collection_generation = resolve_version(db_path, collection)
+        self.collection_name = collection
+        default_index_path, default_sparse_path = index_paths(collection)
+        if index_path is None:
+            index_path = str(default_index_path)
+        if sparse_index_path is None:
+            sparse_index_path = str(default_sparse_path)
+
+        if backend == "chroma":
+            # 热加载时重新从磁盘加载，否则增量导入后拿到的还是进程内缓存的旧 HNSW 段
+            self.client = open_chroma_client(db_path, fresh=shared is not None)
+            self.collection = self.client.get_collection(collection)
+            imported_with = (self.collection.metadata or {}).get("encoder")
+            if imported_with and imported_with != encoder:
+                raise ValueError(f"集合 {collection} 由 {imported_with} 生成，与配置的 {encoder} 不一致")
+            self.store = ChromaStore(self.collection)
+        elif backend == "numpy":
+            self.store = NumpyStore(index_path)
+        elif backend in QuantizedStore.QUANTIZATIONS:
+            self.store = QuantizedStore(index_path, backend, rescore_multiplier=rescore_multiplier)
+        else:
+            raise ValueError(f"未知的检索后端: {backend}")
+        self.backend = backend
+        self.granularity = granularity
+
+        self.parent_context = parent_context
+        self.parent_candidates = parent_candidates
+        self.parent_store = None
+        if parent_context:
+            if granularity != "utterance":
+                raise ValueError("父文档模式只适用于 utterance 粒度")
+            parent_path = Path(parent_path or parent_store_path(collection))
+            if not parent_path.exists():
+                raise ValueError(f"父文档文件不存在: {parent_path}，请先运行 import_data.py")
+            self.parent_store = ParentStore(str(parent_path))
+
+        if mode not in self.MODES:
+            raise ValueError(f"未知的检索模式: {mode}")
+        self.mode = mode
+        self.fusion_candidates = fusion_candidates
+        self.sparse_index = BM25Index.load(sparse_index_path) if Path(sparse_index_path).exists() else None
+
+        # 产品目录 = 生成脚本中的产品 + 库里实际出现的产品；只有库里有的产品才参与过滤，
+        # 否则识别出一个没有案例的产品会把检索结果过滤成空
+        self.product_filter = product_filter
+        self.indexed_products = self.store.metadata_values("product")
+        self.product_detector = ProductDetector(load_catalog_products() + sorted(self.indexed_products))
+
+        self.model_name = encoder
+        self.encoder_backend = encoder_backend
+        if shared is not None:
+            self.model, self.encoder = shared.model, shared.encoder
+            self.query_cache, self.embedding_cache = shared.query_cache, shared.embedding_cache
+            self.reranker = shared.reranker
+        else:
+            self._load_models(encoder_backend, onnx_path, encoder_threads, query_cache_size, embedding_cache,
+                              embedding_cache_dir, embedding_cache_size, reranker_model, rerank_budget_ms)
+        self.rerank_candidates = rerank_candidates
+
+        self.mmr_lambda = mmr_lambda
+        self.mmr_fetch_multiplier = mmr_fetch_multiplier
+
+    def _load_models(self, encoder_backend, onnx_path, encoder_threads, query_cache_size, embedding_cache,
+                     embedding_cache_dir, embedding_cache_size, reranker_model, rerank_budget_ms):
+        if encoder_backend == "torch":
+            self.model = SentenceTransformer(self.model_name)
+        elif encoder_backend == "onnx":
+            self.model = OnnxEncoder(onnx_path or default_onnx_path(self.model_name), intra_op_threads=encoder_threads)
+        else:
+            raise ValueError(f"未知的编码后端: {encoder_backend}")
+        self.query_cache = QueryEmbeddingCache(max_size=query_cache_size)
+
+        # int8 ONNX 的向量与 PyTorch 略有差异，两种后端分开缓存；self.model 保持原编码器（post_fork 要调线程数）
+        self.embedding_cache = None
+        self.encoder = self.model
+        if embedding_cache:
+            namespace = self.model_name if encoder_backend == "torch" else f"{self.model_name}#onnx"
+            self.embedding_cache = EmbeddingCache(namespace, embedding_cache_dir, max_entries=embedding_cache_size)
+            self.encoder = CachedEncoder(self.model, self.embedding_cache)
+
+        self.reranker = CrossEncoderReranker(reranker_model, budget_ms=rerank_budget_ms) if reranker_model else None
+
+    @classmethod
+    def from_profile(cls, profile: str = DEFAULT_PROFILE, **kwargs) -> "RAGEngine":
+        """按预置配置创建引擎，kwargs 可覆盖配置项或传其他参数"""
+        if profile not in PROFILES:
+            raise ValueError(f"未知的配置: {profile}")
+        return cls(**{**PROFILES[profile], **kwargs})
+
+    def resolve_version(self) -> tuple[str, int]:
+        """别名当前的 (版本, generation)，与本引擎打开的不同说明有新版本上线或当前版本被增量更新"""
+        return resolve_version(self.db_path, self.collection_alias)
+
+    def reload(self) -> "RAGEngine":
+        """按别名重新打开当前版本，复用本引擎已加载的模型；本引擎不受影响，可继续服务"""
+        return RAGEngine(**self.options, shared=self)
+
+    def _encode_one(self, text: str) -> np.ndarray:
+        return self.encoder.encode([text])[0]
+
+    def encode_query(self, query: str) -> np.ndarray:
+        """计算单条查询的 embedding（一维向量，只读），重复查询走缓存"""
+        return self.query_cache.get_or_compute(self.model_name, query, self._encode_one)
+
+    def encode_queries(self, queries: list[str]) -> np.ndarray:
+        """批量计算查询 embedding：缓存未命中的部分合并成一次 model.encode"""
+        embeddings = self.query_cache.get_or_compute_many(self.model_name, queries, self.encoder.encode)
+        return np.stack(embeddings)
 
-        self.client = chromadb.PersistentClient(path=db_path)
-        self.collection = self.client.get_collection("dialogues")
-        self.model = SentenceTransformer('BAAI/bge-m3')
+    def detect_products(self, query: str) -> list[str]:
+        """识别查询中提到的、库里有案例的产品"""
+        return [p for p in self.product_detector.detect(query) if p in self.indexed_products]
 
-    def search(self, query: str, k: int = 5) -> list[dict]:
+    def _resolve_products(self, query: str, products) -> tuple:
+        """products 为 None 时自动识别（受 product_filter 开关控制），[] 表示不过滤"""
+        if products is None:
+            products = self.detect_products(query) if self.product_filter else []
+        return tuple(products)
+
+    @staticmethod
+    def _product_where(products: tuple) -> dict:
+        if not products:
+            return None
+        if len(products) == 1:
+            return {"product": products[0]}
+        return {"product": {"$in": list(products)}}
+
+    def search(self, query: str, k: int = 5, query_embedding: np.ndarray = None, mode: str = None,
+               products: list[str] = None, mmr_lambda: float = None) -> list[dict]:
         """
         检索相似对话
 
         Args:
             query: 用户查询
             k: 返回结果数量
+            query_embedding: 已算好的查询向量（如语义缓存已经算过），为空时现算
+            mode: 检索模式（dense / sparse / hybrid），为空时用引擎默认模式
+            products: 只在这些产品的案例中检索；为空时从查询中自动识别，传 [] 不过滤
+            mmr_lambda: MMR 多样性权重，为空时用引擎默认值
 
         Returns:
-            相似对话列表，每个包含 document, metadata, distance
+            相似对话列表，每个包含 id, document, metadata, distance（sparse / hybrid 另有 score）
+        """
+        query_embeddings = [query_embedding] if query_embedding is not None else None
+        products_list = [products] if products is not None else None
+        return self.search_batch([query], k, query_embeddings=query_embeddings, mode=mode,
+                                 products_list=products_list, mmr_lambda=mmr_lambda)[0]
+
+    def search_batch(self, queries: list[str], k: int = 5, query_embeddings: np.ndarray = None,
+                     mode: str = None, products_list: list = None, mmr_lambda: float = None) -> list[list[dict]]:
         """
-        query_embedding = self.model.encode([query])
+        批量检索：一次编码 + 按产品过滤条件分组的多查询
+        （Chroma 每组一次 collection.query，NumPy 每组一次分区内矩阵乘）
+
+        Args:
+            products_list: 与 queries 一一对应的产品过滤列表，为空时逐条自动识别
+            mmr_lambda: MMR 多样性权重，为空时用引擎默认值；启用时多取候选再选出 k 个
+
+        Returns:
+            与 queries 一一对应的检索结果列表
+        """
+        mmr_lambda = self.mmr_lambda if mmr_lambda is None else mmr_lambda
+        if mmr_lambda is None:
+            return self._search_batch(queries, k, query_embeddings, mode, products_list)
+        batch = self._search_batch(queries, k * self.mmr_fetch_multiplier, query_embeddings, mode, products_list)
+        return self.diversify(batch, k, mmr_lambda)
+
+    def _search_batch(self, queries: list[str], k: int, query_embeddings, mode: str,
+                      products_list: list) -> list[list[dict]]:
+        mode = mode or self.mode
+        if mode not in self.MODES:
+            raise ValueError(f"未知的检索模式: {mode}")
+        if products_list is None:
+            products_list = [None] * len(queries)
+        products_list = [self._resolve_products(q, p) for q, p in zip(queries, products_list)]
+
+        # sparse 快速路径：完全跳过编码器
+        if mode == "sparse":
+            return [self._sparse_search(query, k, products) for query, products in zip(queries, products_list)]
 
-        results = self.collection.query(
-            query_embeddings=query_embedding.tolist(),
-            n_results=k
-        )
+        if query_embeddings is None:
+            query_embeddings = self.encode_queries(queries)
 
-        similar_dialogues = []
-        for i in range(len(results['documents'][0])):
-            similar_dialogues.append({
-                "document": results['documents'][0][i],
-                "metadata": results['metadatas'][0][i],
-                "distance": results['distances'][0][i] if results.get('distances') else None
-            })
+        n_candidates = k if mode == "dense" else k * self.fusion_candidates
+        dense_batch = self._dense_query(query_embeddings, n_candidates, products_list)
+        if mode == "dense":
+            return dense_batch
+        return [self._hybrid_merge(query, dense, k, n_candidates, products)
+                for query, dense, products in zip(queries, dense_batch, products_list)]
 
-        return similar_dialogues
+    def _dense_query(self, query_embeddings, k: int, products_list: list[tuple]) -> list[list[dict]]:
+        """过滤条件相同的查询合并成一次后端查询"""
+        groups = {}
+        for i, products in enumerate(products_list):
+            groups.setdefault(products, []).append(i)
 
-    def build_prompt(self, query: str, k: int = 5) -> str:
+        results = [None] * len(products_list)
+        for products, indexes in groups.items():
+            batch = self.store.query([query_embeddings[i] for i in indexes], k,
+                                     where=self._product_where(products))
+            for i, items in zip(indexes, batch):
+                results[i] = items
+        return results
+
+    @staticmethod
+    def _relevance(items: list[dict], key: str = None) -> np.ndarray:
+        """
+        候选的相关度，归一化到 [0, 1]：有 key（如 rerank_score）用 key，其次融合 / BM25 分数，否则用距离取负
+
+        key 的值为 None（超出重排预算没有打分）的候选排在所有有分数的候选之后
+        """
+        if key is None:
+            key = "score" if items and "score" in items[0] else None
+        if key:
+            scored = [item[key] for item in items if item[key] is not None]
+            floor = min(scored) - 1.0 if scored else 0.0
+            values = np.array([floor if item[key] is None else item[key] for item in items], dtype=np.float32)
+        else:
+            values = np.array([-item["distance"] for item in items], dtype=np.float32)
+        span = values.max() - values.min()
+        return (values - values.min()) / span if span > 0 else np.ones_like(values)
+
+    def diversify(self, batch: list[list[dict]], k: int, mmr_lambda: float, key: str = None) -> list[list[dict]]:
+        """
+        MMR 多样性选择：每个查询从候选中贪心选出 k 个，按选择顺序返回（整批候选的向量一次取回）
+
+        Args:
+            batch: 与查询一一对应的候选（通常多取了 mmr_fetch_multiplier 倍）
+            key: 相关度字段，为空时用 score / distance
+        """
+        ids = list(dict.fromkeys(item["id"] for items in batch for item in items))
+        if not ids:
+            return [[] for _ in batch]
+        row_of = {doc_id: row for row, doc_id in enumerate(ids)}
+        matrix = self.store.embeddings(ids)
+
+        results = []
+        for items in batch:
+            if len(items) <= 1:
+                results.append(items[:k])
+                continue
+            embeddings = matrix[[row_of[item["id"]] for item in items]]
+            selected = mmr_select(self._relevance(items, key), embeddings, k, mmr_lambda)
+            results.append([items[i] for i in selected])
+        return results
+
+    def search_parents(self, query: str, k: int = 5, query_embedding: np.ndarray = None, mode: str = None,
+                       products: list[str] = None, mmr_lambda: float = None) -> list[dict]:
+        """
+        父子检索：按发言检索，返回命中发言所属的完整对话（去重，按最佳命中排序）
+
+        Returns:
+            对话列表，每个包含 id, document, metadata, distance / score（取最佳命中发言），
+            matched（命中的发言 ID）
+        """
+        query_embeddings = [query_embedding] if query_embedding is not None else None
+        products_list = [products] if products is not None else None
+        return self.search_parents_batch([query], k, query_embeddings=query_embeddings, mode=mode,
+                                         products_list=products_list, mmr_lambda=mmr_lambda)[0]
+
+    def search_parents_batch(self, queries: list[str], k: int = 5, query_embeddings: np.ndarray = None,
+                             mode: str = None, products_list: list = None, mmr_lambda: float = None) -> list[list[dict]]:
+        """批量父子检索：发言检索同 search_batch（MMR 作用在发言上），整批命中的父文档一次批量取回"""
+        if self.parent_store is None:
+            raise ValueError("未启用父文档模式（parent_context=True）")
+        child_batch = self.search_batch(queries, k * self.parent_candidates, query_embeddings=query_embeddings,
+                                        mode=mode, products_list=products_list, mmr_lambda=mmr_lambda)
+
+        # 每个查询：按首次命中顺序取前 k 个不同的父文档
+        ranked = []
+        for children in child_batch:
+            hits = {}
+            for child in children:
+                parent_id = child["metadata"].get("parent_id")
+                if parent_id is None:
+                    continue
+                if parent_id not in hits:
+                    if len(hits) == k:
+                        continue
+                    hits[parent_id] = {"best": child, "matched": []}
+                hits[parent_id]["matched"].append(child["id"])
+            ranked.append(hits)
+
+        parent_ids = list(dict.fromkeys(pid for hits in ranked for pid in hits))
+        parents = {item["id"]: item for item in self.parent_store.get(parent_ids)}
+
+        results = []
+        for hits in ranked:
+            items = []
+            for parent_id, hit in hits.items():
+                if parent_id not in parents:
+                    continue
+                item = dict(parents[parent_id], distance=hit["best"].get("distance"), matched=hit["matched"])
+                if "score" in hit["best"]:
+                    item["score"] = hit["best"]["score"]
+                items.append(item)
+            results.append(items)
+        return results
+
+    def _require_sparse(self) -> BM25Index:
+        if self.sparse_index is None:
+            raise ValueError("BM25 索引不存在，请先运行 import_data.py 生成 sparse_index.json")
+        return self.sparse_index
+
+    def _sparse_search(self, query: str, k: int, products: tuple = ()) -> list[dict]:
+        """BM25 检索，文档内容从向量后端批量取回"""
+        hits = self._require_sparse().search(query, k, products=list(products))
+        scores = dict(hits)
+        results = self.store.get([doc_id for doc_id, _ in hits])
+        for item in results:
+            item["distance"] = None
+            item["score"] = scores[item["id"]]
+        return results
+
+    def _hybrid_merge(self, query: str, dense: list[dict], k: int, n_candidates: int,
+                      products: tuple = ()) -> list[dict]:
+        """稠密 / 稀疏两路排名做 RRF 融合，取前 k"""
+        sparse_hits = self._require_sparse().search(query, n_candidates, products=list(products))
+        fused = reciprocal_rank_fusion([
+            [item["id"] for item in dense],
+            [doc_id for doc_id, _ in sparse_hits],
+        ])[:k]
+
+        by_id = {item["id"]: item for item in dense}
+        missing = [doc_id for doc_id, _ in fused if doc_id not in by_id]
+        for item in self.store.get(missing):
+            item["distance"] = None
+            by_id[item["id"]] = item
+
+        results = []
+        for doc_id, score in fused:
+            if doc_id in by_id:
+                results.append(dict(by_id[doc_id], score=score))
+        return results
+
+    def _use_reranker(self, rerank: bool) -> bool:
+        """rerank 为空时有重排器就用"""
+        if rerank is None:
+            return self.reranker is not None
+        if rerank and self.reranker is None:
+            raise ValueError("未配置重排模型（reranker_model / RERANKER_MODEL）")
+        return rerank
+
+    def build_prompt(self, query: str, k: int = 5, query_embedding: np.ndarray = None, mode: str = None,
+                     products: list[str] = None, rerank: bool = None, timings: dict = None,
+                     mmr_lambda: float = None) -> str:
         """
         构建完整的 Prompt
 
         Args:
             query: 客服遇到的问题
             k: 检索案例数量
+            query_embedding: 已算好的查询向量，为空时现算
+            mode: 检索模式，为空时用引擎默认模式
+            products: 产品过滤，为空时从查询中自动识别
+            rerank: 是否先取 rerank_candidates 个候选再用 cross-encoder 重排，为空时有重排器就用
+            timings: 传入时写入重排耗时等统计（rerank_ms 等）
+            mmr_lambda: MMR 多样性权重，为空时用引擎默认值；重排时在重排后的候选中选择
 
         Returns:
             完整的 prompt
         """
-        # 检索相似案例
-        similar = self.search(query, k)
+        return self.build_prompts([query], k, query_embeddings=[query_embedding] if query_embedding is not None else None,
+                                  mode=mode, products_list=[products] if products is not None else None,
+                                  rerank=rerank, timings=timings, mmr_lambda=mmr_lambda)[0]
+
+    def build_prompts(self, queries: list[str], k: int = 5, query_embeddings: np.ndarray = None, mode: str = None,
+                      products_list: list = None, rerank: bool = None, timings: dict = None,
+                      mmr_lambda: float = None) -> list[tuple]:
+        """批量构建 Prompt，返回与 queries 一一对应的 (system_prompt, query, similar)"""
+        rerank = self._use_reranker(rerank)
+        mmr_lambda = self.mmr_lambda if mmr_lambda is None else mmr_lambda
+
+        # 检索相似案例（父文档模式下为命中发言所属的完整对话，MMR 在发言检索时完成）
+        if self.parent_context:
+            batch = self.search_parents_batch(queries, max(k, self.rerank_candidates) if rerank else k,
+                                              query_embeddings=query_embeddings, mode=mode,
+                                              products_list=products_list, mmr_lambda=mmr_lambda)
+            post_mmr = None
+        elif rerank:
+            # 重排后再做多样性选择：一阶段不做 MMR
+            batch = self._search_batch(queries, max(k, self.rerank_candidates), query_embeddings, mode, products_list)
+            post_mmr = mmr_lambda
+        else:
+            batch = self.search_batch(queries, k, query_embeddings=query_embeddings, mode=mode,
+                                      products_list=products_list, mmr_lambda=mmr_lambda)
+            post_mmr = None
 
-        # 格式化案例
+        if rerank:
+            keep = k if post_mmr is None else k * self.mmr_fetch_multiplier
+            batch, stats = self.reranker.rerank_many(queries, batch, keep)
+            if post_mmr is not None:
+                batch = self.diversify(batch, k, post_mmr, key="rerank_score")
+            if timings is not None:
+                timings.update(stats)
+        return [(self._format_prompt(similar), query, similar) for query, similar in zip(queries, batch)]
+
+    def _format_prompt(self, similar: list[dict]) -> str:
+        """把检索到的案例格式化为系统提示词"""
         context_parts = []
         for i, item in enumerate(similar, 1):
             meta = item['metadata']
-            context_parts.append(
-                f"案例 {i}:\n"
-                f"  产品: {meta['product']}\n"
-                f"  角色: {meta['role']}\n"
-                f"  轮次: {meta['round']}\n"
-                f"  内容: {item['document'].split('内容:')[-1]}"
-            )
+            if 'role' in meta:
+                context_parts.append(
+                    f"案例 {i}:\n"
+                    f"  产品: {meta['product']}\n"
+                    f"  角色: {meta['role']}\n"
+                    f"  轮次: {meta['round']}\n"
+                    f"  内容: {document_text(item)}"
+                )
+            else:
+                # 整段对话文档
+                dialogue = "\n".join(f"    {line}" for line in document_text(item).splitlines())
+                context_parts.append(
+                    f"案例 {i}:\n"
+                    f"  产品: {meta['product']}\n"
+                    f"  对话:\n{dialogue}"
+                )
 
         context = "\n\n".join(context_parts)
 
         # 组装 prompt
-        system_prompt = self.SYSTEM_PROMPT.format(context=context)
-
-        return system_prompt, query, similar
+        return self.SYSTEM_PROMPT.format(context=context)
 
 
 def main():
@@ -109,8 +655,8 @@ def main():
         print("\n📋 检索到的相似案例:")
         for i, item in enumerate(similar, 1):
             meta = item['metadata']
-            print(f"\n{i}. [{meta['product']}] {meta['role']} (轮次 {meta['round']})")
-            content = item['document'].split('内容:')[-1][:100]
+            print(f"\n{i}. [{meta['product']}] {meta.get('role', '对话')} (轮次 {meta.get('round', meta.get('rounds'))})")
+            content = document_text(item)[:100]
             print(f"   {content}...")
 
 
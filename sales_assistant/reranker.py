@@ -0,0 +1,154 @@
+"""
+交叉编码器重排（带延迟预算）
+
+向量检索便宜但粗糙：先取 top-50 候选，再用小型 cross-encoder 对 (查询, 文档) 逐对打分取前 k。
+- 所有待打分的候选拼成一个 padded batch，一次前向
+- 延迟预算：按历史的每对耗时估算本次能打分的候选数，超出预算的尾部候选不打分，
+  按一阶段顺序排在已打分的候选之后（降级而不是丢弃，总能返回 k 个）
+- (查询, 文档 ID) 分数缓存：重复查询的候选不再重复打分，也不占预算
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from formatting import document_text
+from response_cache import document_keys, normalize_message
+
+
+class CrossEncoderReranker:
+    """带延迟预算和分数缓存的 cross-encoder 重排器（线程安全）"""
+
+    def __init__(self, model_name: str = "BAAI/bge-reranker-base", budget_ms: float = None,
+                 cache_size: int = 8192, max_length: int = 512):
+        """
+        Args:
+            model_name: CrossEncoder 模型
+            budget_ms: 单次重排的延迟预算，为空时全部打分
+            cache_size: (查询, 文档 ID@正文哈希) 分数缓存容量
+            max_length: 每对文本的最大 token 数
+        """
+        from sentence_transformers import CrossEncoder
+
+        self.model_name = model_name
+        self.model = CrossEncoder(model_name, max_length=max_length)
+        self.budget_ms = budget_ms
+        self.cache_size = cache_size
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._ms_per_pair = None  # 每对打分耗时的指数滑动平均
+        self.hits = 0
+        self.misses = 0
+        self.truncated = 0
+
+    def _affordable(self, budget_ms: float) -> int:
+        """预算内能打分的候选对数，尚无耗时估计时不限"""
+        if budget_ms is None or self._ms_per_pair is None:
+            return None
+        return max(1, int(budget_ms / self._ms_per_pair))
+
+    def rerank_many(self, queries: list[str], candidates_list: list[list[dict]], k: int,
+                    budget_ms: float = None) -> tuple[list[list[dict]], dict]:
+        """
+        批量重排：所有查询的未缓存候选对合成一个 batch
+
+        Args:
+            queries: 查询
+            candidates_list: 与 queries 对应的候选（按一阶段排名）
+            k: 每个查询保留数量
+            budget_ms: 覆盖默认预算
+
+        Returns:
+            (重排后的结果列表, 统计 {rerank_ms, rerank_pairs, rerank_cache_hits, rerank_truncated})
+            结果项附加 rerank_score；超出预算没有打分的候选 rerank_score 为 None，
+            按一阶段顺序排在已打分的候选之后
+        """
+        start = time.perf_counter()
+        budget_ms = self.budget_ms if budget_ms is None else budget_ms
+        keys = [normalize_message(q) for q in queries]
+
+        # 1. 查缓存；未缓存的按一阶段排名依次纳入，直到用完预算
+        #    （批量时各查询按名次轮流纳入，预算不会被排在前面的查询用光）
+        affordable = self._affordable(budget_ms)
+        scores = [dict() for _ in queries]
+        kept = [[] for _ in queries]
+        unscored = [[] for _ in queries]
+        pending = []  # (查询下标, 候选, 缓存键)
+        truncated = 0
+        hits = 0
+        order = sorted(
+            ((rank, qi, item) for qi, candidates in enumerate(candidates_list)
+             for rank, item in enumerate(candidates)),
+            key=lambda x: (x[0], x[1])
+        )
+        with self._lock:
+            for _, qi, item in order:
+                # 键带正文哈希：集合换版本后同一 ID 的正文可能变了，旧分数不能复用
+                cache_key = (keys[qi], document_keys([item])[0])
+                cached = self._cache.get(cache_key)
+                if cached is not None:
+                    self._cache.move_to_end(cache_key)
+                    scores[qi][item["id"]] = cached
+                    kept[qi].append(item)
+                    hits += 1
+                elif affordable is None or len(pending) < affordable:
+                    pending.append((qi, item, cache_key))
+                    kept[qi].append(item)
+                else:
+                    unscored[qi].append(item)
+                    truncated += 1
+            self.hits += hits
+            self.misses += len(pending)
+            self.truncated += truncated
+
+        # 2. 未缓存的候选一次 padded batch 打分
+        if pending:
+            pairs = [(queries[qi], document_text(item)) for qi, item, _ in pending]
+            score_start = time.perf_counter()
+            predicted = self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+            per_pair = (time.perf_counter() - score_start) * 1000 / len(pairs)
+
+            with self._lock:
+                self._ms_per_pair = per_pair if self._ms_per_pair is None else 0.8 * self._ms_per_pair + 0.2 * per_pair
+                for (qi, item, cache_key), score in zip(pending, predicted):
+                    scores[qi][item["id"]] = float(score)
+                    self._cache[cache_key] = float(score)
+                    self._cache.move_to_end(cache_key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        # 3. 已打分的按分数排序，未打分的按一阶段顺序接在后面，取前 k
+        results = []
+        for qi, items in enumerate(kept):
+            ranked = sorted(items, key=lambda item: scores[qi][item["id"]], reverse=True)[:k]
+            results.append([dict(item, rerank_score=scores[qi][item["id"]]) for item in ranked] +
+                           [dict(item, rerank_score=None) for item in unscored[qi][:k - len(ranked)]])
+
+        return results, {
+            "rerank_ms": round((time.perf_counter() - start) * 1000, 1),
+            "rerank_pairs": len(pending),
+            "rerank_cache_hits": hits,
+            "rerank_truncated": truncated,
+        }
+
+    def rerank(self, query: str, candidates: list[dict], k: int, budget_ms: float = None) -> tuple[list[dict], dict]:
+        """单条查询重排，返回 (结果, 统计)"""
+        results, stats = self.rerank_many([query], [candidates], k, budget_ms)
+        return results[0], stats
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "model": self.model_name,
+            "budget_ms": self.budget_ms,
+            "ms_per_pair": round(self._ms_per_pair, 3) if self._ms_per_pair is not None else None,
+            "cache_size": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "truncated": self.truncated,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,234 @@
+"""
+/chat 回复缓存：精确匹配
+
+缓存键 = 规范化后的消息 + 检索到的文档（ID + 正文哈希）+ 模型名，
+同一问题、同一批参考案例（且案例内容没有变化）、同一组模型才会命中。
+- 内存层：LRU + TTL，容量有上限
+- 磁盘层（可选）：SQLite，服务重启后仍然有效
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def document_keys(items: list[dict]) -> list[str]:
+    """
+    检索结果的 "ID@正文哈希"
+
+    文档 ID 是稳定的，正文变化后 ID 不变，只用 ID 做键会把按旧正文生成的回复（包括磁盘层）继续返回。
+    优先用导入时写入的 metadata.content_hash，没有时（如父文档）现算。
+    """
+    keys = []
+    for item in items:
+        digest = item.get("metadata", {}).get("content_hash")
+        if not digest:
+            digest = hashlib.sha1(item["document"].encode("utf-8")).hexdigest()[:16]
+        keys.append(f"{item['id']}@{digest}")
+    return keys
+
+
+def normalize_message(message: str) -> str:
+    """规范化消息：全角转半角、小写、合并空白"""
+    text = unicodedata.normalize("NFKC", message).lower().strip()
+    return re.sub(r"\s+", " ", text)
+
+
+class ResponseCache:
+    """LRU + TTL 回复缓存，可选 SQLite 持久化"""
+
+    # 磁盘层每写入多少条清理一次（清理要扫全表，不能每次写入都做；上限因此可能超出这么多条）
+    PRUNE_EVERY = 100
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600, db_path: str = None,
+                 disk_max_size: int = None):
+        """
+        Args:
+            max_size: 内存层最大条目数
+            ttl: 过期时间（秒）
+            db_path: SQLite 文件路径，为 None 时只用内存
+            disk_max_size: 磁盘层最大条目数，默认 max_size 的 10 倍
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.disk_max_size = disk_max_size or max_size * 10
+        self._items = OrderedDict()  # key -> (created_at, value)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # SQLite 连接不能跨 fork 共享，按进程延迟打开
+        self.db_path = db_path
+        self._db = None
+        self._db_pid = None
+        self._disk_writes = 0
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        """
+        从环境变量创建：
+        RESPONSE_CACHE_SIZE / RESPONSE_CACHE_TTL / RESPONSE_CACHE_DB（为空时只用内存）
+        """
+        return cls(
+            max_size=int(os.environ.get("RESPONSE_CACHE_SIZE", 1024)),
+            ttl=float(os.environ.get("RESPONSE_CACHE_TTL", 3600)),
+            db_path=os.environ.get("RESPONSE_CACHE_DB") or None
+        )
+
+    @staticmethod
+    def make_key(message: str, doc_keys: list[str], models: list[str]) -> str:
+        """由消息、检索结果（document_keys）和模型名生成缓存键"""
+        raw = json.dumps([normalize_message(message), list(doc_keys), list(models)], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _conn(self):
+        """当前进程的 SQLite 连接，未启用磁盘层时返回 None"""
+        if not self.db_path:
+            return None
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_created ON responses(created_at)")
+            self._db.commit()
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _expired(self, created_at: float) -> bool:
+        return time.time() - created_at > self.ttl
+
+    def _put_memory(self, key: str, created_at: float, value: dict):
+        self._items[key] = (created_at, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: str):
+        """查询缓存，未命中或已过期返回 None"""
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if not self._expired(created_at):
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._items[key]
+
+            db = self._conn()
+            if db is not None:
+                row = db.execute(
+                    "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and not self._expired(row[1]):
+                    value = json.loads(row[0])
+                    self._put_memory(key, row[1], value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: dict):
+        """写入缓存（value 需可 JSON 序列化）"""
+        created_at = time.time()
+        with self._lock:
+            self._put_memory(key, created_at, value)
+            db = self._conn()
+            if db is not None:
+                db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, created_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), created_at)
+                )
+                self._disk_writes += 1
+                if self._disk_writes % self.PRUNE_EVERY == 0:
+                    self._prune_disk(db)
+                db.commit()
+
+    def _prune_disk(self, db: sqlite3.Connection):
+        """清理磁盘层：删除过期条目，超出上限时删除最旧的"""
+        db.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,))
+        db.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.disk_max_size,)
+        )
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            db = self._conn()
+            if db is not None:
+                db.execute("DELETE FROM responses")
+                db.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class ReplyCache:
+    """
+    两级回复缓存：先精确匹配（ResponseCache），未命中再按 embedding 相似度查找（SemanticCache）
+
+    语义匹配限定在同一组模型（含编码器）和同一组识别出的产品内。
+    """
+
+    def __init__(self, exact: ResponseCache, semantic):
+        self.exact = exact
+        self.semantic = semantic
+
+    @staticmethod
+    def semantic_scope(models: list[str], products: list[str]) -> tuple:
+        return tuple(models), tuple(sorted(products))
+
+    def lookup(self, message: str, doc_keys: list[str], models: list[str], embedding,
+               products: list[str] = ()) -> tuple[str, dict, dict]:
+        """
+        Args:
+            doc_keys: 检索结果的 document_keys
+            products: 查询中识别出的产品，语义命中要求产品集合一致
+
+        Returns:
+            (cache_key, cached, cache_info)：cached 未命中时为 None，
+            cache_info 为接口返回的调试信息（hit / type / similarity）
+        """
+        cache_key = ResponseCache.make_key(message, doc_keys, models)
+        cached = self.exact.get(cache_key)
+        if cached is not None:
+            return cache_key, cached, {"hit": True, "type": "exact"}
+
+        cached, similarity = self.semantic.lookup(embedding, self.semantic_scope(models, products))
+        return cache_key, cached, {
+            "hit": cached is not None,
+            "type": "semantic" if cached is not None else None,
+            "similarity": round(similarity, 4)
+        }
+
+    def store(self, cache_key: str, embedding, value: dict, models: list[str], products: list[str] = ()):
+        self.exact.set(cache_key, value)
+        self.semantic.add(embedding, value, self.semantic_scope(models, products))
+
+    def clear(self):
+        self.exact.clear()
+        self.semantic.clear()
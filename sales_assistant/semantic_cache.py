@@ -0,0 +1,134 @@
+"""
+/chat 语义缓存：近似问题复用回复
+
+"价格太贵了怎么办" 和 "客户嫌贵怎么回" 措辞不同，精确缓存命中不了。
+这里保存最近问题的 query embedding（RAGEngine 检索时已经算过），
+新问题先和缓存矩阵做一次向量化余弦相似度计算，超过阈值就直接复用回复。
+
+只在同一 scope（编码器和模型列表 + 识别出的产品）内匹配："充电宝太贵了" 和 "耳机太贵了"
+向量很接近，但回复里的产品不同，不能互相复用；换了销售模型后旧回复也不再命中。
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class SemanticCache:
+    """基于 embedding 相似度的回复缓存，容量满时淘汰最久未使用的条目"""
+
+    def __init__(self, capacity: int = 512, threshold: float = 0.92, ttl: float = 3600):
+        """
+        Args:
+            capacity: 最大条目数
+            threshold: 余弦相似度阈值，达到才算命中
+            ttl: 过期时间（秒）
+        """
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+        # 首次写入时按 embedding 维度分配
+        self._vectors = None
+        self._values = [None] * capacity
+        self._scopes = [None] * capacity
+        self._created = np.zeros(capacity)
+        self._last_used = np.zeros(capacity)
+        self._size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls) -> "SemanticCache":
+        """从环境变量创建：SEMANTIC_CACHE_SIZE / SEMANTIC_CACHE_THRESHOLD / SEMANTIC_CACHE_TTL"""
+        return cls(
+            capacity=int(os.environ.get("SEMANTIC_CACHE_SIZE", 512)),
+            threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.92)),
+            ttl=float(os.environ.get("SEMANTIC_CACHE_TTL", 3600))
+        )
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, embedding, scope=None) -> tuple[dict, float]:
+        """
+        在同一 scope 的缓存问题中查找最相似的
+
+        Args:
+            embedding: 查询向量
+            scope: 可哈希的匹配范围，只和 scope 相同的条目比较
+
+        Returns:
+            (value, similarity)：未命中时 value 为 None，similarity 为最高相似度（无缓存时为 0）
+        """
+        query = self._normalize(embedding)
+        with self._lock:
+            # 编码器换了维度时旧条目全部不可比
+            if self._size == 0 or self._vectors.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None, 0.0
+
+            sims = self._vectors[:self._size] @ query
+            expired = time.time() - self._created[:self._size] > self.ttl
+            sims[expired] = -1.0
+            sims[[s != scope for s in self._scopes[:self._size]]] = -1.0
+
+            best = int(np.argmax(sims))
+            similarity = float(sims[best])
+            if similarity >= self.threshold:
+                self._last_used[best] = time.time()
+                self.hits += 1
+                return self._values[best], similarity
+
+            self.misses += 1
+            return None, max(similarity, 0.0)
+
+    def add(self, embedding, value: dict, scope=None):
+        """写入缓存，满时替换最久未使用（或已过期）的条目"""
+        vector = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+                self._vectors = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+                self._size = 0
+
+            if self._size < self.capacity:
+                slot = self._size
+                self._size += 1
+            else:
+                # 已过期的条目优先淘汰，其次是最久未使用的
+                priority = self._last_used.copy()
+                priority[now - self._created > self.ttl] = -1.0
+                slot = int(np.argmin(priority))
+                self.evictions += 1
+
+            self._vectors[slot] = vector
+            self._values[slot] = value
+            self._scopes[slot] = scope
+            self._created[slot] = now
+            self._last_used[slot] = now
+
+    def clear(self):
+        with self._lock:
+            self._values = [None] * self.capacity
+            self._scopes = [None] * self.capacity
+            self._size = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": self._size,
+            "capacity": self.capacity,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,183 @@
+"""
+稀疏检索：BM25 倒排索引 + 倒数排名融合（RRF）
+
+买家消息里有大量需要精确匹配的词："MOQ"、"$/pc"、"CE/FCC"、产品名和价格，
+稠密向量相似度容易把它们模糊掉。这里在导入时对对话内容建倒排索引：
+- 中文按字 bigram 切分
+- 英文 / 数字按词切分，"CE/FCC"、"$3.50/pc" 这类复合词同时保留整体和各部分
+"""
+import json
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import numpy as np
+
+from collection_versions import replace_atomically
+
+_CJK_RUN = re.compile(r"[一-鿿]+")
+_ASCII_TOKEN = re.compile(r"[a-z0-9$%]+(?:[./][a-z0-9$%]+)*")
+
+
+def tokenize(text: str) -> list[str]:
+    """中文字 bigram + 英文词"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+
+    for word in _ASCII_TOKEN.findall(text):
+        tokens.append(word)
+        if "/" in word:
+            tokens.extend(part for part in word.split("/") if part)
+
+    return tokens
+
+
+class BM25Index:
+    """
+    BM25 倒排索引
+
+    建索引时把每个 (词, 文档) 的 BM25 权重算好，查询时只需按查询词累加。
+    """
+
+    def __init__(self, ids: list[str], postings: dict, k1: float = 1.5, b: float = 0.75,
+                 products: list[str] = None):
+        """
+        Args:
+            ids: 文档 ID，下标即文档序号
+            postings: 词 -> (文档序号数组, BM25 权重数组)
+            products: 每篇文档的产品（用于按产品过滤），可为空
+        """
+        self.ids = ids
+        self.postings = postings
+        self.k1 = k1
+        self.b = b
+        self.products = np.array(products if products is not None else [""] * len(ids), dtype=object)
+
+    @classmethod
+    def build(cls, ids: list[str], documents: list[str], k1: float = 1.5, b: float = 0.75,
+              products: list[str] = None) -> "BM25Index":
+        """从文档构建索引"""
+        products = products if products is not None else [""] * len(ids)
+        return cls.build_from_records(zip(ids, documents, products), k1=k1, b=b)
+
+    @classmethod
+    def build_from_records(cls, records, k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        """从 (文档 ID, 文档, 产品) 迭代器构建索引，文档正文只在分词时经过，不整体驻留内存"""
+        ids, products, term_freqs = [], [], []
+        for doc_id, doc, product in records:
+            ids.append(doc_id)
+            products.append(product)
+            term_freqs.append(Counter(tokenize(doc)))
+        doc_lens = np.array([sum(tf.values()) for tf in term_freqs], dtype=np.float32)
+        avgdl = float(doc_lens.mean()) if len(doc_lens) else 0.0
+        n_docs = len(term_freqs)
+
+        raw = defaultdict(lambda: ([], []))
+        for doc_idx, tf in enumerate(term_freqs):
+            for term, freq in tf.items():
+                raw[term][0].append(doc_idx)
+                raw[term][1].append(freq)
+
+        postings = {}
+        for term, (doc_idxs, freqs) in raw.items():
+            doc_idxs = np.array(doc_idxs, dtype=np.int32)
+            freqs = np.array(freqs, dtype=np.float32)
+            df = len(doc_idxs)
+            idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            norm = k1 * (1 - b + b * doc_lens[doc_idxs] / avgdl)
+            postings[term] = (doc_idxs, (idf * freqs * (k1 + 1) / (freqs + norm)).astype(np.float32))
+
+        return cls(ids, postings, k1=k1, b=b, products=products)
+
+    def save(self, path: str):
+        data = {
+            "k1": self.k1,
+            "b": self.b,
+            "ids": self.ids,
+            "products": self.products.tolist(),
+            "postings": {
+                term: [doc_idxs.tolist(), weights.round(5).tolist()]
+                for term, (doc_idxs, weights) in self.postings.items()
+            }
+        }
+        # 增量导入会重写当前版本的索引：写临时文件后原子替换
+        with replace_atomically(path) as tmp, open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        postings = {
+            term: (np.array(doc_idxs, dtype=np.int32), np.array(weights, dtype=np.float32))
+            for term, (doc_idxs, weights) in data["postings"].items()
+        }
+        return cls(data["ids"], postings, k1=data["k1"], b=data["b"], products=data.get("products"))
+
+    def search(self, query: str, k: int = 5, products: list[str] = None) -> list[tuple[str, float]]:
+        """
+        返回 [(doc_id, score), ...]，按分数降序，只包含命中至少一个词的文档
+
+        Args:
+            products: 只在这些产品的文档中检索，为空时不过滤
+        """
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is not None:
+                scores[posting[0]] += posting[1]
+        if products:
+            scores[~np.isin(self.products, products)] = 0
+
+        hit = np.flatnonzero(scores)
+        if len(hit) == 0:
+            return []
+        if len(hit) > k:
+            hit = hit[np.argpartition(-scores[hit], k - 1)[:k]]
+        hit = hit[np.argsort(-scores[hit])]
+        return [(self.ids[i], float(scores[i])) for i in hit]
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = 60) -> list[tuple[str, float]]:
+    """
+    倒数排名融合：score(d) = Σ 1 / (k + rank)
+
+    Args:
+        rankings: 多路检索各自的 ID 排名（rank 从 1 开始）
+        k: 平滑常数，越大越平均
+
+    Returns:
+        [(doc_id, score), ...]，按融合分数降序
+    """
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            fused[doc_id] += 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)
+
+
+def main():
+    """对导入数据建 BM25 索引并测试检索"""
+    from import_data import load_dialogues, create_documents
+
+    base = Path(__file__).parent
+    documents, metadatas, ids = create_documents(load_dialogues(str(base.parent / "dialogue_data.jsonl")))
+    index = BM25Index.build(ids, documents, products=[m["product"] for m in metadatas])
+    index.save(str(base / "sparse_index.json"))
+    print(f"✅ BM25 索引: {len(ids)} 篇文档，{len(index.postings)} 个词")
+
+    for query in ["MOQ能不能降", "有CE/FCC认证吗", "$/pc 报价"]:
+        print(f"\n🔍 {query} -> {tokenize(query)}")
+        for doc_id, score in index.search(query, k=3):
+            print(f"  {doc_id}: {score:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,550 @@
+"""
+向量检索后端
+
+- ChromaStore: 基于 chromadb 集合（默认）
+- NumpyStore: 进程内 NumPy 索引，归一化向量存为内存映射矩阵，
+  精确 top-k（矩阵-向量乘 + argpartition），没有序列化和 SQLite 开销，
+  适合几千到几十万条对话的语料
+- QuantizedStore: 在 NumpyStore 目录上加 int8 / 二值量化向量，常驻内存只有量化矩阵，
+  先用量化向量粗排，再从 mmap 的全精度矩阵取候选重排
+
+三者的 query() 返回格式一致，RAGEngine 可以任意切换。
+ParentStore 保存完整对话（父文档），发言级检索命中后按 parent_id 批量取回。
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from collection_versions import replace_atomically
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _write_records(path, ids: list[str], documents, metadatas: list[dict]):
+    """
+    写 {"ids", "documents", "metadatas"} 记录文件
+
+    documents 可以是迭代器：逐条写出，文档正文不必整体驻留内存。
+    """
+    with replace_atomically(path) as tmp, open(tmp, "w", encoding="utf-8") as f:
+        f.write('{"ids": ')
+        json.dump(list(ids), f, ensure_ascii=False)
+        f.write(', "documents": [')
+        for i, doc in enumerate(documents):
+            if i:
+                f.write(", ")
+            json.dump(doc, f, ensure_ascii=False)
+        f.write('], "metadatas": ')
+        json.dump(list(metadatas), f, ensure_ascii=False)
+        f.write("}")
+
+
+def _save_npy(path, array: np.ndarray):
+    """原子地写 .npy（传文件对象，np.save 不会给临时文件名追加 .npy）"""
+    with replace_atomically(path) as tmp, open(tmp, "wb") as f:
+        np.save(f, array)
+
+
+def open_chroma_client(db_path: str, fresh: bool = False):
+    """
+    打开 Chroma PersistentClient
+
+    chromadb 按路径在进程内缓存 System（含已加载的 HNSW 段），同一路径再建 client 拿到的还是旧段，
+    看不到其他进程（import_data.py --incremental）之后写入 / 删除的数据。fresh=True 时先丢弃缓存，
+    从磁盘重新加载；旧 client 不受影响，旧引擎上的请求照常完成。
+    """
+    import chromadb
+    from chromadb.api.client import SharedSystemClient
+
+    if fresh:
+        SharedSystemClient.clear_system_cache()
+    return chromadb.PersistentClient(path=str(db_path))
+
+
+class ChromaStore:
+    """Chroma 集合检索后端"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def query(self, embeddings, k: int, where: dict = None) -> list[list[dict]]:
+        """
+        批量检索
+
+        Args:
+            embeddings: 查询向量
+            k: 每个查询返回数量
+            where: 元数据过滤条件（Chroma where 语法），如 {"product": "充电宝"}
+
+        Returns:
+            与 embeddings 一一对应的结果列表，每条包含 id, document, metadata, distance
+        """
+        results = self.collection.query(
+            query_embeddings=[np.asarray(e).tolist() for e in embeddings],
+            n_results=k,
+            where=where
+        )
+
+        batch = []
+        for row in range(len(results['documents'])):
+            items = []
+            for i in range(len(results['documents'][row])):
+                items.append({
+                    "id": results['ids'][row][i],
+                    "document": results['documents'][row][i],
+                    "metadata": results['metadatas'][row][i],
+                    "distance": results['distances'][row][i] if results.get('distances') else None
+                })
+            batch.append(items)
+        return batch
+
+    def get(self, ids: list[str]) -> list[dict]:
+        """按 ID 批量取文档（一次 collection.get），按传入顺序返回，不存在的 ID 跳过"""
+        if not ids:
+            return []
+        results = self.collection.get(ids=list(ids), include=["documents", "metadatas"])
+        by_id = {
+            doc_id: {"id": doc_id, "document": doc, "metadata": meta}
+            for doc_id, doc, meta in zip(results['ids'], results['documents'], results['metadatas'])
+        }
+        return [by_id[doc_id] for doc_id in ids if doc_id in by_id]
+
+    def embeddings(self, ids: list[str]) -> np.ndarray:
+        """按 ID 批量取向量（一次 collection.get），按传入顺序返回"""
+        if not ids:
+            return np.empty((0, 0), dtype=np.float32)
+        results = self.collection.get(ids=list(ids), include=["embeddings"])
+        by_id = dict(zip(results['ids'], results['embeddings']))
+        return np.asarray([by_id[doc_id] for doc_id in ids], dtype=np.float32)
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def metadata_values(self, key: str) -> set:
+        """集合中某个元数据字段的所有取值"""
+        results = self.collection.get(include=["metadatas"])
+        return {meta[key] for meta in results['metadatas'] if meta and key in meta}
+
+
+class NumpyStore:
+    """
+    进程内 NumPy 向量索引
+
+    目录结构:
+        embeddings.npy  归一化向量矩阵（float32 或 float16），以 mmap 方式加载
+        records.json    与矩阵逐行对应的 ids / documents / metadatas
+
+    distance 返回 2 - 2·cos，即归一化向量的 L2 平方距离，与 Chroma 默认的 l2 空间一致。
+    各文件写临时文件后原子替换，增量导入重写当前版本的索引时，已加载的进程继续读旧文件。
+    """
+
+    EMBEDDINGS_FILE = "embeddings.npy"
+    RECORDS_FILE = "records.json"
+
+    # float16 矩阵分块计算，限制临时 float32 副本的大小
+    BLOCK_ROWS = 65536
+
+    def __init__(self, path: str, mmap: bool = True):
+        path = Path(path)
+        self.path = path
+        self.matrix = np.load(path / self.EMBEDDINGS_FILE, mmap_mode="r" if mmap else None)
+        with open(path / self.RECORDS_FILE, "r", encoding="utf-8") as f:
+            records = json.load(f)
+        self.ids = records["ids"]
+        self.documents = records["documents"]
+        self.metadatas = records["metadatas"]
+
+        if len(self.ids) != self.matrix.shape[0]:
+            raise ValueError(f"索引文件不一致: {len(self.ids)} 条记录 vs {self.matrix.shape[0]} 行向量")
+        self._row_of = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        self._partitions = {}  # 元数据字段 -> {取值: 行号数组}
+
+    @classmethod
+    def write(cls, path: str, ids: list[str], documents: list[str], metadatas: list[dict],
+              embeddings: np.ndarray, dtype: str = "float32"):
+        """写入索引目录（向量先归一化，再按 dtype 存储）"""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        matrix = _normalize_rows(embeddings).astype(dtype)
+        _save_npy(path / cls.EMBEDDINGS_FILE, matrix)
+        _write_records(path / cls.RECORDS_FILE, ids, documents, metadatas)
+
+    @classmethod
+    def write_from_collection(cls, path: str, collection, dtype: str = "float32", page_size: int = 4096) -> int:
+        """
+        从 Chroma 集合分页导出索引：向量逐页写入 .npy 内存映射，文档正文第二遍分页流式写出，
+        峰值内存与集合大小无关（ids / metadatas 除外）
+
+        Returns:
+            导出的条数
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        count = collection.count()
+        if not count:
+            return 0
+        ids, metadatas = [], []
+        with replace_atomically(path / cls.EMBEDDINGS_FILE) as tmp:
+            matrix = None
+            for offset in range(0, count, page_size):
+                page = collection.get(limit=page_size, offset=offset, include=["embeddings", "metadatas"])
+                block = _normalize_rows(page["embeddings"])
+                if matrix is None:
+                    matrix = np.lib.format.open_memmap(tmp, mode="w+", dtype=dtype, shape=(count, block.shape[1]))
+                matrix[offset:offset + len(block)] = block
+                ids += page["ids"]
+                metadatas += page["metadatas"]
+            matrix.flush()
+            del matrix
+
+        documents = (
+            doc
+            for offset in range(0, count, page_size)
+            for doc in collection.get(limit=page_size, offset=offset, include=["documents"])["documents"]
+        )
+        _write_records(path / cls.RECORDS_FILE, ids, documents, metadatas)
+        return count
+
+    def _scores(self, queries: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        """文档（或 rows 指定的子集）对所有查询的余弦相似度，形状 (n_docs, n_queries)"""
+        if rows is not None:
+            return np.asarray(self.matrix[rows], dtype=np.float32) @ queries.T
+        if self.matrix.dtype == np.float32:
+            return self.matrix @ queries.T
+        scores = np.empty((self.matrix.shape[0], queries.shape[0]), dtype=np.float32)
+        for start in range(0, self.matrix.shape[0], self.BLOCK_ROWS):
+            block = np.asarray(self.matrix[start:start + self.BLOCK_ROWS], dtype=np.float32)
+            scores[start:start + len(block)] = block @ queries.T
+        return scores
+
+    def _rows_for(self, where: dict) -> np.ndarray:
+        """
+        元数据过滤对应的行号（按取值预先分区并缓存）
+
+        支持 {key: value} 和 {key: {"$in": [...]}} 两种形式。
+        """
+        (key, condition), = where.items()
+        values = condition["$in"] if isinstance(condition, dict) else [condition]
+
+        partitions = self._partitions.get(key)
+        if partitions is None:
+            grouped = {}
+            for row, meta in enumerate(self.metadatas):
+                if key in meta:
+                    grouped.setdefault(meta[key], []).append(row)
+            partitions = {value: np.array(rows, dtype=np.int64) for value, rows in grouped.items()}
+            self._partitions[key] = partitions
+
+        parts = [partitions[v] for v in values if v in partitions]
+        return np.sort(np.concatenate(parts)) if parts else np.array([], dtype=np.int64)
+
+    def query(self, embeddings, k: int, where: dict = None) -> list[list[dict]]:
+        """批量精确 top-k 检索，返回格式同 ChromaStore.query；where 过滤时只在对应分区内计算"""
+        queries = _normalize_rows(np.atleast_2d(np.asarray(embeddings, dtype=np.float32)))
+        rows = self._rows_for(where) if where else None
+        if rows is not None and len(rows) == 0:
+            return [[] for _ in range(len(queries))]
+
+        scores = self._scores(queries, rows)
+        k = min(k, scores.shape[0])
+
+        batch = []
+        for col in range(scores.shape[1]):
+            column = scores[:, col]
+            top = _top_k(column, k)
+            doc_rows = rows[top] if rows is not None else top
+            batch.append([self._item(r, column[i]) for i, r in zip(top, doc_rows)])
+        return batch
+
+    def _item(self, row: int, similarity: float) -> dict:
+        return {
+            "id": self.ids[row],
+            "document": self.documents[row],
+            "metadata": self.metadatas[row],
+            "distance": float(2.0 - 2.0 * similarity)
+        }
+
+    def get(self, ids: list[str]) -> list[dict]:
+        """按 ID 批量取文档，按传入顺序返回，不存在的 ID 跳过"""
+        rows = [self._row_of[doc_id] for doc_id in ids if doc_id in self._row_of]
+        return [{
+            "id": self.ids[row],
+            "document": self.documents[row],
+            "metadata": self.metadatas[row]
+        } for row in rows]
+
+    def embeddings(self, ids: list[str]) -> np.ndarray:
+        """按 ID 批量取（归一化后的）向量，按传入顺序返回"""
+        rows = [self._row_of[doc_id] for doc_id in ids]
+        return np.asarray(self.matrix[rows], dtype=np.float32)
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def metadata_values(self, key: str) -> set:
+        return {meta[key] for meta in self.metadatas if key in meta}
+
+
+class ParentStore:
+    """
+    父文档（完整对话）存储
+
+    不参与向量检索，只供发言级检索命中后按 parent_id 批量取回完整对话。
+    文件格式同 NumpyStore 的 records.json。
+    """
+
+    def __init__(self, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            records = json.load(f)
+        self._by_id = {
+            doc_id: {"id": doc_id, "document": doc, "metadata": meta}
+            for doc_id, doc, meta in zip(records["ids"], records["documents"], records["metadatas"])
+        }
+
+    @staticmethod
+    def write(path: str, ids: list[str], documents, metadatas: list[dict]):
+        """documents 可以是迭代器（流式写出）"""
+        _write_records(path, ids, documents, metadatas)
+
+    def get(self, ids: list[str]) -> list[dict]:
+        """按 ID 批量取文档，按传入顺序返回，不存在的 ID 跳过"""
+        return [dict(self._by_id[doc_id]) for doc_id in ids if doc_id in self._by_id]
+
+    def count(self) -> int:
+        return len(self._by_id)
+
+
+class QuantizedStore(NumpyStore):
+    """
+    量化向量索引（两阶段检索）
+
+    在 NumpyStore 目录中额外保存:
+        int8.npy / int8_range.npy  按维度 min/max 标定的 int8 标量量化向量（1/4 大小）
+        binary.npy                 符号位打包的二值向量（1/32 大小），粗排用 Hamming 距离
+
+    第一阶段在量化矩阵上取 k × rescore_multiplier 个候选，
+    第二阶段只从 mmap 的全精度矩阵读取这些行精确重排，返回的 distance 是全精度结果。
+    """
+
+    INT8_FILE = "int8.npy"
+    INT8_RANGE_FILE = "int8_range.npy"
+    BINARY_FILE = "binary.npy"
+    QUANTIZATIONS = ("int8", "binary")
+
+    # 字节 -> 置 1 的位数
+    _POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def __init__(self, path: str, quantization: str = "int8", rescore_multiplier: int = 4):
+        if quantization not in self.QUANTIZATIONS:
+            raise ValueError(f"未知的量化方式: {quantization}")
+        super().__init__(path, mmap=True)
+        self.quantization = quantization
+        self.rescore_multiplier = rescore_multiplier
+
+        if quantization == "int8":
+            self.codes = np.load(self.path / self.INT8_FILE)
+            low, high = np.load(self.path / self.INT8_RANGE_FILE)
+            self.scale = ((high - low) / 255.0).astype(np.float32)
+            self.offset = (low + 128.0 * self.scale).astype(np.float32)
+        else:
+            self.codes = np.load(self.path / self.BINARY_FILE)
+
+        if self.codes.shape[0] != self.matrix.shape[0]:
+            raise ValueError(f"量化文件与索引不一致: {self.codes.shape[0]} vs {self.matrix.shape[0]} 行")
+
+    @classmethod
+    def quantize(cls, path: str):
+        """为已导出的 NumpyStore 目录生成 int8 和二值量化文件"""
+        path = Path(path)
+        matrix = np.load(path / cls.EMBEDDINGS_FILE, mmap_mode="r")
+        n, dim = matrix.shape
+
+        def blocks():
+            for start in range(0, n, cls.BLOCK_ROWS):
+                yield start, np.asarray(matrix[start:start + cls.BLOCK_ROWS], dtype=np.float32)
+
+        # 按维度标定范围；x ≈ offset + scale * code，code ∈ [-128, 127]
+        # 全精度矩阵分块读取，量化结果分块写入内存映射，峰值内存与条数无关
+        low = np.full(dim, np.inf, dtype=np.float32)
+        high = np.full(dim, -np.inf, dtype=np.float32)
+        for _, block in blocks():
+            np.minimum(low, block.min(axis=0), out=low)
+            np.maximum(high, block.max(axis=0), out=high)
+        high = np.where(high > low, high, low + 1e-6)
+        scale = (high - low) / 255.0
+
+        with replace_atomically(path / cls.INT8_FILE) as codes_tmp, \
+                replace_atomically(path / cls.BINARY_FILE) as bits_tmp:
+            codes = np.lib.format.open_memmap(codes_tmp, mode="w+", dtype=np.int8, shape=(n, dim))
+            bits = np.lib.format.open_memmap(bits_tmp, mode="w+", dtype=np.uint8, shape=(n, (dim + 7) // 8))
+            for start, block in blocks():
+                codes[start:start + len(block)] = np.clip(np.round((block - low) / scale) - 128, -128, 127)
+                bits[start:start + len(block)] = np.packbits(block > 0, axis=1)
+            codes.flush()
+            bits.flush()
+            del codes, bits
+        _save_npy(path / cls.INT8_RANGE_FILE, np.stack([low, high]).astype(np.float32))
+
+    def _approx_scores(self, queries: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        """量化向量上的近似分数（越大越相似），形状 (n_docs, n_queries)"""
+        codes = self.codes[rows] if rows is not None else self.codes
+        scores = np.empty((codes.shape[0], queries.shape[0]), dtype=np.float32)
+
+        if self.quantization == "int8":
+            # q·x ≈ (q ⊙ scale)·code + q·offset
+            scaled = (queries * self.scale).T
+            bias = queries @ self.offset
+            for start in range(0, codes.shape[0], self.BLOCK_ROWS):
+                block = codes[start:start + self.BLOCK_ROWS].astype(np.float32)
+                scores[start:start + len(block)] = block @ scaled + bias
+        else:
+            query_bits = np.packbits(queries > 0, axis=1)
+            for col, bits in enumerate(query_bits):
+                for start in range(0, codes.shape[0], self.BLOCK_ROWS):
+                    block = codes[start:start + self.BLOCK_ROWS]
+                    hamming = self._POPCOUNT[np.bitwise_xor(block, bits)].sum(axis=1, dtype=np.int32)
+                    scores[start:start + len(block), col] = -hamming
+        return scores
+
+    def query(self, embeddings, k: int, where: dict = None) -> list[list[dict]]:
+        """量化粗排 + 全精度重排，返回格式同 NumpyStore.query"""
+        queries = _normalize_rows(np.atleast_2d(np.asarray(embeddings, dtype=np.float32)))
+        rows = self._rows_for(where) if where else None
+        if rows is not None and len(rows) == 0:
+            return [[] for _ in range(len(queries))]
+
+        approx = self._approx_scores(queries, rows)
+        n_candidates = min(k * self.rescore_multiplier, approx.shape[0])
+
+        batch = []
+        for col, query in enumerate(queries):
+            candidates = _top_k(approx[:, col], n_candidates, ordered=False)
+            doc_rows = np.sort(rows[candidates] if rows is not None else candidates)
+            exact = np.asarray(self.matrix[doc_rows], dtype=np.float32) @ query
+            top = _top_k(exact, min(k, len(exact)))
+            batch.append([self._item(doc_rows[i], exact[i]) for i in top])
+        return batch
+
+    def memory_bytes(self) -> int:
+        """常驻的量化矩阵大小（全精度矩阵按需从 mmap 读取，不计入）"""
+        return int(self.codes.nbytes)
+
+
+def _top_k(scores: np.ndarray, k: int, ordered: bool = True) -> np.ndarray:
+    """分数最高的 k 个下标，ordered 时按分数降序"""
+    top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    return top[np.argsort(-scores[top])] if ordered else top
+
+
+def compare_quantization(path: str, queries: np.ndarray, k: int = 5, rescore_multiplier: int = 4) -> dict:
+    """
+    对比全精度与各量化方式的内存、召回和延迟
+
+    recall 以全精度精确检索的 top-k 为基准。
+
+    Returns:
+        {名称: {"memory_mb": ..., "saving": ..., "recall": ..., "p50_ms": ...}}
+    """
+    exact_store = NumpyStore(path, mmap=False)
+    exact = [[item["id"] for item in items] for items in exact_store.query(queries, k)]
+    full_bytes = exact_store.matrix.astype(np.float32).nbytes
+
+    stores = {"float32": exact_store}
+    for quantization in QuantizedStore.QUANTIZATIONS:
+        stores[quantization] = QuantizedStore(path, quantization, rescore_multiplier)
+
+    report = {}
+    for name, store in stores.items():
+        memory = full_bytes if name == "float32" else store.memory_bytes()
+        hits = 0
+        for q, expected in zip(queries, exact):
+            got = {item["id"] for item in store.query([q], k)[0]}
+            hits += len(got & set(expected))
+        report[name] = {
+            "memory_mb": round(memory / 1024 / 1024, 3),
+            "saving": round(1 - memory / full_bytes, 4),
+            f"recall@{k}": round(hits / (len(queries) * k), 4),
+            **compare_latency({name: store}, queries, k, repeat=1)[name],
+        }
+    return report
+
+
+def compare_latency(stores: dict, queries: np.ndarray, k: int = 5, repeat: int = 3) -> dict:
+    """
+    比较各后端的单查询延迟
+
+    Args:
+        stores: {名称: 后端实例}
+        queries: 查询向量矩阵
+
+    Returns:
+        {名称: {"p50_ms": ..., "p99_ms": ...}}
+    """
+    report = {}
+    for name, store in stores.items():
+        latencies = []
+        for _ in range(repeat):
+            for q in queries:
+                start = time.perf_counter()
+                store.query([q], k)
+                latencies.append((time.perf_counter() - start) * 1000)
+        report[name] = {
+            "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        }
+    return report
+
+
+def main():
+    """对比 Chroma 与 NumPy 后端的检索延迟，或（--quantization）量化的内存节省与召回损失"""
+    parser = argparse.ArgumentParser(description="向量检索后端对比")
+    parser.add_argument("--quantization", action="store_true", help="对比全精度 / int8 / 二值量化")
+    parser.add_argument("--index-path", help="NumPy 索引目录，默认为 dialogues 当前版本的索引")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--rescore-multiplier", type=int, default=4)
+    args = parser.parse_args()
+
+    from collection_versions import resolve_collection
+    from rag_engine import index_paths
+
+    base = Path(__file__).parent
+    collection = resolve_collection(base / "chroma_db", "dialogues")
+    index_path = args.index_path or str(index_paths(collection)[0])
+    numpy_store = NumpyStore(index_path)
+
+    rng = np.random.default_rng(0)
+    sample = rng.choice(numpy_store.count(), size=min(200, numpy_store.count()), replace=False)
+    queries = np.asarray(numpy_store.matrix[np.sort(sample)], dtype=np.float32)
+    queries += rng.normal(scale=0.01, size=queries.shape).astype(np.float32)
+    print(f"📦 文档数: {numpy_store.count()}，查询数: {len(queries)}")
+
+    if args.quantization:
+        if not (Path(index_path) / QuantizedStore.INT8_FILE).exists():
+            QuantizedStore.quantize(index_path)
+        report = compare_quantization(index_path, queries, args.k, args.rescore_multiplier)
+        for name, stats in report.items():
+            print(f"  {name:>7}: {stats['memory_mb']:.2f} MB（节省 {stats['saving']:.0%}），"
+                  f"recall@{args.k} {stats[f'recall@{args.k}']:.3f}，p50 {stats['p50_ms']:.3f} ms")
+        return
+
+    import chromadb
+
+    client = chromadb.PersistentClient(path=str(base / "chroma_db"))
+    stores = {
+        "chroma": ChromaStore(client.get_collection(collection)),
+        "numpy": numpy_store,
+    }
+    for name, stats in compare_latency(stores, queries, args.k).items():
+        print(f"  {name:>6}: p50 {stats['p50_ms']:.3f} ms, p99 {stats['p99_ms']:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
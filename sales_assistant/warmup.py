@@ -0,0 +1,141 @@
+"""
+启动预热与就绪状态
+
+延迟初始化会让部署后的第一个 /chat 承担加载 BGE-M3、打开 chroma_db、
+Ollama 冷加载两个模型的全部开销。预热按阶段提前完成这些工作，
+/readyz 在所有阶段完成前返回 503，负载均衡据此决定是否导流。
+
+阶段失败不会被永久标记为失败：后台预热按指数退避一直重试（Ollama 晚于服务启动也能恢复就绪）。
+生产模式下 master 只加载模型权重和向量库客户端（preload_engine），不做任何计算；
+所有预热阶段（dummy encode、检索、Ollama）都在每个 worker fork 之后后台进行，不阻塞 fork。
+"""
+import threading
+import time
+
+
+class WarmupState:
+    """各预热阶段的状态（线程安全）"""
+
+    STAGES = ("encoder", "vector_store", "analyst_model", "sales_model")
+    LOCAL_STAGES = ("encoder", "vector_store")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {
+            stage: {"status": "pending", "ms": None, "error": None}
+            for stage in self.STAGES
+        }
+
+    def mark(self, stage: str, status: str, ms: float = None, error: str = None, attempts: int = None):
+        with self._lock:
+            self._stages[stage] = {
+                "status": status,
+                "ms": round(ms, 1) if ms is not None else None,
+                "error": error,
+                "attempts": attempts
+            }
+
+    def pending(self) -> list[str]:
+        """尚未就绪的阶段"""
+        with self._lock:
+            return [stage for stage, info in self._stages.items() if info["status"] != "ready"]
+
+    def ready(self) -> bool:
+        with self._lock:
+            return all(s["status"] == "ready" for s in self._stages.values())
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {stage: dict(info) for stage, info in self._stages.items()}
+
+
+def _run_stage(state: WarmupState, stage: str, func, attempts: int, retry_interval: float,
+               max_interval: float) -> bool:
+    """
+    执行单个阶段，失败时按指数退避重试，返回是否成功
+
+    attempts 为 None 时一直重试到成功；用完次数时阶段保持 retrying，之后的预热还会再试。
+    """
+    state.mark(stage, "running")
+    attempt = 0
+    interval = retry_interval
+    while True:
+        attempt += 1
+        start = time.perf_counter()
+        try:
+            func()
+            state.mark(stage, "ready", ms=(time.perf_counter() - start) * 1000, attempts=attempt)
+            return True
+        except Exception as e:
+            state.mark(stage, "retrying", error=str(e), attempts=attempt)
+            if attempts is not None and attempt >= attempts:
+                return False
+            time.sleep(interval)
+            interval = min(interval * 2, max_interval)
+
+
+def run_warmup(state: WarmupState, get_engine, client, stages: list[str] = None, attempts: int = None,
+               retry_interval: float = 1.0, max_interval: float = 60.0):
+    """
+    依次执行预热阶段：
+    1. encoder: 加载 Embedding 模型并做一次 dummy encode
+    2. vector_store: 打开向量库并做一次检索
+    3. analyst_model / sales_model: 让 Ollama 加载模型并保持常驻
+
+    Args:
+        state: 预热状态
+        get_engine: 返回 RAGEngine 的函数（首次调用时加载模型）
+        client: DualModelClient，用于预热 Ollama 模型（只预热本地阶段时可为 None）
+        stages: 要执行的阶段，默认所有未就绪的阶段
+        attempts: 每个阶段的最多尝试次数，None 表示一直重试到成功
+        retry_interval / max_interval: 重试间隔的初始值和上限（秒），每次失败翻倍
+    """
+    stages = state.pending() if stages is None else stages
+    retry = dict(attempts=attempts, retry_interval=retry_interval, max_interval=max_interval)
+    def warm_encoder():
+        get_engine().model.encode(["预热"])
+
+    def warm_vector_store():
+        engine = get_engine()
+        engine.search("预热", k=1, query_embedding=engine.model.encode(["预热"])[0])
+
+    if "encoder" not in stages or _run_stage(state, "encoder", warm_encoder, **retry):
+        if "vector_store" in stages:
+            _run_stage(state, "vector_store", warm_vector_store, **retry)
+
+    if "analyst_model" in stages:
+        _run_stage(state, "analyst_model", lambda: client.warm_model(client.analyst_model), **retry)
+    if "sales_model" in stages:
+        _run_stage(state, "sales_model", lambda: client.warm_model(client.sales_model), **retry)
+
+
+def preload_engine(get_engine, attempts: int = 3, retry_interval: float = 1.0) -> bool:
+    """
+    fork 之前在 master 中只加载模型权重和向量库客户端，不做 encode / 检索，返回是否加载成功
+
+    PyTorch 的 OpenMP 运行时（libgomp）在父进程里建立线程池之后不是 fork 安全的，
+    worker 首次编码可能死锁；dummy encode 和检索留给 worker 的 encoder / vector_store 阶段。
+    加载失败时 worker 在后台预热中重试。
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            get_engine()
+            return True
+        except Exception as e:
+            print(f"⚠️ 预加载失败（第 {attempt} 次）: {e}")
+            if attempt < attempts:
+                time.sleep(retry_interval * 2 ** (attempt - 1))
+    return False
+
+
+def start_background_warmup(state: WarmupState, get_engine, client, **kwargs) -> threading.Thread:
+    """在后台线程中预热，服务可立即接受 /healthz 探测"""
+    thread = threading.Thread(
+        target=run_warmup,
+        args=(state, get_engine, client),
+        kwargs=kwargs,
+        name="warmup",
+        daemon=True
+    )
+    thread.start()
+    return thread
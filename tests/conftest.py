@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# sales_assistant 下的模块按同目录方式互相导入（from mmr import ...）
+sys.path.insert(0, str(Path(__file__).parent.parent / "sales_assistant"))
@@ -0,0 +1,30 @@
+import sys
+import types
+
+from bulk_encoder import _pin_threads
+
+
+def stub_torch(monkeypatch, interop_error=False):
+    calls = {}
+
+    def set_num_interop_threads(n):
+        if interop_error:
+            raise RuntimeError("Error: cannot set number of interop threads after parallel work has started")
+        calls["interop"] = n
+
+    torch = types.SimpleNamespace(set_num_threads=lambda n: calls.__setitem__("intra", n),
+                                  set_num_interop_threads=set_num_interop_threads)
+    monkeypatch.setitem(sys.modules, "torch", torch)
+    return calls
+
+
+def test_pin_threads_uses_torch_api(monkeypatch):
+    calls = stub_torch(monkeypatch)
+    _pin_threads(3)
+    assert calls == {"intra": 3, "interop": 3}
+
+
+def test_pin_threads_after_parallel_work(monkeypatch):
+    calls = stub_torch(monkeypatch, interop_error=True)
+    _pin_threads(2)
+    assert calls == {"intra": 2}
@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("chromadb")
+from vector_store import open_chroma_client  # noqa: E402
+
+# 模拟 import_data.py --incremental：另一个进程在同一路径上删除 / 新增文档
+INCREMENTAL_UPDATE = """
+import sys
+import chromadb
+collection = chromadb.PersistentClient(path=sys.argv[1]).get_collection("coll")
+collection.delete(ids=["a"])
+collection.upsert(ids=["d"], embeddings=[[1.0, 0.01]], documents=["d"])
+"""
+
+
+def query_ids(collection):
+    return collection.query(query_embeddings=[[1.0, 0.0]], n_results=collection.count())["ids"][0]
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    monkeypatch.setenv("ANONYMIZED_TELEMETRY", "False")
+    collection = open_chroma_client(tmp_path, fresh=True).create_collection("coll")
+    collection.add(ids=["a", "b", "c"], embeddings=[[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]],
+                   documents=["a", "b", "c"])
+    subprocess.run([sys.executable, "-c", INCREMENTAL_UPDATE, str(tmp_path)], check=True, env=dict(os.environ))
+    return tmp_path
+
+
+def test_fresh_client_sees_other_process_writes(db_path):
+    collection = open_chroma_client(db_path, fresh=True).get_collection("coll")
+    ids = query_ids(collection)
+    assert "a" not in ids
+    assert ids[0] == "d"
+
+
+def test_cached_client_is_stale(db_path):
+    """不丢弃缓存时拿到的是进程内的旧段（EngineReloader 必须用 fresh=True 的原因）"""
+    collection = open_chroma_client(db_path).get_collection("coll")
+    assert "a" in query_ids(collection)
+
+
+def test_old_client_still_usable_after_fresh(db_path):
+    old = open_chroma_client(db_path).get_collection("coll")
+    open_chroma_client(db_path, fresh=True).get_collection("coll")
+    assert len(query_ids(old)) == 3
@@ -0,0 +1,97 @@
+import time
+
+import numpy as np
+
+from collection_versions import (EngineReloader, bump_generation, gc_versions, replace_atomically,
+                                 resolve_version, switch_alias)
+
+
+def test_replace_keeps_mapped_readers_valid(tmp_path):
+    path = tmp_path / "embeddings.npy"
+    np.save(path, np.arange(4, dtype=np.float32))
+    mapped = np.load(path, mmap_mode="r")
+
+    with replace_atomically(path) as tmp:
+        rewritten = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=(8,))
+        rewritten[:] = 7
+        rewritten.flush()
+        del rewritten
+
+    assert mapped.tolist() == [0, 1, 2, 3]
+    assert np.load(path).tolist() == [7] * 8
+    assert [p.name for p in tmp_path.iterdir()] == ["embeddings.npy"]
+
+
+def test_failed_write_leaves_original(tmp_path):
+    path = tmp_path / "sparse_index.json"
+    path.write_text("old")
+    try:
+        with replace_atomically(path) as tmp:
+            tmp.write_text("half")
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert path.read_text() == "old"
+    assert [p.name for p in tmp_path.iterdir()] == ["sparse_index.json"]
+
+
+def test_generation(tmp_path):
+    assert resolve_version(tmp_path, "dialogues") == ("dialogues", 0)
+    assert bump_generation(tmp_path, "dialogues") == 1
+    assert resolve_version(tmp_path, "dialogues") == ("dialogues", 1)
+    switch_alias(tmp_path, "dialogues", "dialogues__v20261017T101500123")
+    assert resolve_version(tmp_path, "dialogues") == ("dialogues__v20261017T101500123", 2)
+
+
+class FakeClient:
+    def __init__(self, names):
+        self.names = list(names)
+
+    def list_collections(self):
+        return [type("Collection", (), {"name": n})() for n in self.names]
+
+    def delete_collection(self, name):
+        self.names.remove(name)
+
+
+def test_gc_keeps_protected_and_recent(tmp_path):
+    versions = [f"dialogues__v2026101{i}T101500123" for i in range(5)]
+    for version in versions[:3]:
+        switch_alias(tmp_path, "dialogues", version)
+    # versions[3] 校验失败没有上线，versions[4] 正在导入（有检查点）
+    client = FakeClient(versions)
+    (tmp_path / versions[0]).mkdir()
+    removed = gc_versions(client, tmp_path, "dialogues", keep=2, protect=[versions[4]],
+                          derived_paths=lambda v: [tmp_path / v])
+    assert removed == [versions[0], versions[3]]
+    assert client.names == [versions[1], versions[2], versions[4]]
+    assert not (tmp_path / versions[0]).exists()
+
+
+class FakeEngine:
+    collection_alias = "dialogues"
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.collection_name, self.collection_generation = resolve_version(db_path, "dialogues")
+
+    def resolve_version(self):
+        return resolve_version(self.db_path, self.collection_alias)
+
+    def reload(self):
+        return FakeEngine(self.db_path)
+
+
+def test_reloader_fires_on_generation_bump(tmp_path):
+    swapped = []
+    reloader = EngineReloader(swapped.append, interval=0)
+    engine = FakeEngine(tmp_path)
+    reloader.maybe_reload(engine)
+    assert not swapped
+
+    bump_generation(tmp_path, "dialogues")
+    reloader.maybe_reload(engine)
+    deadline = time.monotonic() + 5
+    while not swapped and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [(e.collection_name, e.collection_generation) for e in swapped] == [("dialogues", 1)]
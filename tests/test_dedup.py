@@ -0,0 +1,54 @@
+import pytest
+
+from dedup import cluster_near_duplicates, collapse_near_duplicates, near_duplicate_representatives, normalize_for_dedup
+
+TEMPLATE = "亲，{price}真的是我们的底价了，but看在长期合作的份上，我可以给您{offer}，这已经是best offer了"
+
+
+def meta(product, role="seller", round_=2):
+    return {"product": product, "role": role, "round": round_}
+
+
+def test_normalize_masks_numbers_and_products():
+    assert normalize_for_dedup("加湿器 $39.48/pc", ["加湿器"]) == "@ #/pc"
+    assert normalize_for_dedup("ＭＯＱ 1,000") == "moq #"
+
+
+def test_near_duplicates_collapse():
+    texts = [normalize_for_dedup(TEMPLATE.format(price=f"${p}.48", offer=f"${p - 3}.02")) for p in (39, 48, 57)]
+    texts.append(normalize_for_dedup("你好，想问下这个产品支持OEM定制吗？起订量是多少？"))
+    assert cluster_near_duplicates(texts) == [0, 0, 0, 3]
+
+
+def test_distinct_texts_stay_separate():
+    texts = ["请问发货时间大概多久", "这个价格可以再便宜一点吗", "有没有CE和FCC认证"]
+    assert cluster_near_duplicates(texts) == [0, 1, 2]
+
+
+def test_representative_is_first_and_counts_cluster():
+    docs = [TEMPLATE.format(price=f"${p}.48", offer=f"${p - 3}.02") for p in (39, 48)] + ["完全不同的一句话"]
+    documents, metadatas, ids = collapse_near_duplicates(docs, [meta("加湿器")] * 3, ["a", "b", "c"])
+    assert ids == ["a", "c"]
+    assert [m["cluster_size"] for m in metadatas] == [2, 1]
+    assert documents[0] == docs[0]
+
+
+def test_product_scope_does_not_merge_across_products():
+    records = [
+        (f"加湿器{TEMPLATE.format(price='$39.48', offer='$36.63')}", meta("加湿器"), "a"),
+        (f"净化器{TEMPLATE.format(price='$48.74', offer='$45.02')}", meta("净化器"), "b"),
+    ]
+    assert near_duplicate_representatives(records, scope="product") == {"a": 1, "b": 1}
+    merged = near_duplicate_representatives(records, scope="global", products=["加湿器", "净化器"])
+    assert merged == {"a": 2}
+
+
+def test_product_scope_separates_roles():
+    doc = TEMPLATE.format(price="$39.48", offer="$36.63")
+    records = [(doc, meta("加湿器", role="seller"), "a"), (doc, meta("加湿器", role="buyer"), "b")]
+    assert near_duplicate_representatives(records) == {"a": 1, "b": 1}
+
+
+def test_unknown_scope():
+    with pytest.raises(ValueError):
+        near_duplicate_representatives([], scope="dialogue")
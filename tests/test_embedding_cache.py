@@ -0,0 +1,67 @@
+import numpy as np
+
+from embedding_cache import CachedEncoder, EmbeddingCache
+
+
+def vec(i, dim=4):
+    return np.full(dim, i, dtype=np.float32)
+
+
+def test_roundtrip_and_eviction(tmp_path):
+    cache = EmbeddingCache("m", str(tmp_path), max_entries=4, evict_fraction=0.5)
+    cache.put_many([f"t{i}" for i in range(4)], np.stack([vec(i) for i in range(4)]))
+    assert [r[0] for r in cache.get_many(["t0", "t1", "t2", "t3"])] == [0, 1, 2, 3]
+
+    cache.put_many(["t4"], np.stack([vec(4)]))
+    results = cache.get_many([f"t{i}" for i in range(5)])
+    assert results[4][0] == 4
+    # 被淘汰的键未命中，留下的键仍是自己的向量
+    assert all(r is None or r[0] == i for i, r in enumerate(results))
+    assert sum(r is None for r in results) == 2
+
+
+def test_read_does_not_return_reused_slot(tmp_path, monkeypatch):
+    cache = EmbeddingCache("m", str(tmp_path), max_entries=2, evict_fraction=1.0)
+    cache.put_many(["a", "b"], np.stack([vec(1), vec(2)]))
+
+    # 读者查完索引、复制向量之前，另一个写者淘汰了 a 并复用了它的行
+    lookup = EmbeddingCache._lookup
+    calls = []
+
+    def racing_lookup(db, keys):
+        found = lookup(db, keys)
+        if not calls:
+            calls.append(1)
+            other = EmbeddingCache("m", str(tmp_path), max_entries=2, evict_fraction=1.0)
+            other.put_many(["c", "d"], np.stack([vec(3), vec(4)]))
+        return found
+
+    monkeypatch.setattr(EmbeddingCache, "_lookup", staticmethod(racing_lookup))
+    assert cache.get_many(["a", "b"]) == [None, None]
+
+
+def test_counters_are_batched(tmp_path):
+    cache = EmbeddingCache("m", str(tmp_path))
+    cache.put_many(["a"], np.stack([vec(1)]))
+    cache.get_many(["a", "b"])
+    other = EmbeddingCache("m", str(tmp_path))
+    assert other.stats()["hits"] == 0
+    cache.flush()
+    stats = other.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_cached_encoder_encodes_misses_once(tmp_path):
+    class Encoder:
+        def __init__(self):
+            self.calls = []
+
+        def encode(self, texts, show_progress_bar=False, **kwargs):
+            self.calls.append(list(texts))
+            return np.stack([vec(len(t)) for t in texts])
+
+    encoder = CachedEncoder(Encoder(), EmbeddingCache("m", str(tmp_path)), flush_on_put=True)
+    first = encoder.encode(["aa", "bbb", "aa"])
+    second = encoder.encode(["aa", "c"])
+    assert encoder.encoder.calls == [["aa", "bbb"], ["c"]]
+    assert first[:, 0].tolist() == [2, 3, 2] and second[:, 0].tolist() == [2, 1]
@@ -0,0 +1,191 @@
+import threading
+import time
+
+import pytest
+
+from llm_client import DualModelClient
+
+
+def make_client(monkeypatch, delays, **kwargs):
+    client = DualModelClient(**kwargs)
+
+    def fake_call(model, system_prompt, user_message):
+        time.sleep(delays[model])
+        return model, delays[model] * 1000
+
+    monkeypatch.setattr(client, "_timed_call", fake_call)
+    return client
+
+
+def test_queue_time_does_not_count_against_timeout(monkeypatch):
+    # 单线程池：第二个分支排队 0.2s，但自身只跑 0.2s，不应超时
+    client = make_client(monkeypatch, {"qwen2.5": 0.2, "sales-assistant": 0.2}, max_workers=1, timeout=0.3)
+    analysis, sales_reply, _ = client._run_branches("a", "s", "m")
+    assert (analysis, sales_reply) == ("qwen2.5", "sales-assistant")
+    client.close()
+
+
+def test_slow_branch_times_out(monkeypatch):
+    client = make_client(monkeypatch, {"qwen2.5": 0.05, "sales-assistant": 1.0}, max_workers=2, timeout=0.2)
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        client._run_branches("a", "s", "m")
+    assert time.monotonic() - start < 0.6
+    client.close()
+
+
+class FakeStreamResponse:
+    """先吐一行 token，之后阻塞到被 close()"""
+
+    status_code = 200
+
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.closed.set()
+
+    def iter_lines(self):
+        yield b'{"message": {"content": "hi"}, "done": false}'
+        self.closed.wait(5)
+        raise ConnectionError("closed")
+
+
+def test_stream_does_not_use_shared_executor_and_closes_on_exit(monkeypatch):
+    client = DualModelClient(max_workers=1)
+    responses = []
+
+    def fake_post(path, payload, stream=False):
+        responses.append(FakeStreamResponse())
+        return responses[-1]
+
+    monkeypatch.setattr(client.transport, "post", fake_post)
+    stream = client.generate_stream("", "太贵了")
+    assert next(stream) == ("product", "通用产品")
+    assert next(stream)[1] == "hi"
+    # 流式生成期间共享线程池仍然空闲
+    assert client._executor.submit(lambda: 1).result(timeout=1) == 1
+
+    stream.close()
+    deadline = time.monotonic() + 2
+    while len(responses) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert all(r.closed.wait(1) for r in responses)
+    client.close()
+
+
+def test_cancelled_stream_does_not_post(monkeypatch):
+    client = DualModelClient()
+    posted = []
+    monkeypatch.setattr(client.transport, "post", lambda *a, **k: posted.append(a))
+    cancel = threading.Event()
+    cancel.set()
+    assert list(client._stream_model("m", "", "x", cancel)) == []
+    assert posted == []
+    client.close()
+
+
+def test_body_read_reset_is_retried(monkeypatch):
+    import requests
+
+    from llm_client import OllamaTransport
+
+    transport = OllamaTransport("http://ollama", backoff=0)
+    calls = []
+
+    def flaky_post(url, json, stream, timeout):
+        calls.append(stream)
+        if len(calls) == 1:
+            raise requests.exceptions.ChunkedEncodingError("connection reset")
+        return type("Response", (), {"status_code": 200})()
+
+    monkeypatch.setattr(transport.session, "post", flaky_post)
+    assert transport.post("/api/chat", {}).status_code == 200
+    assert transport.retries == 1
+
+
+def test_async_body_read_reset_is_retried():
+    import asyncio
+
+    import httpx
+
+    from async_llm_client import AsyncDualModelClient
+
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            raise httpx.ReadError("connection reset")
+        return httpx.Response(200, json={"message": {"content": "ok"}})
+
+    async def run():
+        client = AsyncDualModelClient("http://ollama", backoff=0)
+        client._client = httpx.AsyncClient(base_url="http://ollama", transport=httpx.MockTransport(handler))
+        try:
+            return await client._call_model("m", "", "x")
+        finally:
+            await client._client.aclose()
+
+    assert asyncio.run(run()) == "ok"
+    assert len(calls) == 2
+
+
+def test_async_pool_stats_count_reuse():
+    import asyncio
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from async_llm_client import AsyncDualModelClient
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            body = json.dumps({"message": {"content": "ok"}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    async def run():
+        client = AsyncDualModelClient(f"http://127.0.0.1:{server.server_port}")
+        try:
+            for _ in range(3):
+                await client._call_model("m", "", "x")
+            return client.stats()
+        finally:
+            await client.aclose()
+
+    try:
+        stats = asyncio.run(run())
+    finally:
+        server.shutdown()
+    assert (stats["requests"], stats["connections_created"], stats["connections_reused"]) == (3, 1, 2)
+
+
+def test_cancel_stops_waiting_for_branches(monkeypatch):
+    from concurrent.futures import CancelledError
+
+    client = make_client(monkeypatch, {"qwen2.5": 1.0, "sales-assistant": 1.0}, max_workers=1, timeout=5)
+    cancel = threading.Event()
+    threading.Timer(0.1, cancel.set).start()
+    start = time.monotonic()
+    with pytest.raises(CancelledError):
+        client._run_branches("a", "s", "m", cancel)
+    assert time.monotonic() - start < 0.6
+    client.close()
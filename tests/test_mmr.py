@@ -0,0 +1,32 @@
+import numpy as np
+
+from mmr import mmr_select
+
+
+def test_lambda_one_is_pure_relevance_order():
+    rng = np.random.default_rng(0)
+    relevance = rng.random(10)
+    embeddings = rng.normal(size=(10, 8))
+    assert mmr_select(relevance, embeddings, k=5, lambda_=1.0) == list(np.argsort(-relevance)[:5])
+
+
+def test_duplicate_vectors_are_skipped():
+    # 0、1、2 是同一向量的副本，相关度最高；3、4 是其他方向
+    base = np.array([1.0, 0.0, 0.0])
+    embeddings = np.stack([base, base, base * 2, [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]])
+    relevance = np.array([0.9, 0.89, 0.88, 0.7, 0.6])
+    assert mmr_select(relevance, embeddings, k=3, lambda_=0.5) == [0, 3, 4]
+    # 只看相关度时副本全部入选
+    assert mmr_select(relevance, embeddings, k=3, lambda_=1.0) == [0, 1, 2]
+
+
+def test_k_larger_than_candidates_and_empty():
+    embeddings = np.eye(3)
+    assert sorted(mmr_select([0.3, 0.2, 0.1], embeddings, k=10)) == [0, 1, 2]
+    assert mmr_select([], np.empty((0, 3)), k=3) == []
+    assert mmr_select([0.3], np.eye(1), k=0) == []
+
+
+def test_zero_vectors_do_not_break_normalization():
+    embeddings = np.array([[0.0, 0.0], [1.0, 0.0]])
+    assert mmr_select([0.5, 0.4], embeddings, k=2) == [0, 1]
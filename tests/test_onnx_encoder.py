@@ -0,0 +1,41 @@
+import json
+import sys
+import types
+
+import pytest
+
+import onnx_encoder
+
+
+class StubPooling:
+    def __init__(self, mode):
+        self.mode = mode
+
+    def get_pooling_mode_str(self):
+        return self.mode
+
+
+def stub_sentence_transformers(monkeypatch, mode):
+    class SentenceTransformer(list):
+        def __init__(self, model_name, device=None):
+            super().__init__([object(), StubPooling(mode)])
+
+    monkeypatch.setitem(sys.modules, "torch", types.ModuleType("torch"))
+    monkeypatch.setitem(sys.modules, "sentence_transformers",
+                        types.SimpleNamespace(SentenceTransformer=SentenceTransformer))
+
+
+@pytest.mark.parametrize("mode", ["max", "lasttoken", "weightedmean", "cls+mean"])
+def test_export_rejects_unsupported_pooling(monkeypatch, tmp_path, mode):
+    stub_sentence_transformers(monkeypatch, mode)
+    with pytest.raises(ValueError, match=mode.replace("+", r"\+")):
+        onnx_encoder.export_onnx("stub/model", str(tmp_path / "out"))
+    assert not (tmp_path / "out").exists()
+
+
+def test_encoder_rejects_unsupported_pooling_config(monkeypatch, tmp_path):
+    monkeypatch.setitem(sys.modules, "transformers",
+                        types.SimpleNamespace(AutoTokenizer=types.SimpleNamespace(from_pretrained=lambda path: None)))
+    (tmp_path / onnx_encoder.CONFIG_FILE).write_text(json.dumps({"pooling": "max"}))
+    with pytest.raises(ValueError):
+        onnx_encoder.OnnxEncoder(str(tmp_path))
@@ -0,0 +1,30 @@
+from product_detector import ProductDetector
+
+
+def test_nested_names_take_longest():
+    detector = ProductDetector(["耳机", "蓝牙耳机"])
+    assert detector.detect("想买蓝牙耳机") == ["蓝牙耳机"]
+    assert detector.detect("耳机和蓝牙耳机都要") == ["耳机", "蓝牙耳机"]
+
+
+def test_prefix_names_take_longest():
+    detector = ProductDetector(["空气", "空气净化器"])
+    assert detector.detect("空气净化器多少钱") == ["空气净化器"]
+
+
+def test_overlapping_names_take_leftmost():
+    detector = ProductDetector(["智能手表", "手表带"])
+    assert detector.detect("智能手表带") == ["智能手表"]
+    assert detector.detect("手表带和智能手表") == ["手表带", "智能手表"]
+
+
+def test_match_through_failure_link():
+    # "蓝牙" 走到一半失配，要经失败指针接上 "牙刷"
+    detector = ProductDetector(["蓝牙音箱", "牙刷"])
+    assert detector.detect("蓝牙刷") == ["牙刷"]
+
+
+def test_dedup_in_order_and_normalized():
+    detector = ProductDetector(["iPhone 壳", "加湿器", ""])
+    assert detector.detect("IPHONE 壳 加湿器 ｉｐｈｏｎｅ 壳") == ["iPhone 壳", "加湿器"]
+    assert detector.detect("没有产品") == []
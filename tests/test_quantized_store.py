@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from vector_store import NumpyStore, QuantizedStore
+
+
+@pytest.fixture(scope="module")
+def index(tmp_path_factory):
+    """带簇结构的随机向量（接近真实 embedding 的分布），查询为带噪声的文档向量"""
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(20, 64))
+    vectors = centers[rng.integers(0, 20, 2000)] + rng.normal(scale=0.5, size=(2000, 64))
+    path = tmp_path_factory.mktemp("numpy_index")
+    ids = [f"d{i}" for i in range(len(vectors))]
+    NumpyStore.write(str(path), ids, ids, [{"product": "p"} for _ in ids], vectors)
+    QuantizedStore.quantize(str(path))
+    queries = vectors[rng.choice(len(vectors), 50, replace=False)] + rng.normal(scale=0.1, size=(50, 64))
+    return str(path), queries
+
+
+def recall_at_k(store, exact, queries, k):
+    truth = [{item["id"] for item in items} for items in exact.query(queries, k)]
+    found = [{item["id"] for item in items} for items in store.query(queries, k)]
+    return np.mean([len(t & f) / k for t, f in zip(truth, found)])
+
+
+@pytest.mark.parametrize("quantization, rescore_multiplier, min_recall", [
+    ("int8", 4, 0.95),
+    ("binary", 10, 0.8),
+])
+def test_recall_against_exact_search(index, quantization, rescore_multiplier, min_recall):
+    path, queries = index
+    exact = NumpyStore(path)
+    store = QuantizedStore(path, quantization, rescore_multiplier=rescore_multiplier)
+    assert recall_at_k(store, exact, queries, k=10) >= min_recall
+
+
+def test_rescored_distances_are_full_precision(index):
+    path, queries = index
+    exact = NumpyStore(path)
+    store = QuantizedStore(path, "int8")
+    expected = {item["id"]: item["distance"] for item in exact.query(queries[:1], 50)[0]}
+    for item in store.query(queries[:1], 10)[0]:
+        assert item["distance"] == pytest.approx(expected[item["id"]], abs=1e-5)
+
+
+def test_unknown_quantization(index):
+    with pytest.raises(ValueError):
+        QuantizedStore(index[0], "int4")
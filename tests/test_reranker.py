@@ -0,0 +1,71 @@
+import sys
+import types
+
+import pytest
+
+
+class StubCrossEncoder:
+    """分数 = 文档里的数字（"内容:37" -> 37），记录每次打分的对数"""
+
+    def __init__(self, model_name, max_length=512):
+        self.calls = []
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=False):
+        self.calls.append(len(pairs))
+        return [float(doc) for _, doc in pairs]
+
+
+@pytest.fixture
+def reranker(monkeypatch):
+    monkeypatch.setitem(sys.modules, "sentence_transformers",
+                        types.SimpleNamespace(CrossEncoder=StubCrossEncoder))
+    from reranker import CrossEncoderReranker
+    return CrossEncoderReranker("stub")
+
+
+def candidates(n):
+    # 一阶段排名与重排分数相反：越靠后的候选分数越高
+    return [{"id": f"d{i}", "document": f"内容:{i}", "metadata": {}} for i in range(n)]
+
+
+def test_reranks_by_score(reranker):
+    results, stats = reranker.rerank("太贵了", candidates(10), k=3)
+    assert [item["id"] for item in results] == ["d9", "d8", "d7"]
+    assert stats["rerank_pairs"] == 10 and stats["rerank_truncated"] == 0
+
+
+def test_over_budget_candidates_are_demoted_not_dropped(reranker):
+    reranker._ms_per_pair = 5.0  # 15 ms 预算只够打 3 对
+    results, stats = reranker.rerank("太贵了", candidates(50), k=5, budget_ms=15)
+
+    assert len(results) == 5
+    assert stats["rerank_pairs"] == 3 and stats["rerank_truncated"] == 47
+    # 已打分的按分数排在前面，未打分的按一阶段顺序接在后面
+    assert [item["id"] for item in results] == ["d2", "d1", "d0", "d3", "d4"]
+    assert [item["rerank_score"] for item in results[3:]] == [None, None]
+
+
+def test_cache_hits_skip_scoring_and_budget(reranker):
+    reranker.rerank("太贵了", candidates(10), k=3)
+    reranker._ms_per_pair = 5.0
+    results, stats = reranker.rerank("太贵了 ", candidates(10), k=3, budget_ms=5)
+
+    assert stats["rerank_cache_hits"] == 10 and stats["rerank_pairs"] == 0
+    assert [item["id"] for item in results] == ["d9", "d8", "d7"]
+    assert reranker.model.calls == [10]
+
+
+def test_batch_shares_budget_round_robin(reranker):
+    reranker._ms_per_pair = 1.0
+    results, stats = reranker.rerank_many(["a", "b"], [candidates(5), candidates(5)], k=5, budget_ms=4)
+    assert stats["rerank_pairs"] == 4
+    assert all(len(items) == 5 for items in results)
+    assert [item["id"] for item in results[0][:2]] == ["d1", "d0"]
+
+
+def test_cache_misses_when_content_changes(reranker):
+    reranker.rerank("q", candidates(3), k=3)
+    changed = [dict(item, document=f"内容:{9 - i}") for i, item in enumerate(candidates(3))]
+    results, stats = reranker.rerank("q", changed, k=3)
+    assert stats["rerank_cache_hits"] == 0
+    assert [r["rerank_score"] for r in results] == [9.0, 8.0, 7.0]
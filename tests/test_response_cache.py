@@ -0,0 +1,23 @@
+import sqlite3
+
+from response_cache import ResponseCache
+
+
+def disk_rows(path):
+    with sqlite3.connect(path) as db:
+        return db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+def test_disk_is_pruned_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(ResponseCache, "PRUNE_EVERY", 10)
+    path = str(tmp_path / "cache.db")
+    cache = ResponseCache(max_size=2, db_path=path, disk_max_size=5)
+    for i in range(9):
+        cache.set(f"k{i}", {"reply": i})
+    assert disk_rows(path) == 9
+
+    cache.set("k9", {"reply": 9})
+    assert disk_rows(path) == 5
+    # 最新的条目留在磁盘层，内存层淘汰后仍能命中
+    assert cache.get("k5") == {"reply": 5}
+    assert cache.get("k0") is None
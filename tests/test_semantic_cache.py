@@ -0,0 +1,54 @@
+import numpy as np
+
+from response_cache import ReplyCache, ResponseCache, document_keys
+from semantic_cache import SemanticCache
+
+MODELS = ["BAAI/bge-m3", "analyst", "sales"]
+
+
+def make_cache():
+    return ReplyCache(ResponseCache(), SemanticCache(threshold=0.9))
+
+
+def test_semantic_hit_requires_same_products():
+    cache = make_cache()
+    embedding = np.array([1.0, 0.0, 0.0])
+    key, _, _ = cache.lookup("耳机太贵了", ["a"], MODELS, embedding, ["耳机"])
+    cache.store(key, embedding, {"reply": "耳机回复"}, MODELS, ["耳机"])
+
+    _, cached, info = cache.lookup("充电宝太贵了", ["b"], MODELS, embedding, ["充电宝"])
+    assert cached is None and not info["hit"]
+
+    _, cached, info = cache.lookup("耳机好贵", ["b"], MODELS, embedding, ["耳机"])
+    assert cached == {"reply": "耳机回复"} and info["type"] == "semantic"
+
+
+def test_semantic_hit_requires_same_models():
+    cache = make_cache()
+    embedding = np.array([1.0, 0.0, 0.0])
+    key, _, _ = cache.lookup("太贵了", ["a"], MODELS, embedding)
+    cache.store(key, embedding, {"reply": "旧模型"}, MODELS)
+
+    _, cached, _ = cache.lookup("太贵了吧", ["a"], MODELS[:2] + ["sales-v2"], embedding)
+    assert cached is None
+
+
+def test_dimension_change_is_a_miss():
+    cache = SemanticCache(threshold=0.9)
+    cache.add(np.ones(4), {"reply": "x"}, "m3")
+    assert cache.lookup(np.ones(8), "small") == (None, 0.0)
+
+    cache.add(np.ones(8), {"reply": "y"}, "small")
+    value, _ = cache.lookup(np.ones(8), "small")
+    assert value == {"reply": "y"}
+
+
+def test_exact_key_changes_with_content():
+    item = {"id": "doc_1_2_buyer", "document": "旧正文", "metadata": {"content_hash": "aaaa"}}
+    changed = dict(item, document="新正文", metadata={"content_hash": "bbbb"})
+    parent = {"id": "conv_1", "document": "整段对话", "metadata": {}}
+
+    assert document_keys([item]) == ["doc_1_2_buyer@aaaa"]
+    assert document_keys([parent])[0].startswith("conv_1@")
+    assert (ResponseCache.make_key("太贵了", document_keys([item]), MODELS)
+            != ResponseCache.make_key("太贵了", document_keys([changed]), MODELS))
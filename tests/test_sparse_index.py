@@ -0,0 +1,62 @@
+import pytest
+
+from sparse_index import BM25Index, reciprocal_rank_fusion, tokenize
+
+
+def test_tokenize_mixed_cjk_and_latin():
+    tokens = tokenize("价格太贵 MOQ 500，CE/FCC认证 $3.50/pc")
+    # 中文按字 bigram（被英文隔开的各段分别切分），单字段保留原字
+    assert {"价格", "格太", "太贵", "认证"} <= set(tokens)
+    # 英文小写；复合词保留整体和各部分
+    assert {"moq", "500", "ce/fcc", "ce", "fcc", "$3.50/pc", "$3.50", "pc"} <= set(tokens)
+    assert "贵m" not in "".join(tokens)
+    assert tokenize("好") == ["好"]
+
+
+def test_tokenize_normalizes_fullwidth():
+    assert tokenize("ＭＯＱ") == ["moq"]
+
+
+def build():
+    return BM25Index.build(
+        ["d0", "d1", "d2"],
+        ["加湿器 MOQ 500 价格", "空气净化器 MOQ 1000", "加湿器 包邮"],
+        products=["加湿器", "空气净化器", "加湿器"],
+    )
+
+
+def test_search_ranks_exact_terms():
+    index = build()
+    assert [doc_id for doc_id, _ in index.search("MOQ 500")][0] == "d0"
+    assert index.search("完全无关") == []
+
+
+def test_product_filter():
+    index = build()
+    assert {doc_id for doc_id, _ in index.search("MOQ", products=["空气净化器"])} == {"d1"}
+    assert {doc_id for doc_id, _ in index.search("MOQ")} == {"d0", "d1"}
+
+
+def test_save_and_load_roundtrip(tmp_path):
+    index = build()
+    path = tmp_path / "sparse_index.json"
+    index.save(str(path))
+    loaded = BM25Index.load(str(path))
+    expected = index.search("加湿器", products=["加湿器"])
+    actual = loaded.search("加湿器", products=["加湿器"])
+    # 权重保存时保留 5 位小数
+    assert [doc_id for doc_id, _ in actual] == [doc_id for doc_id, _ in expected]
+    assert [score for _, score in actual] == pytest.approx([score for _, score in expected], abs=1e-4)
+
+
+def test_rrf_ordering():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "c", "d"]], k=60)
+    assert [doc_id for doc_id, _ in fused] == ["b", "c", "a", "d"]
+    assert fused[0][1] == 1 / 62 + 1 / 61
+
+
+def test_rrf_ties_keep_first_seen_order():
+    # a 和 x 都只在各自一路排第 1，分数相同，按首次出现的顺序
+    fused = reciprocal_rank_fusion([["a"], ["x"]])
+    assert [doc_id for doc_id, _ in fused] == ["a", "x"]
+    assert fused[0][1] == fused[1][1]
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("sentence_transformers")
+from import_data import validate_collection  # noqa: E402
+
+
+class FakeCollection:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def count(self):
+        return len(self.documents)
+
+    def query(self, query_embeddings, n_results):
+        return {"documents": [self.documents[:n_results]]}
+
+
+class FakeEncoder:
+    def encode(self, texts):
+        return np.zeros((len(texts), 4), dtype=np.float32)
+
+
+def test_empty_import_fails():
+    problems, documents = validate_collection(FakeCollection([]), 0, FakeEncoder())
+    assert problems and documents == []
+
+
+def test_count_mismatch_fails():
+    problems, _ = validate_collection(FakeCollection(["a", "b"]), 3, FakeEncoder())
+    assert len(problems) == 1
+
+
+def test_valid_collection_passes():
+    problems, documents = validate_collection(FakeCollection(["a", "b"]), 2, FakeEncoder())
+    assert problems == [] and documents == ["a", "b"]
@@ -0,0 +1,64 @@
+from warmup import WarmupState, preload_engine, run_warmup
+
+
+class FakeEngine:
+    class model:
+        @staticmethod
+        def encode(texts):
+            return [[0.0] for _ in texts]
+
+    def search(self, *args, **kwargs):
+        return []
+
+
+class FlakyClient:
+    """前 failures 次预热失败（模拟 Ollama 晚于服务启动）"""
+    analyst_model = "analyst"
+    sales_model = "sales"
+
+    def __init__(self, failures: int):
+        self.failures = failures
+
+    def warm_model(self, model):
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError("ollama not ready")
+
+
+def test_local_stages_only():
+    state = WarmupState()
+    run_warmup(state, FakeEngine, None, stages=list(WarmupState.LOCAL_STAGES), attempts=1)
+    assert state.pending() == ["analyst_model", "sales_model"]
+
+
+def test_failed_stage_is_retried_not_marked_failed():
+    state = WarmupState()
+    run_warmup(state, FakeEngine, FlakyClient(failures=1), attempts=1)
+    assert state.snapshot()["analyst_model"]["status"] == "retrying"
+    assert not state.ready()
+
+    # 之后的预热只跑未就绪的阶段，恢复后整体就绪
+    run_warmup(state, FakeEngine, FlakyClient(failures=2), retry_interval=0.01)
+    assert state.ready()
+    assert state.snapshot()["analyst_model"]["attempts"] == 3
+
+
+def test_preload_only_loads_and_leaves_stages_to_workers():
+    loads = []
+
+    class NoComputeEngine:
+        class model:
+            @staticmethod
+            def encode(texts):
+                raise AssertionError("master 中不能编码")
+
+    def get_engine():
+        loads.append(1)
+        if len(loads) == 1:
+            raise OSError("chroma_db 暂时不可读")
+        return NoComputeEngine()
+
+    state = WarmupState()
+    assert preload_engine(get_engine, attempts=2, retry_interval=0.01)
+    assert len(loads) == 2
+    assert state.pending() == list(WarmupState.STAGES)